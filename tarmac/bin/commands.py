@@ -14,51 +14,127 @@
 # You should have received a copy of the GNU General Public License
 # along with Tarmac.  If not, see <http://www.gnu.org/licenses/>.
 '''Command handling for Tarmac.'''
+from contextlib import contextmanager
+from concurrent.futures import (
+    CancelledError,
+    Future,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    as_completed,
+    wait,
+)
 import httplib2
+import itertools
+import json
 import logging
+import multiprocessing
 import os
 import re
+import time
 
 from breezy.commands import Command
 from breezy.errors import LockContention
 from breezy.help import help_commands
 from breezy.workingtree import PointlessMerge
-from launchpadlib.launchpad import Launchpad
+from launchpadlib.credentials import AccessToken, Credentials
 from launchpadlib.uris import (
     LPNET_SERVICE_ROOT,
     STAGING_SERVICE_ROOT,
 )
 
 from tarmac.bin import options
+from tarmac.bin.registry import CommandRegistry
 from tarmac.branch import Branch
+from tarmac.config import BranchConfig, StackedConfig
 from tarmac.hooks import tarmac_hooks
+from tarmac.ordering import LandingGraph, landing_orders, proposal_owner
 from tarmac.log import set_up_debug_logging, set_up_logging
+from tarmac.lp import (
+    WRITE_THREADS,
+    CachedLaunchpad,
+    ProposalSnapshot,
+    TTLStore,
+    WriteQueue,
+    branch_unique_name,
+)
 from tarmac.exceptions import (
+    LaunchpadUnavailable,
+    PrerequisiteCycle,
     TarmacCommandError,
     TarmacMergeError,
     TarmacMergeSkipError,
     UnapprovedChanges,
 )
 from tarmac.plugin import load_plugins
+from tarmac.state import FAILED_OUTCOMES, LandingState
+from tarmac.traffic import TrafficRecorder, TrafficReplayer
+from tarmac.transport import (
+    LATENCY_BUCKETS,
+    WADL_TTL,
+    TarmacLaunchpad,
+    WadlCache,
+    get_http,
+    is_unavailable,
+)
 
-
-def sort_landing_candidates(proposals):
-    unique_names = {
-        p.source_branch.unique_name: (
-            p.prerequisite_branch.unique_name
-            if p.prerequisite_branch else None)
-        for p in proposals}
-
-    def key(p):
-        """Helper to sort proposals based on a prerequisite branch"""
-        c = 0
-        b = p.source_branch.unique_name
-        while unique_names.get(b) in unique_names:
-            c += 1
-            b = unique_names.get(b)
-        return c
-
-    return sorted(proposals, key=key)
+# Number of seconds `tarmac daemon` waits between polls, unless the
+# ``poll_interval`` setting says otherwise.
+POLL_INTERVAL = 60
+
+# Where the counts of the Launchpad API requests made by the last run are
+# written, in the cache directory.
+API_STATS_FILENAME = 'api-stats.json'
+
+# Number of threads fetching merge proposals from Launchpad ahead of the
+# checks, unless the ``prefetch_threads`` setting says otherwise.
+PREFETCH_THREADS = 8
+
+
+def sort_landing_candidates(proposals, order=None):
+    """Sort %proposals so that prerequisites come first.
+
+    Proposals that are equally deep in a chain of prerequisites are sorted
+    by the %order key function, if given.
+    """
+    return LandingGraph(proposals).sorted(order)
+
+
+def _merge_in_subprocess(branch_url, settings, dry_run):
+    """Merge the approved proposals for %branch_url in a worker process.
+
+    Every worker reads the configuration and sets up logging afresh, and
+    logs in to Launchpad with its own session.  Returns whether a proposal
+    was merged, and the summary of the API requests made.
+    """
+    command = cmd_merge(CommandRegistry())
+    command._set_up(**settings)
+    try:
+        with command.state.batch():
+            merged = command._do_merges(branch_url, dry_run=dry_run)
+    finally:
+        command._flush_writes()
+    http = get_http(command.launchpad)
+    return merged, [] if http is None else http.stats.summary()
+
+
+def _in_worker(function, *args):
+    """Call %function with %args, raising errors a parent process can load.
+
+    Errors of launchpadlib and breezy can be pickled, but many of them can't
+    be unpickled, which breaks the whole process pool.  Launchpad being
+    unavailable is raised as LaunchpadUnavailable, and errors other than
+    Tarmac's own as TarmacCommandError.
+    """
+    try:
+        return function(*args)
+    except (TarmacMergeError, TarmacMergeSkipError, TarmacCommandError,
+            LaunchpadUnavailable, LockContention):
+        raise
+    except Exception as error:
+        if is_unavailable(error):
+            raise LaunchpadUnavailable(str(error)) from None
+        raise TarmacCommandError(
+            '%s: %s' % (type(error).__name__, error)) from None
 
 
 class TarmacCommand(Command):
@@ -97,12 +173,34 @@ class TarmacCommand(Command):
     def run(self):
         '''Actually run the command.'''
 
-    def get_launchpad_object(self, filename=None, staging=False):
-        '''Return a Launchpad object for making API requests.'''
+    def get_launchpad_object(self, filename=None, staging=False,
+                             record=None, replay=None):
+        '''Return a Launchpad object for making API requests.
+
+        With %record, the API traffic is recorded in that directory; with
+        %replay, it is answered from the traffic recorded there, without
+        logging in.
+        '''
+        if record and replay:
+            raise TarmacCommandError(
+                'Traffic cannot be recorded while it is being replayed.')
+        if replay:
+            self.logger.debug(
+                "Replaying Launchpad API traffic from {0}".format(replay))
+            traffic = TrafficReplayer(replay)
+            return TarmacLaunchpad.using(traffic=traffic)(
+                Credentials(
+                    'Tarmac', access_token=AccessToken('replay', 'replay')),
+                None, None, service_root=traffic.service_root,
+                cache=os.path.join(self.config.CACHE_HOME, 'replay'),
+                version='devel')
+
         if not filename:
             filename = self.config.CREDENTIALS
 
-        if staging:
+        if self.config.SERVICE_ROOT:
+            SERVICE_ROOT = self.config.SERVICE_ROOT
+        elif staging:
             SERVICE_ROOT = STAGING_SERVICE_ROOT
         else:
             SERVICE_ROOT = LPNET_SERVICE_ROOT
@@ -116,7 +214,17 @@ class TarmacCommand(Command):
             self.logger.debug("  Fetching new credentials from {0}".format(
                 SERVICE_ROOT))
 
-        launchpad = Launchpad.login_with(
+        if record:
+            # The service description is recorded too, for replaying.
+            self.logger.debug(
+                "  Recording the API traffic in {0}".format(record))
+            launchpad_class = TarmacLaunchpad.using(
+                traffic=TrafficRecorder(record, service_root=SERVICE_ROOT))
+        else:
+            launchpad_class = TarmacLaunchpad.using(wadl_cache=WadlCache(
+                self.config.CACHE_HOME, ttl=int(self.config['Tarmac'].get(
+                    'wadl_ttl', WADL_TTL))))
+        launchpad = launchpad_class.login_with(
             'Tarmac', service_root=SERVICE_ROOT,
             version='devel',
             credentials_file=filename,
@@ -183,8 +291,47 @@ class cmd_merge(TarmacCommand):
         options.list_approved_option,
         options.proposal_option,
         options.dry_run_option,
+        options.jobs_option,
+        options.record_option,
+        options.replay_option,
     ]
 
+    # The LandingState of earlier runs, and the Launchpad API, once the
+    # command has been set up.
+    state = None
+    launchpad = None
+    writes = None
+    _target_revid = None
+    # The self_links of proposals whose prerequisites form a cycle.
+    _cyclic = frozenset()
+
+    def __init__(self, registry):
+        TarmacCommand.__init__(self, registry)
+        # The landing targets of prerequisite branches, for the current run.
+        self._prerequisite_cache = {}
+        self._round_trips_saved = 0
+
+    def _log_preparing(self, proposal):
+        """Log that landing %proposal starts, and note the time."""
+        self.logger.debug(
+            'Preparing to merge %(source_branch)s' % {
+                'source_branch': proposal.source_branch.web_link})
+        if self.state is not None:
+            self._started[proposal.self_link] = time.time()
+
+    def _record_outcome(self, proposal, outcome):
+        """Record %outcome for %proposal in the landing state."""
+        if self.state is None:
+            return
+        started = self._started.pop(proposal.self_link, None)
+        duration = None if started is None else time.time() - started
+        self.state.record(
+            proposal, outcome, target_revid=self._target_revid,
+            duration=duration)
+        if outcome == 'landed' or outcome in FAILED_OUTCOMES:
+            self.state.record_attempt(
+                proposal_owner(proposal), outcome, duration=duration)
+
     def _handle_merge_error(self, proposal, failure, dry_run):
         """Handle TarmacMergeError cases from _do_merges."""
         self.logger.warning(
@@ -192,6 +339,7 @@ class cmd_merge(TarmacCommand):
             {'source': proposal.source_branch.web_link,
              'target': proposal.target_branch.web_link,
              'msg': str(failure)})
+        self._record_outcome(proposal, failure.outcome)
 
         subject = 'Re: [Merge] %(source)s into %(target)s' % {
             "source": proposal.source_branch.display_name,
@@ -203,30 +351,276 @@ class cmd_merge(TarmacCommand):
             comment = str(failure)
 
         if not dry_run:
-            proposal.createComment(subject=subject, content=comment)
             if self.config.rejected_branch_status is not None:
-                proposal.setStatus(status=self.config.rejected_branch_status)
+                status = self.config.rejected_branch_status
             else:
-                proposal.setStatus(status='Needs review')
-            proposal.lp_save()
+                status = 'Needs review'
+            with self._api_phase('error-reporting'):
+                self.queue_write(
+                    proposal.self_link, 'comment on %s' % proposal.web_link,
+                    proposal.createComment, subject=subject, content=comment)
+                self.queue_write(
+                    proposal.self_link, 'set the status of %s' % (
+                        proposal.web_link),
+                    proposal.setStatus, status=status)
+                self.queue_write(
+                    proposal.self_link, 'save %s' % proposal.web_link,
+                    proposal.lp_save)
+
+    def queue_write(self, key, description, function, *args, **kwargs):
+        """Call %function to change something on Launchpad, in the background.
+
+        Changes with the same %key, such as the self_link of the object
+        changed, are made in the order they were queued in.  They are all
+        made by the end of the run; %description is logged if one fails.
+        """
+        if self.writes is None:
+            function(*args, **kwargs)
+            return
+        http = get_http(self.launchpad)
+        phase = 'setup' if http is None else http.phase
+
+        def write():
+            with self._api_phase(phase):
+                function(*args, **kwargs)
+        self.writes.put(key, description, write)
+
+    def _flush_writes(self):
+        """Wait for the changes queued with queue_write to be made."""
+        if self.writes is None:
+            return
+        failures = self.writes.flush()
+        if failures:
+            self.logger.warning(
+                '%d changes to Launchpad failed', len(failures))
+
+    @contextmanager
+    def _api_phase(self, name):
+        """Count the API requests made by this thread under phase %name."""
+        http = get_http(self.launchpad)
+        if http is None:
+            yield
+            return
+        previous = http.phase
+        http.phase = name
+        try:
+            yield
+        finally:
+            http.phase = previous
+
+    def _fire(self, hook_name, *args, **kwargs):
+        """Fire the %hook_name hook for this command."""
+        with self._api_phase('plugins'):
+            tarmac_hooks.fire(hook_name, self, *args, **kwargs)
+
+    def _report_api_stats(self):
+        """Log and write out the API requests made, and start counting anew.
+        """
+        http = get_http(self.launchpad)
+        if http is None:
+            return
+        summary = http.stats.summary()
+        http.stats.reset()
+        total = {'requests': 0, 'cache_hits': 0, 'bytes': 0, 'seconds': 0}
+        for entry in summary:
+            for name in total:
+                total[name] += entry[name]
+            self.logger.debug(
+                '  %(phase)s: %(resource)s: %(requests)d requests'
+                ' (%(cache_hits)d cached), %(bytes)d bytes, %(seconds).2fs'
+                % entry)
+        self.logger.info(
+            'Launchpad API: %(requests)d requests (%(cache_hits)d cached),'
+            ' %(bytes)d bytes, %(seconds).2fs' % total)
+
+        path = os.path.join(self.config.CACHE_HOME, API_STATS_FILENAME)
+        try:
+            with open(path + '.tmp', 'w') as stats_file:
+                json.dump({
+                    'finished': time.time(),
+                    'latency_buckets': list(LATENCY_BUCKETS),
+                    'requests': summary,
+                    }, stats_file, indent=2)
+            os.replace(path + '.tmp', path)
+        except OSError as error:
+            self.logger.warning(
+                'Could not write %s: %s', path, error)
+
+    def _get_target(self, lp_branch):
+        """Return the target Branch for %lp_branch, with a working tree."""
+        return Branch.create(
+            lp_branch, config=self.config, create_tree=True,
+            launchpad=self.launchpad)
+
+    def _log_skip(self, proposal, failure):
+        """Log that merging %proposal was skipped because of %failure."""
+        self.logger.warning(
+            'Skipping merge of %(source)s into %(target)s:'
+            ' %(msg)s' % {
+                'source': proposal.source_branch.web_link,
+                'target': proposal.target_branch.web_link,
+                'msg': str(failure),
+            })
+        self._record_outcome(proposal, 'skipped')
+
+    def _log_pointless(self, proposal):
+        """Log that merging %proposal would not change anything."""
+        self.logger.warning(
+            'Merging %(source)s into %(target)s would be '
+            'pointless.' % {
+                'source': proposal.source_branch.web_link,
+                'target': proposal.target_branch.web_link})
+        self._record_outcome(proposal, 'pointless')
+
+    def _check_proposal(self, lp_branch, proposal):
+        """Check that %proposal can be merged into %lp_branch.
+
+        Only the data on Launchpad is checked, so the source branch isn't
+        fetched.
+        """
+        if proposal.self_link in self._cyclic:
+            raise PrerequisiteCycle(
+                'Prerequisites form a cycle.',
+                'The prerequisite branch of %s depends on it, directly or '
+                'through its own prerequisites, so it can not be landed.' % (
+                    proposal.source_branch.web_link))
+
+        prerequisite = proposal.prerequisite_branch
+        if prerequisite:
+            merges = self._get_prerequisite_proposals(proposal)
+            if len(merges) == 0:
+                raise TarmacMergeError(
+                    'No proposals of prerequisite branch.',
+                    'No proposals found for merge of %s '
+                    'into %s.' % (
+                        prerequisite.web_link,
+                        lp_branch.web_link))
+            elif len(merges) > 1:
+                raise TarmacMergeError(
+                    'Too many proposals of prerequisite.',
+                    'More than one proposal found for merge '
+                    'of %s into %s, which is not Superseded.' % (
+                        prerequisite.web_link,
+                        lp_branch.web_link))
+
+        if not proposal.reviewed_revid:
+            raise TarmacMergeError(
+                'No approved revision specified.')
+
+    def _prepare_source(self, target, proposal):
+        """Check that %proposal can be merged, and return its source Branch.
+        """
+        self._check_proposal(target.lp_branch, proposal)
+
+        self.logger.debug('Firing tarmac_pre_merge_check hook')
+        self._fire('tarmac_pre_merge_check', target, proposal)
+
+        source = Branch.create(
+            proposal.source_branch, config=self.config,
+            target=target, launchpad=self.launchpad)
+
+        approved = source.bzr_branch.revision_id_to_revno(
+            proposal.reviewed_revid.encode('utf-8'))
+        tip = source.bzr_branch.revno()
+
+        if tip > approved:
+            message = 'Unapproved changes made after approval'
+            lp_comment = (
+                'There are additional revisions which have not '
+                'been approved in review. Please seek review and '
+                'approval of these new revisions.')
+            raise UnapprovedChanges(message, lp_comment)
+        return source
+
+    def _merge_source(self, target, source, proposal, force=False):
+        """Merge %source into %target at the approved revision of %proposal.
+        """
+        self.logger.debug(
+            'Merging %(source)s at revision %(revision)s' % {
+                'source': proposal.source_branch.web_link,
+                'revision': proposal.reviewed_revid})
+
+        target.merge(
+            source, proposal.reviewed_revid.encode('utf-8'), force=force)
+
+    def _fire_pre_commit(self, target, source, proposal):
+        """Fire the tarmac_pre_commit hook for %proposal."""
+        self._restore_commit_message(proposal)
+        self.logger.debug('Firing tarmac_pre_commit hook')
+        self._fire('tarmac_pre_commit', target, source, proposal)
+
+    def _restore_commit_message(self, proposal):
+        """Give %proposal back the commit message it had at first.
+
+        Plug-ins such as the commit message template rewrite the commit
+        message of the proposals they verify, so a proposal verified again
+        would otherwise have it rewritten twice.
+        """
+        original = self._commit_messages.setdefault(
+            proposal.self_link, proposal.commit_message)
+        if proposal.commit_message != original:
+            proposal.commit_message = original
+
+    def _commit_proposal(self, target, source, proposal, dry_run):
+        """Commit the merge of %proposal, and its tags, to %target."""
+        revprops = {'merge_url': proposal.web_link}
+
+        commit_message = proposal.commit_message
+        if commit_message is None and self.config.imply_commit_message:
+            commit_message = proposal.description
+        target.commit(commit_message,
+                      revprops=revprops,
+                      authors=source.authors,
+                      dry_run=dry_run,
+                      reviews=self._get_reviews(proposal))
+        if not dry_run:
+            # The outcomes of the proposals behind depend on the new tip.
+            self._target_revid = target.bzr_branch.last_revision().decode()
+        target.merge_tags(source)
+
+    def _land_verified(self, target, source, proposal, dry_run):
+        """Merge and commit %proposal, which has already been verified."""
+        target.cleanup()
+        self._merge_source(target, source, proposal)
+        self._commit_proposal(target, source, proposal, dry_run)
+
+        self.logger.debug('Firing tarmac_post_commit hook')
+        self._fire('tarmac_post_commit', target, source, proposal)
+        self._record_outcome(proposal, 'landed')
 
     def _do_merges(self, branch_url, source_mp=None, dry_run=False):
         """Merge the approved proposals for %branch_url."""
-        lp_branch = self.launchpad.branches.getByUrl(url=branch_url)
-        if lp_branch is None:
-            self.logger.info('Not a valid branch: {0}'.format(branch_url))
-            return
+        self._round_trips_saved = 0
+        self._commit_messages = {}
+        try:
+            with self._api_phase('landing'):
+                return self._merge_approved(branch_url, source_mp, dry_run)
+        finally:
+            self.logger.debug(
+                'Caching prerequisite proposals saved %d API round trips '
+                'for %s', self._round_trips_saved, branch_url)
+
+    def _merge_approved(self, branch_url, source_mp, dry_run):
+        with self._api_phase('discovery'):
+            lp_branch = self.launchpad.branches.getByUrl(url=branch_url)
+            if lp_branch is None:
+                self.logger.info(
+                    'Not a valid branch: {0}'.format(branch_url))
+                return
+            self._target_revid = getattr(lp_branch, 'last_scanned_id', None)
 
-        if source_mp is not None:
-            proposals = [source_mp]
-        else:
-            proposals = self._get_mergable_proposals_for_branch(lp_branch)
+            if source_mp is not None:
+                proposals = iter([ProposalSnapshot.from_proposal(source_mp)])
+            else:
+                proposals = self._iter_mergable_proposals(lp_branch)
+            first = next(proposals, None)
 
-        if not proposals:
+        if first is None:
             self.logger.info(
                 'No approved proposals found for %(branch_url)s' % {
                     'branch_url': branch_url})
             return
+        proposals = itertools.chain([first], proposals)
 
         if self.config.list_approved:
             for proposal in proposals:
@@ -234,74 +628,35 @@ class cmd_merge(TarmacCommand):
             return
 
         try:
-            target = Branch.create(
-                lp_branch, config=self.config, create_tree=True,
-                launchpad=self.launchpad)
+            target = self._get_target(lp_branch)
         except TarmacMergeError as failure:
-            self._handle_merge_error(proposals[0], failure, dry_run)
+            self._handle_merge_error(first, failure, dry_run)
             return
 
         self.logger.debug('Firing tarmac_pre_merge hook')
-        tarmac_hooks.fire('tarmac_pre_merge',
-                          self, target)
+        self._fire('tarmac_pre_merge', target)
 
         success_count = 0
         try:
+            train_size = int(target.config.get('train_size', 1))
+            batch_size = int(target.config.get('batch_size', 1))
+            if train_size > 1 and not self.config.one:
+                success_count = self._do_train_merges(
+                    target, proposals, train_size, dry_run)
+                proposals = []
+            elif batch_size > 1 and not self.config.one:
+                success_count = self._do_batch_merges(
+                    target, proposals, batch_size, dry_run)
+                proposals = []
+
             for proposal in proposals:
                 target.cleanup()
-                self.logger.debug(
-                    'Preparing to merge %(source_branch)s' % {
-                        'source_branch': proposal.source_branch.web_link})
+                self._log_preparing(proposal)
                 try:
-                    prerequisite = proposal.prerequisite_branch
-                    if prerequisite:
-                        merges = self._get_prerequisite_proposals(proposal)
-                        if len(merges) == 0:
-                            raise TarmacMergeError(
-                                'No proposals of prerequisite branch.',
-                                'No proposals found for merge of %s '
-                                'into %s.' % (
-                                    prerequisite.web_link,
-                                    target.lp_branch.web_link))
-                        elif len(merges) > 1:
-                            raise TarmacMergeError(
-                                'Too many proposals of prerequisite.',
-                                'More than one proposal found for merge '
-                                'of %s into %s, which is not Superseded.' % (
-                                    prerequisite.web_link,
-                                    target.lp_branch.web_link))
-
-                    if not proposal.reviewed_revid:
-                        raise TarmacMergeError(
-                            'No approved revision specified.')
-
-                    source = Branch.create(
-                        proposal.source_branch, config=self.config,
-                        target=target, launchpad=self.launchpad)
-
-                    approved = source.bzr_branch.revision_id_to_revno(
-                        proposal.reviewed_revid.encode('utf-8'))
-                    tip = source.bzr_branch.revno()
-
-                    if tip > approved:
-                        message = 'Unapproved changes made after approval'
-                        lp_comment = (
-                            'There are additional revisions which have not '
-                            'been approved in review. Please seek review and '
-                            'approval of these new revisions.')
-                        raise UnapprovedChanges(message, lp_comment)
-
-                    self.logger.debug(
-                        'Merging %(source)s at revision %(revision)s' % {
-                            'source': proposal.source_branch.web_link,
-                            'revision': proposal.reviewed_revid})
+                    source = self._prepare_source(target, proposal)
+                    self._merge_source(target, source, proposal)
 
-                    target.merge(
-                        source, proposal.reviewed_revid.encode('utf-8'))
-
-                    self.logger.debug('Firing tarmac_pre_commit hook')
-                    tarmac_hooks.fire('tarmac_pre_commit',
-                                      self, target, source, proposal)
+                    self._fire_pre_commit(target, source, proposal)
 
                 except TarmacMergeError as failure:
                     self._handle_merge_error(proposal, failure, dry_run)
@@ -312,35 +667,15 @@ class cmd_merge(TarmacCommand):
 
                     continue
                 except TarmacMergeSkipError as failure:
-                    self.logger.warning(
-                        'Skipping merge of %(source)s into %(target)s:'
-                        ' %(msg)s' % {
-                            'source': proposal.source_branch.web_link,
-                            'target': proposal.target_branch.web_link,
-                            'msg': str(failure),
-                        })
+                    self._log_skip(proposal, failure)
                     target.cleanup()
                     continue
                 except PointlessMerge:
-                    self.logger.warning(
-                        'Merging %(source)s into %(target)s would be '
-                        'pointless.' % {
-                            'source': proposal.source_branch.web_link,
-                            'target': proposal.target_branch.web_link})
+                    self._log_pointless(proposal)
                     continue
 
-                revprops = {'merge_url': proposal.web_link}
-
-                commit_message = proposal.commit_message
-                if commit_message is None and self.config.imply_commit_message:
-                    commit_message = proposal.description
                 try:
-                    target.commit(commit_message,
-                                  revprops=revprops,
-                                  authors=source.authors,
-                                  dry_run=dry_run,
-                                  reviews=self._get_reviews(proposal))
-                    target.merge_tags(source)
+                    self._commit_proposal(target, source, proposal, dry_run)
                 except TarmacMergeError as failure:
                     self._handle_merge_error(proposal, failure, dry_run)
 
@@ -350,19 +685,13 @@ class cmd_merge(TarmacCommand):
 
                     continue
                 except TarmacMergeSkipError as failure:
-                    self.logger.warning(
-                        'Skipping merge of %(source)s into %(target)s:'
-                        ' %(msg)s' % {
-                            'source': proposal.source_branch.web_link,
-                            'target': proposal.target_branch.web_link,
-                            'msg': str(failure),
-                        })
+                    self._log_skip(proposal, failure)
                     target.cleanup()
                     continue
 
                 self.logger.debug('Firing tarmac_post_commit hook')
-                tarmac_hooks.fire('tarmac_post_commit',
-                                  self, target, source, proposal)
+                self._fire('tarmac_post_commit', target, source, proposal)
+                self._record_outcome(proposal, 'landed')
                 success_count += 1
                 target.cleanup()
                 if self.config.one:
@@ -374,45 +703,368 @@ class cmd_merge(TarmacCommand):
             raise
         else:
             self.logger.debug('Firing tarmac_post_merge hook')
-            tarmac_hooks.fire('tarmac_post_merge',
-                              self, target, success_count=success_count)
+            self._fire(
+                'tarmac_post_merge', target, success_count=success_count)
         finally:
             target.cleanup()
 
+    def _do_batch_merges(self, target, proposals, batch_size, dry_run):
+        """Land %proposals in batches of up to %batch_size.
+
+        Returns the number of proposals that were landed.
+        """
+        success_count = 0
+        batch = []
+        for proposal in proposals:
+            self._log_preparing(proposal)
+            try:
+                source = self._prepare_source(target, proposal)
+            except TarmacMergeError as failure:
+                self._handle_merge_error(proposal, failure, dry_run)
+                continue
+            except TarmacMergeSkipError as failure:
+                self._log_skip(proposal, failure)
+                continue
+
+            batch.append((proposal, source))
+            if len(batch) == batch_size:
+                success_count += self._land_batch(target, batch, dry_run)
+                batch = []
+        if batch:
+            success_count += self._land_batch(target, batch, dry_run)
+        return success_count
+
+    def _land_batch(self, target, batch, dry_run):
+        """Verify the (proposal, source) pairs in %batch together, and land.
+
+        All the proposals are merged into the tree at once, so that
+        verification of the combined tree only happens once.  If that fails,
+        the batch is split in two halves which are tried one after the other,
+        until the proposals that fail are found.
+
+        Returns the number of proposals that were landed.
+        """
+        target.cleanup()
+        self.logger.debug('Verifying a batch of %d proposals', len(batch))
+        try:
+            for proposal, source in list(batch):
+                try:
+                    self._merge_source(target, source, proposal, force=True)
+                except PointlessMerge:
+                    self._log_pointless(proposal)
+                    batch = [pair for pair in batch if pair[0] is not proposal]
+
+            # Verification plug-ins only verify the combined tree once.
+            for proposal, source in batch:
+                self._fire_pre_commit(target, source, proposal)
+        except TarmacMergeError as failure:
+            if len(batch) == 1:
+                self._handle_merge_error(batch[0][0], failure, dry_run)
+                return 0
+            self.logger.info(
+                'Batch of %d proposals failed, splitting it: %s',
+                len(batch), failure)
+            middle = len(batch) // 2
+            return (self._land_batch(target, batch[:middle], dry_run) +
+                    self._land_batch(target, batch[middle:], dry_run))
+        except TarmacMergeSkipError as failure:
+            for proposal, _ in batch:
+                self._log_skip(proposal, failure)
+            return 0
+
+        success_count = 0
+        for index, (proposal, source) in enumerate(batch):
+            try:
+                self._land_verified(target, source, proposal, dry_run)
+            except TarmacMergeError as failure:
+                self._handle_merge_error(proposal, failure, dry_run)
+            except TarmacMergeSkipError as failure:
+                self._log_skip(proposal, failure)
+            except PointlessMerge:
+                self._log_pointless(proposal)
+            else:
+                success_count += 1
+                continue
+
+            # The rest of the batch was verified along with the proposal that
+            # failed to land, so has to be verified again.
+            return success_count + self._land_batch(
+                target, batch[index + 1:], dry_run)
+        target.cleanup()
+        return success_count
+
+    def _do_train_merges(self, target, proposals, train_size, dry_run):
+        """Land %proposals, verifying up to %train_size of them at once.
+
+        Every proposal in the train is verified in its own copy of the tree,
+        with the proposals ahead of it merged as well, while those are still
+        being verified.  Proposals are committed one at a time, in order, as
+        soon as they and all the proposals ahead of them have passed.  When a
+        proposal fails, the proposals behind it are verified again without
+        it.
+
+        Returns the number of proposals that were landed.
+        """
+        success_count = 0
+        queue = [(proposal, None) for proposal in proposals]
+        with ThreadPoolExecutor(max_workers=train_size) as executor:
+            while queue:
+                train = self._start_train(
+                    target, queue, train_size, executor, dry_run)
+                try:
+                    for index, (proposal, source, car, outcome) in enumerate(
+                            train):
+                        try:
+                            if isinstance(outcome, Future):
+                                outcome.result()
+                            elif outcome is not None:
+                                raise outcome
+
+                            self._land_verified(
+                                target, source, proposal, dry_run)
+                        except TarmacMergeError as failure:
+                            self._handle_merge_error(
+                                proposal, failure, dry_run)
+                        except TarmacMergeSkipError as failure:
+                            self._log_skip(proposal, failure)
+                        except PointlessMerge:
+                            self._log_pointless(proposal)
+                        else:
+                            success_count += 1
+                            target.cleanup()
+                            continue
+
+                        # Everything behind the failed proposal was verified
+                        # with it merged, so has to be verified again, once
+                        # the verifications already running have finished.
+                        behind = train[index + 1:]
+                        queue[:0] = [
+                            (proposal, source)
+                            for proposal, source, _, _ in behind]
+                        self._stop_verifying(behind)
+                        target.cleanup()
+                        break
+                finally:
+                    for _, _, car, outcome in train:
+                        self._discard_car(car, outcome)
+        return success_count
+
+    def _start_train(self, target, queue, train_size, executor, dry_run):
+        """Take up to %train_size proposals from %queue, and verify them.
+
+        Returns a list of (proposal, source, car, outcome) tuples, where car
+        is the copy of %target that the proposal is verified in, and outcome
+        is either the Future of the verification, or the error from preparing
+        the car.
+        """
+        train = []
+        while queue and len(train) < train_size:
+            proposal, source = queue.pop(0)
+            self._log_preparing(proposal)
+            if source is None:
+                try:
+                    source = self._prepare_source(target, proposal)
+                except TarmacMergeError as failure:
+                    self._handle_merge_error(proposal, failure, dry_run)
+                    continue
+                except TarmacMergeSkipError as failure:
+                    self._log_skip(proposal, failure)
+                    continue
+
+            car = target.copy_tree()
+            try:
+                for ahead, ahead_source, _, _ in train:
+                    self._merge_source(car, ahead_source, ahead, force=True)
+                self._merge_source(car, source, proposal, force=True)
+            except (TarmacMergeError, TarmacMergeSkipError,
+                    PointlessMerge) as error:
+                # Whether this is this proposal's fault depends on whether
+                # the ones ahead of it land, so it is dealt with in order.
+                outcome = error
+            else:
+                # Verification runs in another thread, so it gets its own
+                # branch objects, and the proposal its original message.
+                self._restore_commit_message(proposal)
+                outcome = executor.submit(
+                    self._verify_car, car, source.reopen(target=car),
+                    proposal)
+            train.append((proposal, source, car, outcome))
+        return train
+
+    def _verify_car(self, car, source, proposal):
+        """Fire the tarmac_pre_commit hook for %proposal in %car."""
+        self.logger.debug(
+            'Firing tarmac_pre_commit hook for %s',
+            proposal.source_branch.web_link)
+        self._fire('tarmac_pre_commit', car, source, proposal)
+
+    def _stop_verifying(self, train):
+        """Cancel the verifications of %train, or wait for them to end."""
+        outcomes = [
+            outcome for _, _, _, outcome in train
+            if isinstance(outcome, Future)]
+        for outcome in outcomes:
+            outcome.cancel()
+        wait(outcomes)
+
+    def _discard_car(self, car, outcome):
+        """Remove the tree of %car, once its verification has finished."""
+        if isinstance(outcome, Future) and not outcome.cancel():
+            outcome.add_done_callback(lambda future: car.exit_stack.close())
+        else:
+            car.exit_stack.close()
+
     def _get_mergable_proposals_for_branch(self, lp_branch):
         """
         Return a list of the mergable proposals for the given branch.  The
         list returned will be in the order that they should be processed.
         """
-        proposals = []
-        sorted_proposals = sort_landing_candidates(
-            lp_branch.landing_candidates)
-        for entry in sorted_proposals:
-            self.logger.debug(
-                "Considering merge proposal: {0}".format(entry.web_link))
-            prereqs = self._get_prerequisite_proposals(entry)
+        return list(self._iter_mergable_proposals(lp_branch))
 
-            if entry.queue_status != 'Approved':
-                self.logger.debug(
-                    "  Skipping proposal: status is {0}, not "
-                    "'Approved'".format(entry.queue_status))
-                continue
+    def _iter_mergable_proposals(self, lp_branch):
+        """Yield the mergable proposals for %lp_branch, in landing order.
 
-            if (not self.config.imply_commit_message and
-                    not entry.commit_message):
-                self.logger.debug(
-                    "  Skipping proposal: proposal has no commit message")
-                continue
+        Proposals are ordered, and the ones that can't land are dropped,
+        using only their snapshots.  The checks that need more from
+        Launchpad are run ahead by a pool of threads, in landing order, so
+        that the first proposal can be landing while the ones behind it are
+        still being checked.  Closing the generator cancels the checks that
+        haven't started.
+        """
+        with self._api_phase('discovery'):
+            graph = LandingGraph(
+                self._take_snapshots(list(lp_branch.landing_candidates)))
+            self._cyclic = frozenset(
+                p.self_link for p in graph.proposals if graph.in_cycle(p))
+            candidates = [
+                entry for entry in graph.sorted(
+                    self._get_landing_order(lp_branch))
+                if self._is_candidate(entry)]
+
+        threads = self._get_prefetch_threads()
+        executor = None
+        if threads > 1 and len(candidates) > 1:
+            executor = ThreadPoolExecutor(
+                max_workers=min(threads, len(candidates)))
+            prefetches = [
+                executor.submit(self._prefetch_checks, entry)
+                for entry in candidates]
+        try:
+            for index, entry in enumerate(candidates):
+                with self._api_phase('discovery'):
+                    if executor is not None:
+                        prefetches[index].result()
+                    if (not graph.in_cycle(entry) and
+                            self._is_waiting_for_prerequisite(entry)):
+                        continue
+                yield entry
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=False, cancel_futures=True)
+
+    def _is_candidate(self, entry):
+        """Return whether the snapshot %entry may be landed.
 
-            if len(prereqs) == 1 and prereqs[0].queue_status != 'Merged':
-                # N.B.: The case of a MP with more than one prereq MP open
-                #       will be caught as a merge error.
+        Proposals that are not approved, have no commit message or can't
+        have a different outcome than on the last run are logged and their
+        outcome recorded.
+        """
+        self.logger.debug(
+            "Considering merge proposal: {0}".format(entry.web_link))
+        if self.state is not None:
+            outcome = self.state.unchanged_outcome(
+                entry, target_revid=self._target_revid)
+            if (outcome == 'no-commit-message' and
+                    self.config.imply_commit_message):
+                outcome = None
+            if outcome is not None:
                 self.logger.debug(
-                    "  Skipping proposal: prerequisite not yet merged")
-                continue
+                    "  Skipping proposal: unchanged since the last run"
+                    " ({0})".format(outcome))
+                self._record_outcome(entry, outcome)
+                return False
 
-            proposals.append(entry)
-        return proposals
+        if entry.queue_status != 'Approved':
+            self.logger.debug(
+                "  Skipping proposal: status is {0}, not "
+                "'Approved'".format(entry.queue_status))
+            self._record_outcome(entry, 'not-approved')
+            return False
+
+        if (not self.config.imply_commit_message and
+                not entry.commit_message):
+            self.logger.debug(
+                "  Skipping proposal: proposal has no commit message")
+            self._record_outcome(entry, 'no-commit-message')
+            return False
+        return True
+
+    def _is_waiting_for_prerequisite(self, entry):
+        """Return whether %entry waits for its prerequisite to be merged."""
+        prereqs = self._get_prerequisite_proposals(entry)
+        if len(prereqs) == 1 and prereqs[0].queue_status != 'Merged':
+            # N.B.: The case of a MP with more than one prereq MP open
+            #       will be caught as a merge error.
+            self.logger.debug(
+                "  Skipping proposal: prerequisite not yet merged"
+                " ({0})".format(entry.web_link))
+            self._record_outcome(entry, 'waiting-prerequisite')
+            return True
+        return False
+
+    def _get_prefetch_threads(self):
+        return int(self.config['Tarmac'].get(
+            'prefetch_threads', PREFETCH_THREADS))
+
+    def _take_snapshots(self, proposals):
+        """Return ProposalSnapshots of %proposals, taken in parallel.
+
+        Launchpad is slow to answer, so the snapshots are taken by a pool of
+        threads.
+        """
+        threads = self._get_prefetch_threads()
+        if threads < 2 or len(proposals) < 2:
+            return [ProposalSnapshot(proposal) for proposal in proposals]
+        with ThreadPoolExecutor(
+                max_workers=min(threads, len(proposals))) as executor:
+            return list(executor.map(self._take_snapshot, proposals))
+
+    def _take_snapshot(self, proposal):
+        """Return a ProposalSnapshot of %proposal."""
+        with self._api_phase('discovery'):
+            return ProposalSnapshot(proposal)
+
+    def _prefetch_checks(self, snapshot):
+        """Fetch the prerequisite proposals and votes of %snapshot.
+
+        The HTTP transport remembers them until the checks need them.
+        """
+        with self._api_phase('discovery'):
+            try:
+                self._get_prerequisite_proposals(snapshot)
+                list(snapshot.votes)
+            except Exception as error:
+                # Left for the checks to report.
+                self.logger.debug(
+                    "Prefetching {0} failed: {1}".format(
+                        snapshot.web_link, error))
+
+    def _get_landing_order(self, lp_branch):
+        """Return the sort key for proposals to %lp_branch, or None."""
+        config = StackedConfig([
+            BranchConfig(lp_branch.bzr_identity, self.config),
+            self.config['Tarmac']])
+        name = config.get('landing_order', landing_orders.default_key)
+        try:
+            policy = landing_orders.get(name)
+        except KeyError:
+            raise TarmacCommandError(
+                '%s: Unknown landing_order: %s' % (
+                    lp_branch.bzr_identity, name))
+        if name == landing_orders.default_key:
+            return None
+        stats = self.state.owner_stats() if self.state is not None else {}
+        return policy(stats)
 
     def _get_prerequisite_proposals(self, proposal):
         """
@@ -423,11 +1075,23 @@ class cmd_merge(TarmacCommand):
         """
         prerequisite = proposal.prerequisite_branch
         target_branch = proposal.target_branch
-        if not prerequisite or not prerequisite.landing_targets:
+        if not prerequisite:
             return []
+        try:
+            landing_targets = self._prerequisite_cache[
+                prerequisite.unique_name]
+        except KeyError:
+            landing_targets = [
+                (x, x.target_branch.unique_name)
+                for x in prerequisite.landing_targets]
+            self._prerequisite_cache[prerequisite.unique_name] = \
+                landing_targets
+        else:
+            # The landing targets, and the target branch of each.
+            self._round_trips_saved += 1 + len(landing_targets)
         return [
-            x for x in prerequisite.landing_targets
-            if x.target_branch.unique_name == target_branch.unique_name
+            x for x, unique_name in landing_targets
+            if unique_name == target_branch.unique_name
             and x.queue_status != 'Superseded']
 
     def _get_reviews(self, proposal):
@@ -451,7 +1115,8 @@ class cmd_merge(TarmacCommand):
         api_url = urlp.sub('https://api.launchpad.net/1.0/', mp_url)
         return self.launchpad.load(api_url)
 
-    def run(self, branch_urls=None, launchpad=None, dry_run=False, **kwargs):
+    def _set_up(self, launchpad=None, **kwargs):
+        """Apply the command options, load plugins and connect to Launchpad."""
         for key, value in list(kwargs.items()):
             self.config.set('Tarmac', key, value)
 
@@ -465,12 +1130,39 @@ class cmd_merge(TarmacCommand):
         load_plugins()
         self.logger.debug('Plugins loaded')
 
-        self.launchpad = launchpad
-        if self.launchpad is None:
+        self.state = LandingState.from_config(self.config)
+        self._started = {}
+        self.writes = WriteQueue(threads=int(self.config['Tarmac'].get(
+            'write_threads', WRITE_THREADS)))
+
+        if launchpad is None:
             self.logger.debug('Loading launchpad object')
-            self.launchpad = self.get_launchpad_object()
+            launchpad = self.get_launchpad_object(
+                record=self.config.record, replay=self.config.replay)
             self.logger.debug('launchpad object loaded')
+        self.launchpad = CachedLaunchpad(
+            launchpad, store=TTLStore(
+                os.path.join(self.config.CACHE_HOME, 'launchpad.json')))
+        http = get_http(launchpad)
+        if http is not None:
+            http.retries = int(self.config['Tarmac'].get(
+                'api_retries', http.retries))
+            http.breaker.cooldown = int(self.config['Tarmac'].get(
+                'api_cooldown', http.breaker.cooldown))
+
+    def _is_dry_run(self, dry_run):
+        """Return whether to leave the branches alone, given %dry_run.
+
+        A replayed run is always a dry run: only the Launchpad API is
+        answered from the recording, and the branches are the real ones.
+        """
+        if self.config.replay and not dry_run:
+            self.logger.info('Replaying, so nothing will be committed')
+            return True
+        return dry_run
 
+    def _resolve_branch_urls(self, branch_urls):
+        """Return the target branch urls, and the proposal to merge if any."""
         if self.config.proposal:
             proposal = self._get_proposal_from_mp_url(self.config.proposal)
             # Always override branch_url with the correct one.
@@ -485,23 +1177,324 @@ class cmd_merge(TarmacCommand):
             if not branch_url.startswith('lp:'):
                 raise TarmacCommandError(
                     '%s: Branch urls must start with lp:' % branch_url)
+        return branch_urls, proposal
+
+    def _get_busy_targets(self, branch_urls):
+        """Return the %branch_urls that have approved proposals to land.
+
+        Rather than looking up every target and its landing candidates, the
+        approved proposals of each project the targets belong to are
+        fetched at once.  Targets whose project can't be told from their
+        URL, or couldn't be searched, are always kept.
+        """
+        projects = {}
+        for branch_url in branch_urls:
+            unique_name = branch_unique_name(branch_url)
+            if unique_name is not None:
+                project = unique_name.split('/')[1]
+                if project != '+junk':
+                    projects.setdefault(project, set()).add(unique_name)
+
+        busy = set()
+        with self._api_phase('discovery'):
+            for project, unique_names in sorted(projects.items()):
+                try:
+                    proposals = self.launchpad.projects[
+                        project].getMergeProposals(status=['Approved'])
+                    busy.update(
+                        branch_unique_name(proposal.target_branch_link)
+                        for proposal in proposals)
+                except Exception as error:
+                    self.logger.debug(
+                        'Searching %s for approved proposals failed: %s',
+                        project, error)
+                    busy.update(unique_names)
+        searched = set().union(*projects.values())
+
+        targets = [
+            branch_url for branch_url in branch_urls
+            if branch_unique_name(branch_url) not in searched or
+            branch_unique_name(branch_url) in busy]
+        self.logger.debug(
+            '%d of %d targets may have approved proposals',
+            len(targets), len(branch_urls))
+        return targets
+
+    def _merge_branch_urls(self, branch_urls, proposal=None, dry_run=False):
+        """Merge the approved proposals for each of %branch_urls.
+
+        A target is skipped, rather than the run stopped, if Launchpad is
+        unavailable.
+        """
+        self._prerequisite_cache.clear()
+        self.launchpad.reset()
+        if proposal is None:
+            branch_urls = self._get_busy_targets(branch_urls)
+        with self.state.batch():
+            for branch_url in branch_urls:
+                self.logger.debug(
+                    'Merging approved branches against %(branch_url)s' % {
+                        'branch_url': branch_url})
+                try:
+                    merged = self._do_merges(
+                        branch_url, source_mp=proposal, dry_run=dry_run)
+
+                    # If we've been asked to only merge one branch, then exit.
+                    if merged and self.config.one:
+                        break
+                except LockContention:
+                    continue
+                except Exception as error:
+                    if is_unavailable(error):
+                        self.logger.warning(
+                            'Skipping %s, Launchpad is unavailable: %s',
+                            branch_url, error)
+                        continue
+                    self.logger.error(
+                        'An error occurred trying to merge %s: %s',
+                        branch_url, error)
+                    raise
+
+    def _merge_branch_urls_in_parallel(self, branch_urls, jobs, settings,
+                                       dry_run=False):
+        """Merge the approved proposals for %branch_urls in %jobs processes.
+
+        Unlike _merge_branch_urls, an error merging one target doesn't stop
+        the other targets from being merged; the first error is raised once
+        all workers have finished.  Targets skipped because Launchpad was
+        unavailable aren't errors.
+        """
+        errors = []
+        self.launchpad.reset()
+        branch_urls = self._get_busy_targets(branch_urls)
+        with ProcessPoolExecutor(
+                max_workers=jobs,
+                mp_context=multiprocessing.get_context('spawn')) as executor:
+            futures = {
+                executor.submit(
+                    _in_worker, _merge_in_subprocess, branch_url, settings,
+                    dry_run):
+                branch_url for branch_url in branch_urls}
+            http = get_http(self.launchpad)
+            for future in as_completed(futures):
+                branch_url = futures[future]
+                try:
+                    _, summary = future.result()
+                except (CancelledError, LockContention):
+                    continue
+                except Exception as error:
+                    if is_unavailable(error):
+                        self.logger.warning(
+                            'Skipping %s, Launchpad is unavailable: %s',
+                            branch_url, error)
+                        continue
+                    self.logger.error(
+                        'An error occurred trying to merge %s: %s',
+                        branch_url, error)
+                    errors.append(error)
+                    continue
+                if http is not None:
+                    http.stats.add(summary)
+        if errors:
+            raise errors[0]
+
+    def run(self, branch_urls=None, launchpad=None, dry_run=False, **kwargs):
+        self._set_up(launchpad, **kwargs)
+        dry_run = self._is_dry_run(dry_run)
+        try:
+            branch_urls, proposal = self._resolve_branch_urls(branch_urls)
+            jobs = int(self.config.jobs or 1)
+            # Workers already landing can't be stopped, so --one lands
+            # into one target after another.
+            if (jobs > 1 and proposal is None and len(branch_urls) > 1 and
+                    not self.config.one):
+                settings = dict(kwargs)
+                settings.pop('jobs', None)
+                self._merge_branch_urls_in_parallel(
+                    branch_urls, jobs, settings, dry_run=dry_run)
+            else:
+                self._merge_branch_urls(
+                    branch_urls, proposal, dry_run=dry_run)
+        finally:
+            self._flush_writes()
+            self._report_api_stats()
+
+
+class cmd_daemon(cmd_merge):
+    '''Keep merging approved merge proposal branches until interrupted.
+
+    Rather than being started from cron for every poll, the daemon keeps its
+    Launchpad session, the loaded plug-ins and the target branches and their
+    trees around, and checks for approved proposals every ``poll_interval``
+    seconds.
+    '''
+
+    aliases = []
+    takes_args = ['branch_urls*']
+    takes_options = [
+        options.http_debug_option,
+        options.debug_option,
+        options.imply_commit_message_option,
+        options.dry_run_option,
+        options.interval_option,
+    ]
+
+    def __init__(self, registry):
+        cmd_merge.__init__(self, registry)
+        # The merge options the daemon doesn't support are always off.
+        for name in ('one', 'list_approved', 'proposal', 'jobs', 'record',
+                     'replay'):
+            self.config.set('Tarmac', name, False)
+        self._targets = {}
+
+    def _get_target(self, lp_branch):
+        """Return the target Branch for %lp_branch, reusing it if possible."""
+        target = self._targets.get(lp_branch.unique_name)
+        if target is None:
+            target = cmd_merge._get_target(self, lp_branch)
+            self._targets[lp_branch.unique_name] = target
+        else:
             self.logger.debug(
-                'Merging approved branches against %(branch_url)s' % {
-                    'branch_url': branch_url})
-            try:
-                merged = self._do_merges(
-                    branch_url, source_mp=proposal, dry_run=dry_run)
+                'Reusing tree for %s', lp_branch.unique_name)
+            target.lp_branch = lp_branch
+            target.refresh()
+        return target
 
-                # If we've been asked to only merge one branch, then exit.
-                if merged and self.config.one:
-                    break
-            except LockContention:
-                continue
-            except Exception as error:
-                self.logger.error(
-                    'An error occurred trying to merge %s: %s',
-                    branch_url, error)
-                raise
+    def run(self, branch_urls=None, launchpad=None, dry_run=False, **kwargs):
+        self._set_up(launchpad, **kwargs)
+        dry_run = self._is_dry_run(dry_run)
+        branch_urls, proposal = self._resolve_branch_urls(branch_urls)
+        interval = int(
+            self.config.interval or
+            self.config['Tarmac'].get('poll_interval', POLL_INTERVAL))
+
+        self.logger.info(
+            'Polling %d branches every %d seconds', len(branch_urls),
+            interval)
+        try:
+            while True:
+                try:
+                    self._merge_branch_urls(branch_urls, dry_run=dry_run)
+                except Exception:
+                    # The targets may have been left in an unknown state, so
+                    # start again from scratch on the next poll.
+                    self.logger.exception('Merging failed, retrying later')
+                    self._targets.clear()
+                self._flush_writes()
+                self._report_api_stats()
+                self.logger.debug('Sleeping for %d seconds', interval)
+                time.sleep(interval)
+        except KeyboardInterrupt:
+            self.logger.info('Interrupted, exiting')
+        finally:
+            self._targets.clear()
+
+
+class PlannedTarget:
+    '''The target branch of a plan, without a branch or a tree.
+
+    It only has what tarmac_pre_merge_check plug-ins need: the Launchpad
+    branch, and its configuration.
+    '''
+
+    def __init__(self, lp_branch, config):
+        self.lp_branch = lp_branch
+        self.config = BranchConfig(lp_branch.bzr_identity, config)
+
+
+class cmd_plan(cmd_merge):
+    '''Print the plan for landing approved merge proposals, as JSON.
+
+    For every target branch, this lists the proposals in the order they would
+    be landed, and the proposals that would be skipped, with the reason.  It
+    also reports the number of Launchpad API requests made, and the time each
+    phase took.  No trees are checked out, and nothing is changed.
+
+    The tarmac_pre_merge_check plug-ins are run, but the checks that need the
+    source branch or the merged tree, such as conflicts and the
+    verify_command, are not.
+    '''
+
+    aliases = []
+    takes_args = ['branch_urls*']
+    takes_options = [
+        options.http_debug_option,
+        options.debug_option,
+        options.imply_commit_message_option,
+        options.record_option,
+        options.replay_option,
+    ]
+
+    def __init__(self, registry):
+        cmd_merge.__init__(self, registry)
+        # The merge options that don't apply to planning are always off.
+        for name in ('one', 'list_approved', 'proposal', 'jobs'):
+            self.config.set('Tarmac', name, False)
+        self._timings = {}
+        self._skipped = []
+
+    @contextmanager
+    def _phase(self, name):
+        """Add the time spent in the with block to the timing of %name."""
+        started = time.time()
+        try:
+            yield
+        finally:
+            self._timings[name] = (
+                self._timings.get(name, 0) + time.time() - started)
+
+    def _record_outcome(self, proposal, outcome, message=None):
+        """Note that %proposal would be skipped, instead of recording it."""
+        skipped = {'proposal': proposal.web_link, 'reason': outcome}
+        if message is not None:
+            skipped['message'] = message
+        self._skipped.append(skipped)
+
+    def _plan_target(self, branch_url):
+        """Return the plan for landing proposals into %branch_url."""
+        with self._phase('targets'):
+            lp_branch = self.launchpad.branches.getByUrl(url=branch_url)
+        if lp_branch is None:
+            return {'branch': branch_url, 'error': 'Not a valid branch.'}
+
+        self._skipped = []
+        with self._phase('candidates'):
+            proposals = self._get_mergable_proposals_for_branch(lp_branch)
+        landing = []
+        target = PlannedTarget(lp_branch, self.config)
+        with self._phase('checks'):
+            for proposal in proposals:
+                try:
+                    self._check_proposal(lp_branch, proposal)
+                    self._fire('tarmac_pre_merge_check', target, proposal)
+                except TarmacMergeError as failure:
+                    self._record_outcome(
+                        proposal, 'merge-error', message=str(failure))
+                except TarmacMergeSkipError as failure:
+                    self._record_outcome(
+                        proposal, 'skipped', message=str(failure))
+                else:
+                    landing.append(proposal.web_link)
+        return {
+            'branch': branch_url,
+            'landing': landing,
+            'skipped': self._skipped,
+            }
+
+    def run(self, branch_urls=None, launchpad=None, **kwargs):
+        with self._phase('setup'):
+            self._set_up(launchpad, **kwargs)
+            branch_urls, _ = self._resolve_branch_urls(branch_urls)
+        targets = [self._plan_target(branch_url) for branch_url in branch_urls]
+        http = get_http(self.launchpad)
+        print(json.dumps({
+            'targets': targets,
+            'api_calls': None if http is None else http.request_count,
+            'api': None if http is None else http.stats.summary(),
+            'timings': {
+                name: round(seconds, 3)
+                for name, seconds in sorted(self._timings.items())},
+            }, indent=2))
 
 
 class cmd_plugins(TarmacCommand):
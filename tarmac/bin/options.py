@@ -43,3 +43,19 @@ proposal_option = Option(
 dry_run_option = Option(
     'dry-run',
     help='Do not make any actual changes.')
+jobs_option = Option(
+    'jobs', short_name='j',
+    type=int, argname='N',
+    help='Merge into up to N target branches at once, in separate processes.')
+interval_option = Option(
+    'interval', short_name='i',
+    type=int, argname='seconds',
+    help='Number of seconds to wait between polls for approved proposals.')
+record_option = Option(
+    'record',
+    type=str, argname='DIR',
+    help='Record the Launchpad API traffic of the run in DIR.')
+replay_option = Option(
+    'replay',
+    type=str, argname='DIR',
+    help='Answer Launchpad API requests from the traffic recorded in DIR.')
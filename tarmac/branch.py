@@ -16,15 +16,22 @@
 
 '''Tarmac branch tools.'''
 from contextlib import ExitStack
+import copy
 import logging
 import os
 import shutil
 import tempfile
 
 from breezy import branch as bzr_branch
-from breezy.errors import NoSuchRevision, OutOfDateTree
+from breezy.errors import (
+    BoundBranchOutOfDate,
+    BzrError,
+    NoSuchRevision,
+    OutOfDateTree,
+)
 from breezy.revision import NULL_REVISION
-from breezy.workingtree import WorkingTree
+from breezy.switch import switch
+from breezy.workingtree import PointlessMerge, WorkingTree
 
 from tarmac.config import BranchConfig, TreeConfig, StackedConfig
 from tarmac.exceptions import (
@@ -33,6 +40,8 @@ from tarmac.exceptions import (
     TarmacMergeError,
     TarmacMergeSkipError,
 )
+from tarmac.lp import branch_unique_name
+from tarmac.mirror import MirrorStore
 
 
 class Branch(object):
@@ -57,6 +66,33 @@ class Branch(object):
         self.logger = logging.getLogger('tarmac')
         self.exit_stack = ExitStack()
         self.exit_stack.__enter__()
+        # The paths that may differ from the basis of the tree, or None if
+        # the whole tree has to be reset.
+        self._changed = None
+        if config:
+            self.mirrors = MirrorStore(
+                os.path.join(config.CACHE_HOME, 'mirrors'))
+        else:
+            self.mirrors = None
+        if target is not None and config:
+            self._use_mirror(config)
+
+    def _use_mirror(self, config):
+        '''Read and merge from the local mirror of this source branch.
+
+        Mirrors are kept in CACHE_HOME, unless the source_mirrors setting
+        is off.  The remote branch is used when there is no mirror.
+        '''
+        if not config['Tarmac'].getboolean('source_mirrors', True):
+            return
+        unique_name = branch_unique_name(self.lp_branch.unique_name)
+        if unique_name is None:
+            return
+        try:
+            self.bzr_branch = self.mirrors.mirror(self.bzr_branch, unique_name)
+        except (BzrError, OSError) as error:
+            self.logger.warning(
+                'Not using a mirror of %s: %s', unique_name, error)
 
     @staticmethod
     def resolve_lp_url(unique_name, launchpad):
@@ -81,6 +117,8 @@ class Branch(object):
 
     def create_tree(self):
         '''Create the dir and working tree.'''
+        remote = self.bzr_branch
+        self._use_bound_branch()
         tree_dir = self.config.get('tree_dir')
         self.logger.debug('Using tree in %s', tree_dir)
         if tree_dir is None:
@@ -103,6 +141,15 @@ class Branch(object):
                     'administrator to resolve the issue, and try again.')
         elif os.path.exists(tree_dir):
             self.tree = WorkingTree.open(tree_dir)
+            if (self.tree.branch.user_url != self.bzr_branch.user_url and
+                    self._is_checkout_of(remote)):
+                # The bound_tree setting changed since the tree was made.
+                self.logger.debug(
+                    'Switching the tree in %s to %s', tree_dir,
+                    self.bzr_branch.user_url)
+                switch(self.tree.controldir, self.bzr_branch, force=True,
+                       quiet=True)
+                self.tree = WorkingTree.open(tree_dir)
 
             if self.tree.branch.user_url != self.bzr_branch.user_url:
                 self.logger.debug('Tree URLs do not match: %s - %s' % (
@@ -121,31 +168,211 @@ class Branch(object):
             self.tree = self.bzr_branch.create_checkout(
                 tree_dir, lightweight=True)
 
+        self._branch_config = self.config
+        self._load_tree_config()
+        self.cleanup()
+
+    def _is_checkout_of(self, remote):
+        '''Return whether the tree is a lightweight checkout of %remote.
+
+        The local branch bound to %remote counts as well.
+        '''
+        if self.tree.controldir.user_url == self.tree.branch.user_url:
+            return False
+        branch = self.tree.branch
+        return (branch.user_url == remote.user_url or
+                branch.get_bound_location() == remote.base)
+
+    def _use_bound_branch(self):
+        '''Work on a local branch bound to this one, if bound_tree is set.
+
+        The local branch is kept in the shared repository of the project, so
+        the tree is in effect a heavyweight checkout: only commits go to the
+        network, and the graph and revisions are read from disk.  The tree is
+        a lightweight checkout of this branch if the local one can't be used.
+        '''
+        bound_tree = self.config.get('bound_tree', 'false')
+        if not (bound_tree.lower() == 'true' or bound_tree == '1'):
+            return
+        unique_name = branch_unique_name(self.lp_branch.unique_name)
+        if unique_name is None:
+            self.logger.warning(
+                'Not binding %s: it has no project',
+                self.lp_branch.display_name)
+            return
+        try:
+            self.bzr_branch = self.mirrors.bound_branch(
+                self.bzr_branch, unique_name)
+        except (BzrError, OSError) as error:
+            self.logger.warning(
+                'Not binding %s, using a lightweight checkout: %s',
+                unique_name, error)
+
+    def _load_tree_config(self):
+        """Stack the configuration found in the tree on the branch config."""
         tree_config = TreeConfig.from_tree(self.tree)
         if tree_config:
             self.logger.debug(
                 'Reading additional configuration from %r', self.tree)
-            self.config = StackedConfig([self.config, tree_config])
+            self.config = StackedConfig([self._branch_config, tree_config])
+        else:
+            self.config = self._branch_config
 
+    def refresh(self):
+        """Bring a previously created tree up to date for reuse."""
         self.cleanup()
+        if self.tree.branch.get_bound_location() is not None:
+            # Fetches the revisions the master branch has gained.
+            self.tree.update()
+        self._load_tree_config()
 
-    def cleanup(self):
-        '''Remove the working tree from the temp dir.'''
-        assert self.tree
-        self.tree.revert()
-        for filename in [self.tree.abspath(f) for f in self.unmanaged_files]:
-            if os.path.isdir(filename) and not os.path.islink(filename):
-                shutil.rmtree(filename)
-            else:
-                os.remove(filename)
+    def copy_tree(self):
+        """Return a copy of this Branch, with a copy of its tree.
 
-        self.tree.update()
+        The copy of the tree is in a temporary directory, which is removed
+        when the copy's exit_stack is closed.
+        """
+        assert self.tree
+        clone = copy.copy(self)
+        clone.exit_stack = ExitStack()
+        clone.exit_stack.__enter__()
+        clone.temp_tree_dir = tempfile.mkdtemp()
+        clone.exit_stack.callback(
+            shutil.rmtree, clone.temp_tree_dir, ignore_errors=True)
+        tree_dir = os.path.join(clone.temp_tree_dir, 'tree')
+        shutil.copytree(self.tree.basedir, tree_dir, symlinks=True)
+        clone.tree = WorkingTree.open(tree_dir)
+        clone.bzr_branch = bzr_branch.Branch.open(self.bzr_branch.user_url)
+        if self._changed is not None:
+            clone._changed = set(self._changed)
+        return clone
+
+    def reopen(self, target=None):
+        """Return a copy of this Branch, with its own breezy branch.
+
+        Breezy branches and repositories can't be shared between threads, so
+        a copy is needed to read the branch in another thread.  The copy is
+        merged into %target, if given.
+        """
+        clone = copy.copy(self)
+        clone.exit_stack = ExitStack()
+        clone.exit_stack.__enter__()
+        clone.bzr_branch = bzr_branch.Branch.open(self.bzr_branch.user_url)
+        if target is not None:
+            clone.target = target
+        return clone
+
+    def mark_changed(self, paths=None):
+        '''Note that %paths in the tree were changed, to reset them later.
+
+        Without %paths, the whole tree is reverted by the next cleanup.
+        Plugins that change versioned files themselves should call this.
+        '''
+        if paths is None:
+            self._changed = None
+        elif self._changed is not None:
+            self._changed.update(paths)
+
+    def cleanup(self, full=False):
+        '''Bring the tree back to the tip of the branch.
+
+        Only the paths changed since the last cleanup are reverted, unless
+        they aren't known or %full is set, in which case every change is.
+        All unknown and ignored files are removed either way.
+        '''
+        assert self.tree
+        if (not full and self._changed == set()
+                and self.tree.get_parent_ids() == [self._tip()]):
+            return
+        if full or self._changed is None:
+            self.tree.revert()
+            for filename in [
+                    self.tree.abspath(f) for f in self.unmanaged_files]:
+                self._remove(filename)
+        else:
+            self._reset(self._changed)
+            # Files left by plugins, such as the output of a test run, are
+            # found with one walk of the tree.
+            with self.tree.lock_read():
+                extras = list(self.tree.extras())
+            for filename in extras:
+                self._remove(self.tree.abspath(filename))
+        self._changed = set()
+
+        if self.tree.last_revision() != self._tip():
+            self.tree.update()
+
+    def _reset(self, paths):
+        '''Revert %paths, and remove those of them that aren't versioned.'''
+        with self.tree.lock_tree_write():
+            # Without paths the whole tree would be compared.
+            changes = []
+            basis = self.tree.basis_tree()
+            with basis.lock_read():
+                if paths:
+                    changes = list(self.tree.iter_changes(
+                        basis, specific_files=sorted(paths),
+                        want_unversioned=True, require_versioned=False))
+            # The paths the merge added are unversioned and removed rather
+            # than reverted, which would look for them in nested trees.
+            added = [
+                change.path[1] for change in changes
+                if change.versioned == (False, True)]
+            if added:
+                self.tree.unversion(added)
+            for change in changes:
+                if not change.versioned[0]:
+                    self._remove(self.tree.abspath(change.path[1]))
+            # The merge is undone, and looking up the files it changed is
+            # slow once they are unversioned.
+            self.tree.set_merge_modified({})
+            revert = set()
+            for change in changes:
+                if change.versioned[0]:
+                    revert.update(
+                        path for path, versioned in zip(
+                            change.path, change.versioned) if versioned)
+            if revert:
+                self.tree.revert(sorted(revert), backups=False)
+            # Reverting paths leaves the merged revisions pending.
+            self.tree.set_parent_ids(self.tree.get_parent_ids()[:1])
 
-    def merge(self, branch, revid=None):
-        '''Merge from another tarmac.branch.Branch instance.'''
+    @staticmethod
+    def _remove(filename):
+        if os.path.isdir(filename) and not os.path.islink(filename):
+            shutil.rmtree(filename)
+        elif os.path.lexists(filename):
+            os.remove(filename)
+
+    def _tip(self):
+        '''Return the last revision of the branch of the tree.
+
+        For a bound branch that is the local one, which is only brought up
+        to date with its master by refresh(), to keep cleanups off the
+        network.
+        '''
+        return self.tree.branch.last_revision()
+
+    def merge(self, branch, revid=None, force=False):
+        '''Merge from another tarmac.branch.Branch instance.
+
+        Unless %force is set, the tree must not have any uncommitted changes.
+        '''
         assert self.tree
-        conflict_list = self.tree.merge_from_branch(
-            branch.bzr_branch, to_revision=revid)
+        try:
+            self.mark_changed(self._merge_paths(branch, revid))
+            conflict_list = self.tree.merge_from_branch(
+                branch.bzr_branch, to_revision=revid, force=force)
+        except PointlessMerge:
+            raise
+        except BaseException:
+            self.mark_changed()
+            raise
+        for conflict in conflict_list:
+            self.mark_changed(conflict.associated_filenames())
+            self.mark_changed([conflict.path])
+            if getattr(conflict, 'conflict_path', None):
+                self.mark_changed([conflict.conflict_path])
         if conflict_list:
             message = 'Conflicts merging branch.'
             lp_comment = (
@@ -155,6 +382,25 @@ class Branch(object):
                     "output": self.conflicts})
             raise BranchHasConflicts(message, lp_comment)
 
+    def _merge_paths(self, branch, revid=None):
+        '''Return the paths that merging %revid of %branch may change.
+
+        Merging only changes the paths that differ between the basis of the
+        tree and the revision merged.
+        '''
+        repository = branch.bzr_branch.repository
+        if revid is None:
+            revid = branch.bzr_branch.last_revision()
+        paths = set()
+        with repository.lock_read():
+            other = repository.revision_tree(revid)
+            basis = self.tree.basis_tree()
+            with basis.lock_read():
+                for change in other.iter_changes(basis):
+                    paths.update(
+                        path for path in change.path if path is not None)
+        return paths
+
     def merge_tags(self, branch):
         """Merge tags from another branch into this one."""
         branch.tags.merge_to(self.tags, overwrite=True)
@@ -205,7 +451,7 @@ class Branch(object):
             try:
                 self.tree.commit(commit_message, committer=committer,
                                  revprops=revprops, authors=authors)
-            except OutOfDateTree as exc:
+            except (OutOfDateTree, BoundBranchOutOfDate) as exc:
                 raise TarmacMergeSkipError(
                     "Another revision was created on the branch") from exc
             except Exception as exc:
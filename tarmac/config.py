@@ -98,6 +98,14 @@ class TarmacConfig(ConfigParser):
         except KeyError:
             return os.path.join(self.CONFIG_HOME, 'credentials')
 
+    @property
+    def SERVICE_ROOT(self):
+        '''Return the root of the Launchpad API to use instead, if any.'''
+        try:
+            return os.environ['TARMAC_SERVICE_ROOT']
+        except KeyError:
+            return self['Tarmac'].get('service_root')
+
     @property
     def CONFIG_FILE(self):
         '''Return the path to the config file itself.'''
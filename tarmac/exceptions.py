@@ -22,6 +22,9 @@ from breezy.errors import BzrCommandError
 class TarmacMergeError(Exception):
     """An error occurred, preventing the merge of a branch."""
 
+    # The outcome recorded in the landing state for the proposal.
+    outcome = 'failed'
+
     def __init__(self, message, comment=None, *args, **kwargs):
         super(TarmacMergeError, self).__init__(message, *args, **kwargs)
         self.comment = comment
@@ -30,6 +33,8 @@ class TarmacMergeError(Exception):
 class BranchHasConflicts(TarmacMergeError):
     '''Exception for when a branch merge has conflicts.'''
 
+    outcome = 'conflicts'
+
 
 class CommandNotFound(Exception):
     '''Exception for calling a command that that hasn't been registered.'''
@@ -43,9 +48,21 @@ class TarmacCommandError(BzrCommandError):
     '''Exception for various command errors.'''
 
 
+class ReplayError(TarmacCommandError):
+    '''Exception for a request that wasn't in the recording being replayed.'''
+
+
 class UnapprovedChanges(TarmacMergeError):
     '''Exception for when a branch has unapproved changes.'''
 
 
+class PrerequisiteCycle(TarmacMergeError):
+    '''Exception for when a branch depends on itself through prerequisites.'''
+
+
 class TarmacMergeSkipError(Exception):
     """Exception to raise for non-fatal errors that should skip the merge."""
+
+
+class LaunchpadUnavailable(Exception):
+    '''Exception for when requests to the Launchpad API keep failing.'''
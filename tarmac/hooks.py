@@ -29,6 +29,10 @@ class TarmacHookRegistry(hooks.Hooks):
 
         self.logger = logging.getLogger('tarmac')
         self._hooks = [
+            ('tarmac_pre_merge_check',
+             'Called before Tarmac fetches and merges in a branch, to '
+             'check a proposal using only Launchpad data.',
+             (0, 5), False),
             ('tarmac_pre_commit',
              'Called right after Tarmac checks out and merges in a new '
              'branch, but before committing.',
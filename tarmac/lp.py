@@ -0,0 +1,410 @@
+# Copyright 2026 Tarmac Developers
+#
+# This file is part of Tarmac.
+#
+# Tarmac is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by
+# the Free Software Foundation.
+#
+# Tarmac is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Tarmac.  If not, see <http://www.gnu.org/licenses/>.
+
+'''A caching front end to the Launchpad API.
+
+Within a run, entries are only fetched once: CachedLaunchpad remembers them
+by their self_link, along with the results of the lookups on the top-level
+collections.  Linked entries and collections, which launchpadlib fetches
+again every time they are used, are remembered by the HTTP transport until
+something is changed.  Data that rarely changes, such as the identity Tarmac
+runs as, can also be kept on disk for a while, in a TTLStore.
+
+Merge proposals are handled as ProposalSnapshots, which keep the few
+attributes Tarmac reads over and over, so that the linked branches are only
+fetched once for each proposal.
+
+Changes that nothing waits for, such as the comments and statuses set on
+proposals that failed to land, can be made in the background by a
+WriteQueue.
+'''
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait
+from urllib.parse import urlsplit
+
+from tarmac.transport import (
+    RETRIES,
+    RETRY_DELAY,
+    get_http,
+    retry_delay,
+    was_not_sent,
+)
+
+# Number of seconds the identity of the Launchpad user is kept on disk.
+IDENTITY_TTL = 60 * 60 * 24
+
+# The top-level collections whose lookups are remembered for a run, and the
+# named operations on them that only read.
+CACHED_COLLECTIONS = {
+    'branches': ['getByUrl'],
+    'bugs': [],
+    'distributions': [],
+    'people': ['getByEmail'],
+    'projects': [],
+    }
+
+# Number of threads making the changes in a WriteQueue.
+WRITE_THREADS = 4
+
+Identity = namedtuple('Identity', ['name', 'display_name'])
+
+
+class TTLStore:
+    '''A JSON file of values that expire after a number of seconds.'''
+
+    def __init__(self, path):
+        self.path = path
+        self._values = None
+
+    def _load(self):
+        if self._values is None:
+            try:
+                with open(self.path) as f:
+                    self._values = json.load(f)
+            except (OSError, ValueError):
+                self._values = {}
+        return self._values
+
+    def get(self, key):
+        '''Return the value stored for %key, or None if it expired.'''
+        try:
+            expires, value = self._load()[key]
+        except KeyError:
+            return None
+        if expires < time.time():
+            return None
+        return value
+
+    def set(self, key, value, ttl):
+        '''Store %value for %key, for %ttl seconds.'''
+        now = time.time()
+        values = {
+            name: entry for name, entry in self._load().items()
+            if entry[0] >= now}
+        values[key] = [now + ttl, value]
+        self._values = values
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(self.path))
+        with os.fdopen(fd, 'w') as f:
+            json.dump(values, f)
+        os.replace(temp_path, self.path)
+
+
+def branch_unique_name(url):
+    '''Return the unique name of the branch at %url, or None.
+
+    %url is either an lp: URL or the link to the branch in the API.  URLs
+    such as lp:project, which only Launchpad can resolve, give None.
+    '''
+    if url.startswith('lp:'):
+        path = url[len('lp:'):]
+    else:
+        path = urlsplit(url).path
+    segments = [segment for segment in path.split('/') if segment]
+    for index, segment in enumerate(segments):
+        if segment.startswith('~'):
+            if len(segments) == index + 3:
+                return '/'.join(segments[index:])
+            break
+    return None
+
+
+def _remember(entries, entry):
+    """Return the entry in %entries with the self_link of %entry."""
+    self_link = getattr(entry, 'self_link', None)
+    if self_link is None:
+        return entry
+    return entries.setdefault(self_link, entry)
+
+
+class CachedCollection:
+    '''A top-level Launchpad collection, remembering lookups.'''
+
+    def __init__(self, collection, operations, entries):
+        self._collection = collection
+        self._operations = operations
+        self._entries = entries
+        self._items = {}
+
+    def __getitem__(self, key):
+        try:
+            return self._items[key]
+        except KeyError:
+            item = _remember(self._entries, self._collection[key])
+            self._items[key] = item
+            return item
+
+    def __getattr__(self, name):
+        attribute = getattr(self._collection, name)
+        if name not in self._operations:
+            return attribute
+
+        results = {}
+
+        def operation(**kwargs):
+            key = tuple(sorted(kwargs.items()))
+            try:
+                return results[key]
+            except KeyError:
+                result = _remember(self._entries, attribute(**kwargs))
+                results[key] = result
+                return result
+        # Remember the operation, and so its results, for the rest of the run.
+        setattr(self, name, operation)
+        return operation
+
+
+class CachedLaunchpad:
+    '''A Launchpad API root that remembers what it fetched during a run.
+
+    Anything not handled here is passed on to the wrapped root.
+    '''
+
+    def __init__(self, launchpad, store=None):
+        self._launchpad = launchpad
+        self._store = store
+        self.reset()
+
+    def reset(self):
+        '''Forget what was fetched, for the start of a new run.'''
+        self._entries = {}
+        self._members = {}
+        self._collections = {
+            name: CachedCollection(
+                getattr(self._launchpad, name), operations, self._entries)
+            for name, operations in CACHED_COLLECTIONS.items()
+            if hasattr(self._launchpad, name)}
+        self._identity = None
+        http = get_http(self._launchpad)
+        if http is not None:
+            http.remember_responses()
+
+    def __getattr__(self, name):
+        try:
+            return self.__dict__['_collections'][name]
+        except KeyError:
+            return getattr(self.__dict__['_launchpad'], name)
+
+    @property
+    def me(self):
+        '''The Identity of the user Tarmac acts as.'''
+        if self._identity is None:
+            stored = None
+            if self._store is not None:
+                stored = self._store.get(self._identity_key())
+            if stored is None:
+                me = self._launchpad.me
+                stored = [me.name, me.display_name]
+                if self._store is not None:
+                    self._store.set(
+                        self._identity_key(), stored, IDENTITY_TTL)
+            self._identity = Identity(*stored)
+        return self._identity
+
+    def _identity_key(self):
+        '''Return the key the Identity is stored under.
+
+        The user depends on the service root and the token logged in with.
+        '''
+        credentials = getattr(self._launchpad, 'credentials', None)
+        token = getattr(credentials, 'access_token', None)
+        return 'me %s %s' % (
+            getattr(self._launchpad, '_root_uri', None),
+            getattr(token, 'key', None))
+
+    def load(self, url):
+        '''Load the entry at %url, unless it was loaded before.'''
+        try:
+            return self._entries[url]
+        except KeyError:
+            entry = _remember(self._entries, self._launchpad.load(url))
+            self._entries[url] = entry
+            return entry
+
+    def members(self, team):
+        '''Return the list of members of %team.'''
+        self_link = getattr(team, 'self_link', None)
+        if self_link is None:
+            return list(team.members)
+        try:
+            return self._members[self_link]
+        except KeyError:
+            members = [
+                _remember(self._entries, member) for member in team.members]
+            self._members[self_link] = members
+            return members
+
+
+class BranchSnapshot:
+    '''The attributes of a Launchpad branch that Tarmac reads often.
+
+    Other attributes are read from the branch itself.
+    '''
+
+    __slots__ = ('_branch', 'bzr_identity', 'display_name', 'self_link',
+                 'unique_name', 'web_link')
+
+    def __init__(self, branch):
+        object.__setattr__(self, '_branch', branch)
+        for name in self.__slots__[1:]:
+            try:
+                value = getattr(branch, name)
+            except AttributeError:
+                continue
+            object.__setattr__(self, name, value)
+
+    def __getattr__(self, name):
+        return getattr(object.__getattribute__(self, '_branch'), name)
+
+    def __setattr__(self, name, value):
+        if name in self.__slots__:
+            raise AttributeError('%s is read-only' % name)
+        setattr(self._branch, name, value)
+
+
+class ProposalSnapshot:
+    '''A merge proposal, with the attributes Tarmac reads often kept aside.
+
+    The source, target and prerequisite branches are fetched once, when the
+    snapshot is taken, instead of every time they are used.  Anything else,
+    including the operations and changes such as setting the commit message,
+    goes to the live proposal.
+    '''
+
+    __slots__ = ('proposal', 'date_last_modified', 'prerequisite_branch',
+                 'queue_status', 'reviewed_revid', 'self_link',
+                 'source_branch', 'target_branch', 'web_link')
+
+    def __init__(self, proposal):
+        object.__setattr__(self, 'proposal', proposal)
+        for name in ('date_last_modified', 'queue_status', 'reviewed_revid',
+                     'self_link', 'web_link'):
+            try:
+                value = getattr(proposal, name)
+            except AttributeError:
+                continue
+            object.__setattr__(self, name, value)
+        for name in ('source_branch', 'target_branch', 'prerequisite_branch'):
+            branch = getattr(proposal, name, None)
+            if branch is not None:
+                branch = BranchSnapshot(branch)
+            object.__setattr__(self, name, branch)
+
+    @classmethod
+    def from_proposal(cls, proposal):
+        '''Return a snapshot of %proposal, unless it already is one.'''
+        if isinstance(proposal, cls):
+            return proposal
+        return cls(proposal)
+
+    def __getattr__(self, name):
+        return getattr(object.__getattribute__(self, 'proposal'), name)
+
+    def __setattr__(self, name, value):
+        if name in self.__slots__:
+            raise AttributeError('%s is read-only' % name)
+        setattr(self.proposal, name, value)
+
+    def __repr__(self):
+        return '<ProposalSnapshot %s>' % getattr(self, 'web_link', None)
+
+
+class WriteQueue:
+    '''Changes to Launchpad, made in the background.
+
+    Changes put with the same key, such as the self_link of a merge
+    proposal, are made one at a time, in the order they were put in; others
+    are made at the same time by up to %threads threads.  With no threads,
+    changes are made straight away.  A change that fails before it reached
+    Launchpad is tried again up to %retries times; other failures are
+    recorded, since the change may have been made anyway.
+    '''
+
+    def __init__(self, threads=WRITE_THREADS, retries=RETRIES,
+                 delay=RETRY_DELAY):
+        self.threads = threads
+        self.retries = retries
+        self.delay = delay
+        self.logger = logging.getLogger('tarmac')
+        self._lock = threading.Lock()
+        self._executor = None
+        self._last = {}
+        self._failures = []
+
+    def put(self, key, description, function, *args, **kwargs):
+        '''Queue a call of %function, described as %description for logging.
+        '''
+        if self.threads < 1:
+            self._apply(None, description, function, args, kwargs)
+            return
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.threads,
+                    thread_name_prefix='tarmac-write')
+            self._last[key] = self._executor.submit(
+                self._apply, self._last.get(key), description, function,
+                args, kwargs)
+
+    def _apply(self, previous, description, function, args, kwargs):
+        # Changes are submitted in order, so the previous change for this
+        # key has already been started by another thread.
+        if previous is not None:
+            wait([previous])
+        for attempt in range(self.retries + 1):
+            try:
+                function(*args, **kwargs)
+                return
+            except Exception as error:
+                if not was_not_sent(error) or attempt == self.retries:
+                    self.logger.error(
+                        'Failed to %s: %s', description, error)
+                    with self._lock:
+                        self._failures.append((description, error))
+                    return
+                self.logger.debug(
+                    'Retrying to %s after error: %s', description, error)
+                time.sleep(retry_delay(
+                    attempt, getattr(error, 'response', None), self.delay))
+
+    def flush(self):
+        '''Wait for the queued changes to be made.
+
+        Returns the descriptions of the changes that failed, and the errors
+        they failed with.
+        '''
+        with self._lock:
+            executor, self._executor = self._executor, None
+            self._last = {}
+        if executor is not None:
+            executor.shutdown(wait=True)
+        with self._lock:
+            failures, self._failures = self._failures, []
+        return failures
+
+
+def cached(launchpad, store=None):
+    '''Return %launchpad wrapped in a CachedLaunchpad, unless it already is.
+    '''
+    if isinstance(launchpad, CachedLaunchpad):
+        return launchpad
+    return CachedLaunchpad(launchpad, store=store)
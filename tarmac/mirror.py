@@ -0,0 +1,120 @@
+# Copyright 2026 Tarmac Developers
+#
+# This file is part of Tarmac.
+#
+# Tarmac is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by
+# the Free Software Foundation.
+#
+# Tarmac is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Tarmac.  If not, see <http://www.gnu.org/licenses/>.
+
+'''Local mirrors of the branches Tarmac merges from.
+
+Mirrors are kept in a shared repository for each project, so the revisions
+that the branches of a project have in common are only fetched and stored
+once.  A mirror is laid out like the unique name of its branch:
+``<project>/~<owner>/<name>`` below the directory of the store.  The
+local branches bound to target branches share the same repositories.
+'''
+import logging
+import os
+
+from breezy import branch as bzr_branch
+from breezy.controldir import ControlDir
+from breezy.errors import NotBranchError
+
+# Where the local branches bound to target branches are kept in the shared
+# repository of a project.  Owners start with ~, so this doesn't clash.
+BOUND_DIRECTORY = '+bound'
+
+
+class MirrorStore:
+    '''Shared repositories of branch mirrors, one for each project.'''
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.logger = logging.getLogger('tarmac')
+
+    def repository(self, project, format=None):
+        '''Return the path of the shared repository for %project.
+
+        The repository is created in %format, a ControlDirFormat, if it
+        doesn't exist yet.
+        '''
+        path = os.path.join(self.directory, project)
+        try:
+            ControlDir.open(path).open_repository()
+        except NotBranchError:
+            self.logger.debug('Creating shared repository in %s', path)
+            os.makedirs(path, exist_ok=True)
+            if format is None:
+                controldir = ControlDir.create(path)
+            else:
+                controldir = format.initialize(path)
+            repository = controldir.create_repository(shared=True)
+            repository.set_make_working_trees(False)
+        return path
+
+    def path(self, unique_name, bound=False):
+        '''Return where the mirror of the branch %unique_name is kept.
+
+        With %bound, return where the local branch bound to it is kept.
+        '''
+        owner, project, name = unique_name.split('/')
+        if bound:
+            return os.path.join(
+                self.directory, project, BOUND_DIRECTORY, owner, name)
+        return os.path.join(self.directory, project, owner, name)
+
+    def mirror(self, branch, unique_name):
+        '''Return the local mirror of %branch, with its new revisions.
+
+        The mirror is made the first time, and afterwards only the revisions
+        it lacks are pulled.  It follows %branch when that is overwritten.
+        '''
+        path = self.path(unique_name)
+        try:
+            local = bzr_branch.Branch.open(path)
+        except NotBranchError:
+            self.repository(
+                unique_name.split('/')[1],
+                branch.controldir.cloning_metadir())
+            self.logger.debug('Mirroring %s in %s', unique_name, path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            return branch.controldir.sprout(
+                path, create_tree_if_local=False).open_branch()
+        self.logger.debug('Updating the mirror of %s', unique_name)
+        local.pull(branch, overwrite=True)
+        return local
+
+    def bound_branch(self, branch, unique_name):
+        '''Return a local branch bound to %branch, with its new revisions.
+
+        Commits to the local branch are made on %branch first, and fail if
+        %branch has revisions the local branch lacks.
+        '''
+        path = self.path(unique_name, bound=True)
+        try:
+            local = bzr_branch.Branch.open(path)
+        except NotBranchError:
+            self.repository(
+                unique_name.split('/')[1],
+                branch.controldir.cloning_metadir())
+            self.logger.debug('Binding %s in %s', unique_name, path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            local = branch.controldir.sprout(
+                path, create_tree_if_local=False).open_branch()
+            local.bind(branch)
+            return local
+        if local.get_bound_location() != branch.base:
+            local.bind(branch)
+        self.logger.debug('Updating the bound branch of %s', unique_name)
+        local.update()
+        return local
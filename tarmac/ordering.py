@@ -0,0 +1,168 @@
+# Copyright 2026 Tarmac Developers
+#
+# This file is part of Tarmac.
+#
+# Tarmac is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by
+# the Free Software Foundation.
+#
+# Tarmac is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Tarmac.  If not, see <http://www.gnu.org/licenses/>.
+
+'''Ordering of approved proposals for landing.
+
+A policy is registered in ``landing_orders`` as a function that takes the
+OwnerStats of earlier landings, keyed by owner, and returns a sort key for
+proposals.  Proposals are always sorted by prerequisites first, so the key
+only decides the order of proposals that don't depend on each other.
+'''
+from breezy.registry import Registry
+
+
+class LandingGraph:
+    '''The prerequisites between proposals to the same target.
+
+    Every proposal depends on at most one other, the proposal of its
+    prerequisite branch, so the proposals form independent chains (or trees),
+    unless prerequisites form a cycle.  Proposals in a cycle, or depending on
+    one, can never be landed.
+    '''
+
+    def __init__(self, proposals):
+        self.proposals = list(proposals)
+        self._prerequisites = {}
+        for proposal in self.proposals:
+            prerequisite = proposal.prerequisite_branch
+            self._prerequisites[proposal.source_branch.unique_name] = (
+                prerequisite.unique_name if prerequisite else None)
+        self._depths = {}
+        self._roots = {}
+        self._cyclic = set()
+        for name in self._prerequisites:
+            self._resolve(name)
+
+    def _resolve(self, name):
+        """Work out the depth and root of the branch %name, and its chain."""
+        path = []
+        seen = set()
+        while name not in self._depths and name not in self._cyclic:
+            if name in seen:
+                self._cyclic.update(path)
+                return
+            path.append(name)
+            seen.add(name)
+            prerequisite = self._prerequisites[name]
+            if prerequisite not in self._prerequisites:
+                path.pop()
+                self._depths[name] = 0
+                self._roots[name] = name
+                break
+            name = prerequisite
+        if name in self._cyclic:
+            self._cyclic.update(path)
+            return
+        depth = self._depths[name]
+        root = self._roots[name]
+        for name in reversed(path):
+            depth += 1
+            self._depths[name] = depth
+            self._roots[name] = root
+
+    def depth(self, proposal):
+        '''Return the number of prerequisites of %proposal to land first.
+
+        Returns None if %proposal is in or behind a cycle.
+        '''
+        return self._depths.get(proposal.source_branch.unique_name)
+
+    def in_cycle(self, proposal):
+        '''Return whether %proposal is in or behind a prerequisite cycle.'''
+        return proposal.source_branch.unique_name in self._cyclic
+
+    def chains(self):
+        '''Return the proposals as lists that don't depend on each other.
+
+        Each list is sorted by prerequisites first; proposals in or behind a
+        cycle are left out.
+        '''
+        chains = {}
+        for proposal in self.sorted():
+            name = proposal.source_branch.unique_name
+            if name not in self._cyclic:
+                chains.setdefault(self._roots[name], []).append(proposal)
+        return list(chains.values())
+
+    def sorted(self, order=None):
+        '''Return the proposals, sorted by prerequisites first.
+
+        Proposals at the same depth are sorted by the %order key function, if
+        given, and otherwise kept in their order.  Proposals in or behind a
+        cycle come last.
+        '''
+        # Depths are below the number of proposals, so bucketing the
+        # proposals by depth takes linear time; only %order needs a sort.
+        levels = [[] for _ in range(len(self._depths) + 1)]
+        for proposal in self.proposals:
+            depth = self.depth(proposal)
+            levels[len(self._depths) if depth is None else depth].append(
+                proposal)
+        proposals = []
+        for level in levels:
+            if order is not None:
+                level.sort(key=order)
+            proposals.extend(level)
+        return proposals
+
+
+def proposal_owner(proposal):
+    '''Return the name of the owner of the source branch of %proposal.'''
+    return proposal.source_branch.unique_name.split('/')[0].lstrip('~')
+
+
+def fifo(stats):
+    '''Keep the order in which Launchpad returns the proposals.'''
+    return lambda proposal: 0
+
+
+def shortest_first(stats):
+    '''Land proposals of owners whose proposals verify quickest first.'''
+    durations = [
+        owner.mean_duration for owner in stats.values()
+        if owner.mean_duration is not None]
+    default = sum(durations) / len(durations) if durations else 0
+
+    def key(proposal):
+        owner = stats.get(proposal_owner(proposal))
+        if owner is None or owner.mean_duration is None:
+            return default
+        return owner.mean_duration
+    return key
+
+
+def likely_first(stats):
+    '''Land proposals of owners whose proposals land most often first.'''
+
+    def key(proposal):
+        owner = stats.get(proposal_owner(proposal))
+        attempts, landed = (0, 0) if owner is None else owner[:2]
+        # Owners without history are assumed to land half the time.
+        return -(landed + 1) / (attempts + 2)
+    return key
+
+
+landing_orders = Registry()
+landing_orders.register(
+    'fifo', fifo, help='In the order Launchpad returns them.')
+landing_orders.register(
+    'shortest-first', shortest_first,
+    help='Shortest expected verification first.')
+landing_orders.register(
+    'likely-first', likely_first,
+    help='Most likely to pass verification first.')
+landing_orders.default_key = 'fifo'
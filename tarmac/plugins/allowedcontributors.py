@@ -19,6 +19,7 @@ import re
 from lazr.restfulclient.errors import Unauthorized
 from tarmac.exceptions import TarmacMergeError
 from tarmac.hooks import tarmac_hooks
+from tarmac.lp import cached
 from tarmac.plugins import TarmacPlugin
 
 
@@ -44,7 +45,7 @@ class AllowedContributors(TarmacPlugin):
         if allowed_contributors is None:
             return
 
-        self.allowed_contributors = allowed_contributors.split(',')
+        allowed_contributors = allowed_contributors.split(',')
 
         self.logger.debug(
             'Checking that authors of %s are allowed to '
@@ -52,7 +53,7 @@ class AllowedContributors(TarmacPlugin):
             proposal.source_branch.display_name,
             proposal.target_branch.display_name)
 
-        launchpad = command.launchpad
+        launchpad = cached(command.launchpad)
 
         invalid_contributors = []
         for name in source.authors:
@@ -62,15 +63,16 @@ class AllowedContributors(TarmacPlugin):
                 invalid_contributors.append(email)
                 continue
 
-            if author.name in self.allowed_contributors:
+            if author.name in allowed_contributors:
                 continue
             else:
                 in_team = False
-                for team in self.allowed_contributors:
+                for team in allowed_contributors:
                     try:
                         lp_team = launchpad.people[team]
                         if lp_team.is_team:
-                            in_team = self.is_in_team(author, lp_team)
+                            in_team = self.is_in_team(
+                                author, lp_team, launchpad)
                             if in_team:
                                 break
                     except Unauthorized:
@@ -102,16 +104,21 @@ class AllowedContributors(TarmacPlugin):
                 'teams on Launchpad.\n\n'
                 'Persons or Teams:\n\n    %(teams)s\n\n'
                 'Unaccepted Authors:\n\n    %(authors)s' % {
-                    'teams': '\n    '.join(sorted(self.allowed_contributors)),
+                    'teams': '\n    '.join(sorted(allowed_contributors)),
                     'authors': '\n    '.join(sorted(invalid_contributors))})
             raise InvalidContributor(message, comment)
 
-    def is_in_team(self, person, team):
+    def is_in_team(self, person, team, launchpad=None):
         """Check that a person is a member of team, or one of its subteams."""
-        for subteam in team.members:
+        if launchpad is None:
+            members = team.members
+        else:
+            members = launchpad.members(team)
+        for subteam in members:
             if str(subteam) == str(person):
                 return True
-            if subteam.is_team and self.is_in_team(person, subteam):
+            if subteam.is_team and self.is_in_team(
+                    person, subteam, launchpad):
                 return True
         return False
 
@@ -58,7 +58,9 @@ class BugResolver(TarmacPlugin):
             if task:
                 task.status = 'Fix Committed'
                 self._set_milestone_on_task(project, task)
-                task.lp_save()
+                command.queue_write(
+                    'bug %s' % bug_id, 'mark bug %s fixed' % bug_id,
+                    task.lp_save)
             else:
                 self.logger.info('Target %s/%s not found in bug #%s.',
                                  project.name, series.name, bug_id)
@@ -15,11 +15,16 @@
 # along with Tarmac.  If not, see <http://www.gnu.org/licenses/>.
 '''Tarmac plugin for running tests pre-commit.'''
 
+from collections import OrderedDict
 from tempfile import TemporaryDirectory
 
 from breezy.export import export
+import hashlib
 import os
+import stat
 import subprocess
+import threading
+import time
 from typing import NoReturn
 
 from tarmac.exceptions import TarmacMergeError, TarmacMergeSkipError
@@ -37,10 +42,21 @@ OUTPUT_TIMEOUT = 60 * 15
 # Maximum run time for any command.
 REGULAR_TIMEOUT = 60 * 60
 
+# Number of tree states that are remembered to have passed verification.
+VERIFIED_STATES = 100
+
+# Bounds on the cache of trees that passed verification, kept in CACHE_HOME.
+# The maximum age (in seconds) can be set with verify_cache_age for a branch;
+# 0 disables the cache.
+VERIFY_CACHE_ENTRIES = 1000
+VERIFY_CACHE_AGE = 60 * 60 * 24 * 7
+
 
 class VerifyCommandFailed(TarmacMergeError):
     """Running the verify_command failed."""
 
+    outcome = 'verify-failed'
+
 
 class SetupCommandFailed(TarmacMergeSkipError):
     """Running the setup_command failed."""
@@ -70,6 +86,75 @@ def killem(pid, signal):
             raise
 
 
+def hash_tree(path):
+    """Return a hash of the contents of the directory at %path."""
+    digest = hashlib.sha256()
+    for dirpath, dirnames, filenames in os.walk(path):
+        dirnames.sort()
+        for name in sorted(dirnames + filenames):
+            full_path = os.path.join(dirpath, name)
+            digest.update(os.path.relpath(full_path, path).encode('utf-8'))
+            mode = os.lstat(full_path).st_mode
+            if stat.S_ISLNK(mode):
+                digest.update(b'\0l' + os.readlink(full_path).encode('utf-8'))
+            elif stat.S_ISDIR(mode):
+                digest.update(b'\0d')
+            else:
+                digest.update(b'\0x' if mode & stat.S_IXUSR else b'\0f')
+                with open(full_path, 'rb') as f:
+                    digest.update(hashlib.sha256(f.read()).digest())
+            digest.update(b'\0')
+    return digest.hexdigest()
+
+
+class VerifyCache:
+    """A record of trees that passed verification, kept on disk.
+
+    Every entry is an empty file named after the key, with the time it
+    passed as its modification time.
+    """
+
+    def __init__(self, path, max_age=VERIFY_CACHE_AGE,
+                 max_entries=VERIFY_CACHE_ENTRIES):
+        self.path = path
+        self.max_age = max_age
+        self.max_entries = max_entries
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+
+    def __contains__(self, key):
+        try:
+            passed = os.stat(os.path.join(self.path, key)).st_mtime
+        except FileNotFoundError:
+            return False
+        return time.time() - passed <= self.max_age
+
+    def add(self, key):
+        """Record that the tree with %key passed."""
+        with open(os.path.join(self.path, key), 'w'):
+            pass
+        self.prune()
+
+    def prune(self):
+        """Remove the entries that are too old, or too many."""
+        now = time.time()
+        entries = []
+        for name in os.listdir(self.path):
+            entry = os.path.join(self.path, name)
+            try:
+                passed = os.stat(entry).st_mtime
+            except FileNotFoundError:
+                continue
+            entries.append((passed, entry))
+        entries.sort(reverse=True)
+        for index, (passed, entry) in enumerate(entries):
+            if index >= self.max_entries or now - passed > self.max_age:
+                try:
+                    os.remove(entry)
+                except FileNotFoundError:
+                    pass
+
+
 class NoOutput(Exception):
 
     def __init__(self, timeout, command, output):
@@ -165,21 +250,42 @@ class Command(TarmacPlugin):
     This plugin checks for a config setting specific to the project.  If it
     finds one, it will run that command pre-commit.  On fail, it calls the
     do_failed method, and on success, continues.
+
+    Once a tree has passed, the same tree with the same commands isn't
+    verified again, so that a batch of proposals merged into one tree only
+    gets verified once.  Trees with the same contents are recognised across
+    runs as well, by a hash of the exported tree.
     '''
 
+    def __init__(self):
+        super(Command, self).__init__()
+        self._verified = OrderedDict()
+        # Trains verify their cars from a pool of threads.
+        self._lock = threading.Lock()
+
     def run(self, command, target, source, proposal):
-        self.fixup_command = target.config.get("fixup_command")
-        self.verify_command = target.config.get('verify_command')
-        self.verify_command_output_timeout = int(
+        fixup_command = target.config.get("fixup_command")
+        verify_command = target.config.get('verify_command')
+        verify_command_output_timeout = int(
             target.config.get('verify_command_output_timeout', OUTPUT_TIMEOUT))
-        self.verify_command_timeout = int(
+        verify_command_timeout = int(
             target.config.get('verify_command_timeout', REGULAR_TIMEOUT))
+        verify_cache_age = int(
+            target.config.get('verify_cache_age', VERIFY_CACHE_AGE))
 
-        if not self.verify_command:
+        if not verify_command:
             return
 
-        self.proposal = proposal
-        self.setup_command = target.config.get('setup_command')
+        setup_command = target.config.get('setup_command')
+
+        state = (tuple(target.tree.get_parent_ids()),
+                 setup_command, fixup_command, verify_command)
+        with self._lock:
+            verified = state in self._verified
+        if verified:
+            self.logger.debug(
+                'Tree has already passed test command: %s', verify_command)
+            return
 
         cwd = os.getcwd()
         # Export the changes to a temporary directory, and run the command
@@ -191,12 +297,28 @@ class Command(TarmacPlugin):
             export(target.tree, export_dest, per_file_timestamps=False,
                    recurse_nested=True)
 
-            if self.setup_command:
+            cache = key = None
+            if verify_cache_age:
+                cache = VerifyCache(
+                    os.path.join(command.config.CACHE_HOME, 'verify-cache'),
+                    max_age=verify_cache_age)
+                key = hashlib.sha256('\0'.join(
+                    [hash_tree(export_dest), setup_command or '',
+                     fixup_command or '', verify_command]).encode(
+                         'utf-8')).hexdigest()
+                if key in cache:
+                    self.logger.debug(
+                        'Tree contents have already passed test command: %s',
+                        verify_command)
+                    self._remember(state)
+                    return
+
+            if setup_command:
                 self.logger.debug('Running setup command: %s',
-                                  self.setup_command)
+                                  setup_command)
                 try:
                     subprocess.check_call(
-                        self.setup_command,
+                        setup_command,
                         shell=True,
                         timeout=REGULAR_TIMEOUT,
                         stdin=subprocess.DEVNULL,
@@ -205,20 +327,21 @@ class Command(TarmacPlugin):
                         cwd=export_dest)
                 except subprocess.TimeoutExpired as e:
                     self.do_setup_failed(
-                        'Command timeout out after %d seconds.'
-                        % e.timeout, e.output)
+                        setup_command,
+                        'Command timeout out after %d seconds.' % e.timeout,
+                        e.output)
                 except subprocess.CalledProcessError as e:
                     self.do_setup_failed(
-                        'Command exited with %d' % e.returncode,
-                        e.output)
+                        setup_command,
+                        'Command exited with %d' % e.returncode, e.output)
 
-            if self.fixup_command:
+            if fixup_command:
                 self.logger.debug("Running fixup command: %s",
-                                  self.fixup_command)
+                                  fixup_command)
 
                 try:
                     subprocess.check_call(
-                        self.fixup_command,
+                        fixup_command,
                         shell=True,
                         timeout=REGULAR_TIMEOUT,
                         stdin=subprocess.DEVNULL,
@@ -227,41 +350,56 @@ class Command(TarmacPlugin):
                         cwd=export_dest)
                 except subprocess.TimeoutExpired as e:
                     self.do_setup_failed(
-                        'Command timeout out after %d seconds.'
-                        % e.timeout, e.output)
+                        fixup_command,
+                        'Command timeout out after %d seconds.' % e.timeout,
+                        e.output)
                 except subprocess.CalledProcessError as e:
                     self.do_setup_failed(
-                        'Command exited with %d' % e.returncode,
-                        e.output)
+                        fixup_command,
+                        'Command exited with %d' % e.returncode, e.output)
 
-            self.logger.debug('Running test command: %s', self.verify_command)
+            self.logger.debug('Running test command: %s', verify_command)
             try:
                 run_command_with_output_timeout(
-                    self.verify_command,
+                    verify_command,
                     logger=self.logger,
-                    timeout=self.verify_command_timeout,
-                    output_timeout=self.verify_command_output_timeout,
+                    timeout=verify_command_timeout,
+                    output_timeout=verify_command_output_timeout,
                     cwd=export_dest)
             except subprocess.TimeoutExpired as e:
                 self.do_failed(
+                    proposal, verify_command,
                     '(``verify_command_timeout``) '
                     'Command ran for more than %d seconds.' % e.timeout,
                     e.output)
             except NoOutput as e:
                 self.do_failed(
+                    proposal, verify_command,
                     '(``verify_command_output_timeout``) '
                     'Command sent no output for %d seconds.' % e.timeout,
                     e.output)
             except subprocess.CalledProcessError as e:
                 self.do_failed(
+                    proposal, verify_command,
                     'Command exited with %d.' % e.returncode, e.output)
 
             os.chdir(cwd)
             self.logger.debug(
                 'Completed test command: %s',
-                self.verify_command)
+                verify_command)
+            if cache is not None:
+                cache.add(key)
+
+        self._remember(state)
+
+    def _remember(self, state):
+        """Remember that the tree %state passed verification."""
+        with self._lock:
+            self._verified[state] = True
+            while len(self._verified) > VERIFIED_STATES:
+                self._verified.popitem(last=False)
 
-    def do_failed(self, reason, output_value):
+    def do_failed(self, proposal, verify_command, reason, output_value):
         '''Perform failure tests.
 
         In this case, the output of the test command is posted as a comment,
@@ -270,7 +408,7 @@ class Command(TarmacPlugin):
         exception is then raised to prevent the commit from happening.
         '''
         message = 'Test command "%s" failed: %s' % (
-            self.verify_command, reason)
+            verify_command, reason)
         full_output_value = output_value.decode('UTF-8', 'replace')
         output_value = trim_output(full_output_value)
         comment = ('The attempt to merge %(source)s into %(target)s failed. '
@@ -278,25 +416,26 @@ class Command(TarmacPlugin):
                    'Below is the output from the failed tests.\n\n'
                    '%(output)s') % {
             'reason': reason,
-            'source': self.proposal.source_branch.display_name,
-            'target': self.proposal.target_branch.display_name,
+            'source': proposal.source_branch.display_name,
+            'target': proposal.target_branch.display_name,
             'output': output_value,
             }
         self.logger.info(
-            'Output of failed command %s: %s', self.verify_command,
+            'Output of failed command %s: %s', verify_command,
             output_value)
         raise VerifyCommandFailed(message, comment)
 
-    def do_setup_failed(self, reason, output_value) -> NoReturn:
+    def do_setup_failed(self, setup_command, reason,
+                        output_value) -> NoReturn:
         '''Perform setup failure tests.
         '''
         message = 'Setup command "%s" failed: %s' % (
-            self.setup_command, reason)
+            setup_command, reason)
         if output_value is not None:
             full_output_value = output_value.decode('UTF-8', 'replace')
             output_value = trim_output(full_output_value)
             self.logger.info(
-                'Output of failed setup command %s: %s', self.setup_command,
+                'Output of failed setup command %s: %s', setup_command,
                 output_value)
         raise SetupCommandFailed(message, output_value)
 
@@ -31,6 +31,7 @@ class BugResolverTests(TarmacTestCase):
         self.now = datetime.utcnow()
         self.proposal = Thing()
         self.plugin = BugResolver()
+        self.writes = []
         self.plugin.config = {
             "set_milestone": "False",
             "default_milestone": None}
@@ -97,18 +98,24 @@ class BugResolverTests(TarmacTestCase):
         """Dummy lp_save method."""
         pass
 
+    def queue_write(self, key, description, function, *args, **kwargs):
+        """Fake queue_write method for commands, writing straight away."""
+        self.writes.append(description)
+        function(*args, **kwargs)
+
     def test_run(self):
         """Test that the plug-in runs correctly."""
         target = Thing(fixed_bugs=list(self.bugs.keys()),
                        lp_branch=Thing(project=self.projects[0],
                                        bzr_identity='lp:target'))
         launchpad = Thing(bugs=self.bugs)
-        command = Thing(launchpad=launchpad)
+        command = Thing(launchpad=launchpad, queue_write=self.queue_write)
         self.plugin.run(command=command, target=target, source=None,
                         proposal=self.proposal)
         self.assertEqual(self.bugs['0'].bug_tasks[0].status, 'Fix Committed')
         self.assertEqual(self.bugs['0'].bug_tasks[1].status, 'Incomplete')
         self.assertEqual(self.bugs['1'].bug_tasks[0].status, 'Confirmed')
+        self.assertEqual(['mark bug 0 fixed'], self.writes)
 
     def test_run_with_set_milestone(self):
         """
@@ -122,7 +129,7 @@ class BugResolverTests(TarmacTestCase):
                                        bzr_identity='lp:target'),
                        config=Thing(set_milestone="true"))
         launchpad = Thing(bugs=self.bugs)
-        command = Thing(launchpad=launchpad)
+        command = Thing(launchpad=launchpad, queue_write=self.queue_write)
         self.plugin.run(command=command, target=target, source=None,
                         proposal=self.proposal)
         self.assertEqual(self.bugs['0'].bug_tasks[0].milestone,
@@ -137,7 +144,7 @@ class BugResolverTests(TarmacTestCase):
                        lp_branch=Thing(project=self.projects[0],
                                        bzr_identity='lp:target/stable'))
         launchpad = Thing(bugs=self.bugs)
-        command = Thing(launchpad=launchpad)
+        command = Thing(launchpad=launchpad, queue_write=self.queue_write)
         self.plugin.run(command=command, target=target, source=None,
                         proposal=self.proposal)
         self.assertEqual(self.bugs['0'].bug_tasks[0].status, 'In Progress')
@@ -150,7 +157,7 @@ class BugResolverTests(TarmacTestCase):
                        lp_branch=Thing(project=self.projects[0],
                                        bzr_identity='lp:target/stable'))
         launchpad = Thing(bugs=self.bugs)
-        command = Thing(launchpad=launchpad)
+        command = Thing(launchpad=launchpad, queue_write=self.queue_write)
         self.plugin.run(command=command, target=target, source=None,
                         proposal=self.proposal)
         self.assertEqual(self.bugs['0'].bug_tasks[0].status, 'In Progress')
@@ -163,7 +170,7 @@ class BugResolverTests(TarmacTestCase):
                        lp_branch=Thing(project=self.projects[0],
                                        bzr_identity='lp:target/invalid'))
         launchpad = Thing(bugs=self.bugs)
-        command = Thing(launchpad=launchpad)
+        command = Thing(launchpad=launchpad, queue_write=self.queue_write)
         self.plugin.run(command=command, target=target, source=None,
                         proposal=self.proposal)
         self.assertEqual(self.bugs['0'].bug_tasks[0].status, 'In Progress')
@@ -13,7 +13,9 @@
 # along with Tarmac.  If not, see <http://www.gnu.org/licenses/>.
 """Tests for the Command plug-in."""
 
+from concurrent.futures import ThreadPoolExecutor
 import os
+import time
 
 from unittest.mock import patch
 from tarmac.bin.registry import CommandRegistry
@@ -43,7 +45,8 @@ class TestCommand(TarmacTestCase):
         """Test that the plug-in runs without errors."""
         target = Thing(config=Thing(
                 verify_command="/bin/true"),
-                       tree=Thing(abspath=os.path.abspath))
+                       tree=Thing(abspath=os.path.abspath,
+                                  get_parent_ids=lambda: [b'parent']))
         self.plugin.run(
             command=self.command, target=target, source=None,
             proposal=self.proposal)
@@ -53,7 +56,8 @@ class TestCommand(TarmacTestCase):
         """Test that a failure raises the correct exception."""
         target = Thing(config=Thing(
                 verify_command="/bin/false"),
-                       tree=Thing(abspath=os.path.abspath))
+                       tree=Thing(abspath=os.path.abspath,
+                                  get_parent_ids=lambda: [b'parent']))
         self.assertRaises(command.VerifyCommandFailed,
                           self.plugin.run,
                           command=self.command, target=target, source=None,
@@ -64,7 +68,8 @@ class TestCommand(TarmacTestCase):
         """Test that the plug-in runs the command in an exported tree."""
         target = Thing(config=Thing(
                 verify_command="/bin/true"),
-                       tree=Thing(abspath=os.path.abspath))
+                       tree=Thing(abspath=os.path.abspath,
+                                  get_parent_ids=lambda: [b'parent']))
         self.plugin.run(
             command=self.command, target=target, source=None,
             proposal=self.proposal)
@@ -85,7 +90,8 @@ class TestCommand(TarmacTestCase):
                 "python -c 'import sys;"
                 " sys.stdout.write(\"f\xe5\xefl\");"
                 " sys.exit(1)'")),
-            tree=Thing(abspath=os.path.abspath))
+            tree=Thing(abspath=os.path.abspath,
+                       get_parent_ids=lambda: [b'parent']))
         e = self.assertRaises(command.VerifyCommandFailed,
                               self.plugin.run,
                               command=self.command, target=target, source=None,
@@ -95,3 +101,115 @@ class TestCommand(TarmacTestCase):
                          ' Below is the output from the failed tests.'
                          '\n\nf\xe5\xefl\n',
                          e.comment)
+
+    @patch('tarmac.plugins.command.export')
+    def test_run_verifies_tree_once(self, mocked):
+        """Test that a tree that passed isn't verified again."""
+        target = Thing(config=Thing(
+                verify_command="/bin/true"),
+                       tree=Thing(abspath=os.path.abspath,
+                                  get_parent_ids=lambda: [b'parent']))
+        for _ in range(2):
+            self.plugin.run(
+                command=self.command, target=target, source=None,
+                proposal=self.proposal)
+        self.assertEqual(1, mocked.call_count)
+
+    @patch('tarmac.plugins.command.export')
+    def test_run_verifies_contents_once(self, mocked):
+        """Test that trees with the same contents aren't verified again."""
+        for parent in [b'parent', b'other-parent']:
+            target = Thing(config=Thing(
+                    verify_command="/bin/true"),
+                           tree=Thing(abspath=os.path.abspath,
+                                      get_parent_ids=lambda: [parent]))
+            with patch('tarmac.plugins.command.'
+                       'run_command_with_output_timeout') as run_command:
+                self.plugin.run(
+                    command=self.command, target=target, source=None,
+                    proposal=self.proposal)
+        self.assertEqual(2, mocked.call_count)
+        self.assertEqual(0, run_command.call_count)
+
+    def test_remember_from_threads(self):
+        """Test that trees can be remembered from several threads at once."""
+        def remember(thread):
+            for index in range(command.VERIFIED_STATES):
+                self.plugin._remember((thread, index))
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            for done in [executor.submit(remember, thread)
+                         for thread in range(4)]:
+                done.result()
+        self.assertEqual(
+            command.VERIFIED_STATES, len(self.plugin._verified))
+
+    @patch('tarmac.plugins.command.export')
+    def test_run_failure_not_cached(self, mocked):
+        """Test that a tree that failed is verified again."""
+        target = Thing(config=Thing(
+                verify_command="/bin/false"),
+                       tree=Thing(abspath=os.path.abspath,
+                                  get_parent_ids=lambda: [b'parent']))
+        for _ in range(2):
+            self.assertRaises(command.VerifyCommandFailed,
+                              self.plugin.run,
+                              command=self.command, target=target,
+                              source=None, proposal=self.proposal)
+
+
+class TestVerifyCache(TarmacTestCase):
+    """Test the cache of trees that passed verification."""
+
+    def setUp(self):
+        super(TestVerifyCache, self).setUp()
+        self.cache = command.VerifyCache(
+            os.path.join(self.config.CACHE_HOME, 'verify-cache'),
+            max_age=60, max_entries=2)
+
+    def test_add(self):
+        self.assertNotIn('key', self.cache)
+        self.cache.add('key')
+        self.assertIn('key', self.cache)
+
+    def test_expired(self):
+        self.cache.add('key')
+        old = time.time() - 120
+        os.utime(os.path.join(self.cache.path, 'key'), (old, old))
+        self.assertNotIn('key', self.cache)
+        self.cache.prune()
+        self.assertEqual([], os.listdir(self.cache.path))
+
+    def test_prune_oldest(self):
+        for index, key in enumerate(['first', 'second', 'third']):
+            self.cache.add(key)
+            added = time.time() - 10 + index
+            os.utime(os.path.join(self.cache.path, key), (added, added))
+        self.cache.prune()
+        self.assertEqual(['second', 'third'],
+                         sorted(os.listdir(self.cache.path)))
+
+
+class TestHashTree(TarmacTestCase):
+    """Test hashing the contents of exported trees."""
+
+    def make_tree(self, name, files):
+        path = os.path.join(self.tempdir, name)
+        os.makedirs(path)
+        for filename, content in files.items():
+            with open(os.path.join(path, filename), 'w') as f:
+                f.write(content)
+        return path
+
+    def test_same_contents(self):
+        self.assertEqual(
+            command.hash_tree(self.make_tree('a', {'f': 'x', 'g': 'y'})),
+            command.hash_tree(self.make_tree('b', {'g': 'y', 'f': 'x'})))
+
+    def test_different_contents(self):
+        self.assertNotEqual(
+            command.hash_tree(self.make_tree('a', {'f': 'x'})),
+            command.hash_tree(self.make_tree('b', {'f': 'y'})))
+        self.assertNotEqual(
+            command.hash_tree(self.make_tree('c', {'f': 'x'})),
+            command.hash_tree(self.make_tree('d', {'g': 'x'})))
@@ -92,7 +92,7 @@ class TestVotes(TarmacTestCase):
             config=Thing(
                 voting_criteria="Approve >= 2, Disapprove == 0"))
         self.plugin.run(
-            command=None, target=target, source=None, proposal=self.proposal)
+            command=None, target=target, proposal=self.proposal)
 
     def test_run_no_votes(self):
         """Test that all community reviews fails."""
@@ -105,8 +105,7 @@ class TestVotes(TarmacTestCase):
         self.assertEqual({}, self.plugin.count_votes(self.proposal))
         try:
             self.plugin.run(
-                command=None, target=target, source=None,
-                proposal=self.proposal)
+                command=None, target=target, proposal=self.proposal)
         except VotingViolation as error:
             self.assertEqual(
                 ('Voting does not meet specified criteria. '
@@ -122,8 +121,7 @@ class TestVotes(TarmacTestCase):
                 voting_criteria="Approve >= 2, Needs Information == 0"))
         try:
             self.plugin.run(
-                command=None, target=target, source=None,
-                proposal=self.proposal)
+                command=None, target=target, proposal=self.proposal)
         except VotingViolation as error:
             self.assertEqual(
                 ("Voting does not meet specified criteria. "
@@ -147,8 +145,7 @@ class TestVotes(TarmacTestCase):
             return old_count_votes(proposal)
 
         self.plugin.count_votes = count_votes
-        self.plugin.run(command=command, target=target,
-                        source=None, proposal=self.proposal)
+        self.plugin.run(command=command, target=target, proposal=self.proposal)
         if not self.called:
             self.fail('No voting_criteria configuration found')
 
@@ -159,8 +156,7 @@ class TestVotes(TarmacTestCase):
         command = Thing(config=self.config)
         try:
             self.plugin.run(
-                command=command, target=target, source=None,
-                proposal=self.proposal)
+                command=command, target=target, proposal=self.proposal)
         except VotingViolation as error:
             self.assertEqual(
                 ("Voting does not meet specified criteria. "
@@ -61,7 +61,7 @@ class VoteCounter(dict):
 class Votes(TarmacPlugin):
     """Plugin to enforce a voting policy."""
 
-    def run(self, command, target, source, proposal):
+    def run(self, command, target, proposal):
         """See L{TarmacPlugin.run}."""
         criteria = target.config.get('voting_criteria')
         if criteria is None:
@@ -134,5 +134,5 @@ class Votes(TarmacPlugin):
             for vote, op, value in criteria)
 
 
-tarmac_hooks['tarmac_pre_commit'].hook(
+tarmac_hooks['tarmac_pre_merge_check'].hook(
     Votes(), "Enforces a voting policy.")
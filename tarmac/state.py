@@ -0,0 +1,174 @@
+# Copyright 2026 Tarmac Developers
+#
+# This file is part of Tarmac.
+#
+# Tarmac is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by
+# the Free Software Foundation.
+#
+# Tarmac is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Tarmac.  If not, see <http://www.gnu.org/licenses/>.
+
+'''Landing state of merge proposals, kept between runs.'''
+import os
+import sqlite3
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+
+# Outcomes that will be the same on the next run, unless the proposal changes.
+STABLE_OUTCOMES = frozenset(['not-approved', 'no-commit-message'])
+
+# Outcomes that will be the same on the next run, unless the proposal or the
+# tip of the target branch changes.  Waiting for a prerequisite isn't one, as
+# Launchpad only notices a prerequisite landed after the target is scanned.
+TARGET_OUTCOMES = frozenset(['conflicts', 'verify-failed'])
+
+# Outcomes of attempts to land a proposal that failed.
+FAILED_OUTCOMES = frozenset(['failed', 'conflicts', 'verify-failed'])
+
+# Number of landing attempts kept for the statistics of owners.
+ATTEMPTS_KEPT = 10000
+
+OwnerStats = namedtuple('OwnerStats', ['attempts', 'landed', 'mean_duration'])
+
+
+def _fingerprint(proposal):
+    """Return the attributes of %proposal that change when it is updated."""
+    date_last_modified = getattr(proposal, 'date_last_modified', None)
+    if date_last_modified is not None:
+        date_last_modified = str(date_last_modified)
+    return (date_last_modified, proposal.queue_status,
+            proposal.reviewed_revid)
+
+
+class LandingState:
+    '''A store of what happened to merge proposals on earlier runs.'''
+
+    FILENAME = 'landing-state.sqlite'
+
+    def __init__(self, path):
+        self.path = path
+        # The records kept back by batch(), or None to write them at once.
+        self._pending = None
+        # Merges into different targets can run in separate processes.
+        self._connection = sqlite3.connect(path, timeout=30)
+        with self._connection:
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS proposals ('
+                ' self_link TEXT PRIMARY KEY,'
+                ' date_last_modified TEXT,'
+                ' queue_status TEXT,'
+                ' reviewed_revid TEXT,'
+                ' target_revid TEXT,'
+                ' outcome TEXT NOT NULL,'
+                ' duration REAL,'
+                ' recorded REAL NOT NULL)')
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS attempts ('
+                ' owner TEXT NOT NULL,'
+                ' outcome TEXT NOT NULL,'
+                ' duration REAL,'
+                ' recorded REAL NOT NULL)')
+
+    @classmethod
+    def from_config(cls, config):
+        '''Open the landing state in the cache dir of %config.'''
+        return cls(os.path.join(config.CACHE_HOME, cls.FILENAME))
+
+    def close(self):
+        self._connection.close()
+
+    @contextmanager
+    def batch(self):
+        '''Write the records made in the with block in one transaction.
+
+        They are kept back until the end of the block, so the database
+        isn't locked against other processes in the meantime.
+        '''
+        if self._pending is not None:
+            yield
+            return
+        self._pending = []
+        try:
+            yield
+        finally:
+            pending, self._pending = self._pending, None
+            if pending:
+                with self._connection:
+                    for statement, parameters in pending:
+                        self._connection.execute(statement, parameters)
+
+    def _write(self, statement, parameters):
+        if self._pending is not None:
+            self._pending.append((statement, parameters))
+            return
+        with self._connection:
+            self._connection.execute(statement, parameters)
+
+    def record(self, proposal, outcome, target_revid=None, duration=None):
+        '''Record the %outcome of considering or landing %proposal.'''
+        self._write(
+            'INSERT OR REPLACE INTO proposals VALUES'
+            ' (?, ?, ?, ?, ?, ?, ?, ?)',
+            (proposal.self_link,) + _fingerprint(proposal) +
+            (target_revid, outcome, duration, time.time()))
+
+    def record_attempt(self, owner, outcome, duration=None):
+        '''Record an attempt to land a proposal from %owner.'''
+        self._write(
+            'INSERT INTO attempts VALUES (?, ?, ?, ?)',
+            (owner, outcome, duration, time.time()))
+        self._write(
+            'DELETE FROM attempts WHERE rowid <='
+            ' (SELECT MAX(rowid) FROM attempts) - ?',
+            (ATTEMPTS_KEPT,))
+
+    def owner_stats(self):
+        '''Return a dict of the OwnerStats of the owners of proposals.'''
+        cursor = self._connection.execute(
+            "SELECT owner, COUNT(*), SUM(outcome = 'landed'), AVG(duration)"
+            " FROM attempts GROUP BY owner")
+        return {row[0]: OwnerStats(*row[1:]) for row in cursor}
+
+    def get(self, proposal):
+        '''Return what was recorded for %proposal, as a dict, or None.'''
+        cursor = self._connection.execute(
+            'SELECT * FROM proposals WHERE self_link = ?',
+            (proposal.self_link,))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        return dict(zip([column[0] for column in cursor.description], row))
+
+    def unchanged_outcome(self, proposal, target_revid=None):
+        '''Return the outcome for %proposal, if it can't have changed.
+
+        That is the case when the proposal hasn't been modified since, and
+        either the outcome only depended on the proposal, or it depended on
+        the tip of the target branch too and %target_revid, the tip, is the
+        same.
+        '''
+        if getattr(proposal, 'date_last_modified', None) is None:
+            return None
+        entry = self.get(proposal)
+        if entry is None:
+            return None
+        recorded = (entry['date_last_modified'], entry['queue_status'],
+                    entry['reviewed_revid'])
+        if recorded != _fingerprint(proposal):
+            return None
+        if entry['outcome'] in STABLE_OUTCOMES:
+            return entry['outcome']
+        if (entry['outcome'] in TARGET_OUTCOMES and
+                target_revid is not None and
+                proposal.reviewed_revid is not None and
+                entry['target_revid'] == target_revid):
+            return entry['outcome']
+        return None
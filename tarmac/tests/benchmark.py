@@ -0,0 +1,223 @@
+# Copyright 2026 Tarmac Developers
+#
+# This file is part of Tarmac.
+#
+# Tarmac is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by
+# the Free Software Foundation.
+#
+# Tarmac is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Tarmac.  If not, see <http://www.gnu.org/licenses/>.
+
+'''Benchmarks for Tarmac, run with ``python3 -m tarmac.tests.benchmark``.'''
+import argparse
+import contextlib
+import io
+import os
+import random
+import shutil
+import tempfile
+import timeit
+
+from breezy.controldir import ControlDir
+
+from tarmac.bin import commands
+from tarmac.bin.commands import sort_landing_candidates
+from tarmac.bin.registry import CommandRegistry
+from tarmac.branch import Branch
+from tarmac.config import TarmacConfig
+from tarmac.tests import Thing
+from tarmac.tests.fakelaunchpad import (
+    FakeLaunchpad,
+    FakeLaunchpadServer,
+    write_credentials,
+)
+
+
+def make_queue(size, chain_length, seed=0):
+    """Return %size synthetic proposals, in chains of up to %chain_length."""
+    rng = random.Random(seed)
+    proposals = []
+    prerequisite = None
+    for index in range(size):
+        if prerequisite is not None and rng.randrange(chain_length) == 0:
+            prerequisite = None
+        name = '~owner%d/project/branch%d' % (index % 100, index)
+        proposals.append(Thing(
+            source_branch=Thing(unique_name=name),
+            prerequisite_branch=(
+                Thing(unique_name=prerequisite) if prerequisite else None)))
+        prerequisite = name
+    rng.shuffle(proposals)
+    return proposals
+
+
+def make_service(size, targets, seed=0):
+    """Return a FakeLaunchpad with %size proposals for %targets branches."""
+    rng = random.Random(seed)
+    launchpad = FakeLaunchpad()
+    launchpad.add_person('reviewer')
+    trunks = [
+        launchpad.add_branch('~owner/project%d/trunk' % index)
+        for index in range(targets)]
+    for index in range(size):
+        trunk = rng.choice(trunks)
+        source = launchpad.add_branch('~owner%d/%s/branch%d' % (
+            index % 100, trunk.split('/')[1], index))
+        launchpad.add_proposal(
+            source, trunk, reviewed_revid='revision-%d' % index,
+            queue_status=rng.choice(['Approved', 'Needs review']),
+            votes=[('reviewer', 'Approve')])
+    return launchpad, trunks
+
+
+def bench_sort(args):
+    """Time sort_landing_candidates over synthetic queues."""
+    size = args.size or 10000
+    for chain_length in (1, 10, size):
+        proposals = make_queue(size, chain_length)
+        best = min(timeit.repeat(
+            lambda: sort_landing_candidates(proposals),
+            number=1, repeat=args.repeat))
+        print('sort %d proposals, chains of up to %d: %.3fs' % (
+            size, chain_length, best))
+
+
+def bench_plan(args):
+    """Time `tarmac plan` runs against a local fake Launchpad."""
+    size = args.size or 100
+    launchpad, trunks = make_service(size, targets=5)
+    home = tempfile.mkdtemp()
+    environ = dict(os.environ)
+    with FakeLaunchpadServer(launchpad, latency=args.latency) as server:
+        try:
+            os.environ.update({
+                'TARMAC_CONFIG_HOME': os.path.join(home, 'config'),
+                'TARMAC_CACHE_HOME': os.path.join(home, 'cache'),
+                'TARMAC_PID_FILE': os.path.join(home, 'tarmac.pid'),
+                'TARMAC_CREDENTIALS': os.path.join(home, 'credentials'),
+                'TARMAC_SERVICE_ROOT': server.service_root,
+                })
+            config = TarmacConfig()
+            for trunk in trunks:
+                config.add_section('lp:' + trunk)
+            write_credentials(config.CREDENTIALS)
+
+            def plan():
+                command = commands.cmd_plan(CommandRegistry(config=config))
+                with contextlib.redirect_stdout(io.StringIO()):
+                    command.run()
+
+            before = server.request_count
+            best = min(timeit.repeat(plan, number=1, repeat=args.repeat))
+            print('plan %d proposals for %d targets, %.3fs latency: %.3fs, '
+                  '%d requests' % (
+                      size, len(trunks), args.latency, best,
+                      (server.request_count - before) // args.repeat))
+        finally:
+            os.environ.clear()
+            os.environ.update(environ)
+            shutil.rmtree(home)
+
+
+def make_branches(directory, size, changes):
+    """Return a target Branch of %size files, and a source changing some.
+
+    The source changes %changes of the files, and adds as many.
+    """
+    tree = ControlDir.create_standalone_workingtree(
+        os.path.join(directory, 'target'))
+    names = ['dir%d/file%d' % (index // 100, index) for index in range(size)]
+    for name in names:
+        os.makedirs(os.path.dirname(tree.abspath(name)), exist_ok=True)
+        with open(tree.abspath(name), 'w') as f:
+            f.write('%s\n' % name)
+    tree.smart_add([tree.basedir])
+    tree.commit('Files')
+    source = tree.controldir.sprout(
+        os.path.join(directory, 'source')).open_workingtree()
+    for name in random.Random(0).sample(names, changes):
+        with open(source.abspath(name), 'a') as f:
+            f.write('Changed\n')
+        with open(source.abspath(name + '.new'), 'w') as f:
+            f.write('Added\n')
+        source.add([name + '.new'])
+    source.commit('Changes')
+    branches = []
+    for path in (tree.basedir, source.basedir):
+        branch = Branch(Thing(bzr_identity=path, unique_name=None))
+        branch.tree = branch.bzr_branch.controldir.open_workingtree()
+        branches.append(branch)
+    return branches
+
+
+def bench_cleanup(args):
+    """Time merging into a tree and resetting it, in full and incrementally.
+
+    The merge is timed too, as finding the paths it changes is part of the
+    cost of resetting only those.
+    """
+    size = args.size or 20000
+    directory = tempfile.mkdtemp()
+    environ = dict(os.environ)
+    try:
+        os.environ.setdefault('BRZ_EMAIL', 'Tarmac <tarmac@example.com>')
+        target, source = make_branches(directory, size, args.changes)
+        target.cleanup(full=True)
+        for full in (True, False):
+            times = []
+            for _ in range(args.repeat):
+                times.append(timeit.timeit(
+                    lambda: (target.merge(source), target.cleanup(full=full)),
+                    number=1))
+            print('merging %d changes into %d files with %s cleanup: '
+                  '%.3fs' % (args.changes, size,
+                             'full' if full else 'incremental', min(times)))
+    finally:
+        os.environ.clear()
+        os.environ.update(environ)
+        shutil.rmtree(directory)
+
+
+BENCHMARKS = {
+    'cleanup': bench_cleanup,
+    'plan': bench_plan,
+    'sort': bench_sort,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        'benchmarks', nargs='*', metavar='benchmark',
+        help='Benchmarks to run: %s (default: all).' % ', '.join(
+            sorted(BENCHMARKS)))
+    parser.add_argument(
+        '--size', type=int,
+        help='Number of proposals (default: 10000 to sort, 100 to plan), '
+        'or files in the tree to clean up (default: 20000).')
+    parser.add_argument(
+        '--repeat', type=int, default=3, help='Number of runs to time.')
+    parser.add_argument(
+        '--latency', type=float, default=0.05,
+        help='Seconds the fake Launchpad takes to answer (default: 0.05).')
+    parser.add_argument(
+        '--changes', type=int, default=10,
+        help='Files changed, and added, by the merge to clean up '
+        '(default: 10).')
+    args = parser.parse_args(argv)
+    for name in args.benchmarks:
+        if name not in BENCHMARKS:
+            parser.error('unknown benchmark: %s' % name)
+    for name in args.benchmarks or sorted(BENCHMARKS):
+        BENCHMARKS[name](args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,403 @@
+# Copyright 2026 Tarmac Developers
+#
+# This file is part of Tarmac.
+#
+# Tarmac is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by
+# the Free Software Foundation.
+#
+# Tarmac is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Tarmac.  If not, see <http://www.gnu.org/licenses/>.
+
+'''A local stand-in for the Launchpad web service.
+
+It serves the part of the API Tarmac uses (projects, branches, merge
+proposals, votes, people and bugs) from data kept in memory, with an optional
+delay before every response and a rate of failures, so that whole runs can be
+timed and profiled without a network.  Point Tarmac at it by setting
+``TARMAC_SERVICE_ROOT`` to the service_root of the server.
+'''
+import json
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import launchpadlib.testing
+from launchpadlib.credentials import (
+    AccessToken,
+    Credentials,
+    SystemWideConsumer,
+)
+
+# The description of version 1.0 of the web service, as shipped with
+# launchpadlib, and the service root it was written for.
+WADL_PATH = os.path.join(
+    os.path.dirname(launchpadlib.testing.__file__), 'launchpad-wadl.xml')
+WADL_BASE = 'https://api.launchpad.test/1.0/'
+
+# The web site the web_links point to.
+WEB_ROOT = 'https://code.launchpad.test/'
+
+# The collections of each type of entry that are worked out from the others.
+COLLECTIONS = {
+    'branch': ['landing_candidates', 'landing_targets'],
+    'branch_merge_proposal': ['votes'],
+    }
+
+# Statuses of proposals that are still to be landed.
+ACTIVE_STATUSES = frozenset([
+    'Work in progress', 'Needs review', 'Approved', 'Queued'])
+
+
+def write_credentials(path):
+    '''Write credentials Tarmac can log in to a FakeLaunchpadServer with.'''
+    credentials = Credentials(
+        access_token=AccessToken('fake-token', 'fake-secret'))
+    credentials.consumer = SystemWideConsumer('Tarmac')
+    credentials.save_to_path(path)
+
+
+class FakeLaunchpad:
+    '''The people, branches, proposals and bugs a FakeLaunchpadServer serves.
+
+    Entries are dicts keyed by their path below the service root.  Links to
+    other entries are kept as paths too, and only made into URLs when served.
+    '''
+
+    def __init__(self, me='tarmac'):
+        self.entries = {}
+        self.comments = []
+        self.add_person(me)
+        self.me = '~' + me
+
+    def _add(self, path, resource_type, **fields):
+        fields.update(self_link=path, resource_type=resource_type)
+        fields.setdefault('web_link', WEB_ROOT + path)
+        self.entries[path] = fields
+        return path
+
+    def add_person(self, name, display_name=None, email=None, members=()):
+        '''Add a person, or a team with %members, and return its path.'''
+        return self._add(
+            '~' + name, 'person', name=name,
+            display_name=display_name or name.title(), email=email,
+            is_team=bool(members), members=['~' + m for m in members])
+
+    def add_bug(self, bug_id, title='A bug'):
+        '''Add a bug, and return its path.'''
+        return self._add('bugs/%d' % bug_id, 'bug', id=bug_id, title=title)
+
+    def add_project(self, name):
+        '''Add a project, and return its path.'''
+        return self._add(
+            name, 'project', name=name, display_name=name.title())
+
+    def add_branch(self, unique_name, last_scanned_id=None, bugs=()):
+        '''Add the branch ~owner/project/name, and return its path.'''
+        owner, project = unique_name.lstrip('~').split('/')[:2]
+        if '~' + owner not in self.entries:
+            self.add_person(owner)
+        if project == '+junk':
+            project = None
+        elif project not in self.entries:
+            self.add_project(project)
+        return self._add(
+            unique_name, 'branch', unique_name=unique_name,
+            name=unique_name.split('/')[-1],
+            bzr_identity='lp:' + unique_name,
+            display_name='lp:' + unique_name, owner_link='~' + owner,
+            project_link=project, last_scanned_id=last_scanned_id,
+            revision_count=0,
+            linked_bugs=['bugs/%d' % bug_id for bug_id in bugs])
+
+    def add_proposal(self, source, target, prerequisite=None,
+                     queue_status='Approved', commit_message='Landed.',
+                     reviewed_revid=None, votes=()):
+        '''Add a proposal to merge %source into %target, and return its path.
+
+        %votes is a list of (reviewer, vote) pairs, such as ('person',
+        'Approve').
+        '''
+        proposal_id = len(self.entries)
+        path = self._add(
+            '%s/+merge/%d' % (source, proposal_id), 'branch_merge_proposal',
+            source_branch_link=source, target_branch_link=target,
+            prerequisite_branch_link=prerequisite, queue_status=queue_status,
+            commit_message=commit_message, description=None,
+            reviewed_revid=reviewed_revid,
+            date_created='2026-01-01T00:00:00+00:00')
+        for index, (reviewer, vote) in enumerate(votes):
+            comment = self._add(
+                '%s/comments/%d' % (path, index), 'code_review_comment',
+                author_link='~' + reviewer, vote=vote, vote_tag=None,
+                message_body=vote)
+            self._add(
+                '%s/votes/%d' % (path, index), 'code_review_vote_reference',
+                reviewer_link='~' + reviewer, review_type=None,
+                comment_link=comment, is_pending=False,
+                branch_merge_proposal_link=path)
+        return path
+
+    def _find(self, resource_type, **fields):
+        return [
+            path for path, entry in sorted(self.entries.items())
+            if entry['resource_type'] == resource_type and all(
+                entry.get(name) == value for name, value in fields.items())]
+
+    def collection(self, path, name):
+        '''Return the paths of the entries in collection %name of %path.'''
+        entry = self.entries[path]
+        if name == 'landing_candidates':
+            return [
+                proposal for proposal in self._find(
+                    'branch_merge_proposal', target_branch_link=path)
+                if self.entries[proposal]['queue_status'] in ACTIVE_STATUSES]
+        if name == 'landing_targets':
+            return [
+                proposal for proposal in self._find(
+                    'branch_merge_proposal', source_branch_link=path)
+                if self.entries[proposal]['queue_status'] in ACTIVE_STATUSES]
+        if name == 'votes':
+            return self._find(
+                'code_review_vote_reference', branch_merge_proposal_link=path)
+        if name in ('members', 'linked_bugs'):
+            return entry[name]
+        raise KeyError(name)
+
+    def operation(self, path, name, arguments):
+        '''Call the named operation %name on %path, returning its result.
+
+        The result is the path of an entry, a list of them, or None.
+        '''
+        if path == 'branches' and name == 'getByUrl':
+            paths = self._find('branch', bzr_identity=arguments['url'])
+            return paths[0] if paths else None
+        if path == 'branches' and name == 'getByUniqueName':
+            paths = self._find('branch', unique_name=arguments['unique_name'])
+            return paths[0] if paths else None
+        if path == 'people' and name == 'getByEmail':
+            paths = self._find('person', email=arguments['email'])
+            return paths[0] if paths else None
+        entry = self.entries[path]
+        if name == 'getMergeProposals':
+            statuses = arguments.get('status') or ACTIVE_STATUSES
+            if isinstance(statuses, str):
+                statuses = [statuses]
+            return [
+                proposal for proposal in self._find('branch_merge_proposal')
+                if self.entries[proposal]['queue_status'] in statuses and
+                self.entries[self.entries[proposal]['target_branch_link']][
+                    'project_link'] == path]
+        if name == 'setStatus':
+            entry['queue_status'] = arguments['status']
+            return None
+        if name == 'createComment':
+            self.comments.append((path, arguments.get('subject'),
+                                  arguments.get('content')))
+            return None
+        raise KeyError(name)
+
+
+def _arguments(query):
+    '''Return the arguments of a named operation, which are JSON encoded.'''
+    arguments = {}
+    for name, values in parse_qs(query).items():
+        try:
+            arguments[name] = json.loads(values[0])
+        except ValueError:
+            arguments[name] = values[0]
+    return arguments
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def _launchpad(self):
+        return self.server.launchpad
+
+    def _base(self, version):
+        return 'http://%s:%d/%s/' % (
+            self.server.server_address[0], self.server.server_address[1],
+            version)
+
+    def _send(self, status, body=b'', content_type='application/json'):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, value, status=200):
+        self._send(status, json.dumps(value).encode('utf-8'))
+
+    def _represent(self, base, path):
+        '''Return the representation of the entry at %path.'''
+        entry = self._launchpad.entries[path]
+        representation = {
+            'resource_type_link': base + '#' + entry['resource_type'],
+            'http_etag': '"%d"' % hash(json.dumps(entry, sort_keys=True)),
+            }
+        for name, value in entry.items():
+            if name == 'resource_type':
+                continue
+            if isinstance(value, list):
+                representation[name + '_collection_link'] = (
+                    base + path + '/' + name)
+            elif (name.endswith('_link') and value is not None and
+                    not value.startswith('http')):
+                representation[name] = base + value
+            else:
+                representation[name] = value
+        for name in COLLECTIONS.get(entry['resource_type'], []):
+            representation.setdefault(
+                name + '_collection_link', base + path + '/' + name)
+        return representation
+
+    def _send_page(self, base, paths):
+        '''Send the entries at %paths, as a single page of a collection.'''
+        entries = [self._represent(base, entry) for entry in paths]
+        resource_type = entries[0]['resource_type_link'] if entries else (
+            base + '#branch_merge_proposal')
+        return self._send_json({
+            'total_size': len(entries), 'start': 0, 'entries': entries,
+            'resource_type_link': resource_type + '-page-resource'})
+
+    def _route(self):
+        '''Return the version, path and arguments of the request.'''
+        parts = urlsplit(self.path)
+        version, _, path = parts.path.lstrip('/').partition('/')
+        return version, path.rstrip('/'), _arguments(parts.query)
+
+    def _fail(self):
+        '''Wait, and return whether this request should fail.'''
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        with self.server.lock:
+            self.server.request_count += 1
+            return self.server.random.random() < self.server.failure_rate
+
+    def do_GET(self):
+        if self._fail():
+            return self._send(503, b'Service unavailable', 'text/plain')
+        version, path, arguments = self._route()
+        base = self._base(version)
+        with self.server.lock:
+            if not path and 'wadl' in self.headers.get('Accept', ''):
+                return self._send(
+                    200, self.server.wadl.replace(
+                        WADL_BASE.encode('utf-8'), base.encode('utf-8')),
+                    'application/vnd.sun.wadl+xml')
+            if not path:
+                root = {
+                    name + '_collection_link': base + name
+                    for name in ('branches', 'bugs', 'people', 'projects')}
+                root['me_link'] = base + 'people/+me'
+                root['resource_type_link'] = base + '#service-root'
+                return self._send_json(root)
+            if path == 'people/+me':
+                path = self._launchpad.me
+            if 'ws.op' in arguments:
+                try:
+                    result = self._launchpad.operation(
+                        path, arguments.pop('ws.op'), arguments)
+                except KeyError:
+                    return self._send(400, b'Unknown operation', 'text/plain')
+                if result is None:
+                    return self._send_json(None)
+                if isinstance(result, list):
+                    return self._send_page(base, result)
+                return self._send_json(self._represent(base, result))
+            if path in self._launchpad.entries:
+                return self._send_json(self._represent(base, path))
+            parent, _, name = path.rpartition('/')
+            try:
+                paths = self._launchpad.collection(parent, name)
+            except KeyError:
+                return self._send(404, b'Not found', 'text/plain')
+            return self._send_page(base, paths)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self._fail():
+            return self._send(503, b'Service unavailable', 'text/plain')
+        version, path, _ = self._route()
+        arguments = _arguments(body.decode('utf-8'))
+        with self.server.lock:
+            try:
+                self._launchpad.operation(
+                    path, arguments.pop('ws.op', None), arguments)
+            except KeyError:
+                return self._send(400, b'Unknown operation', 'text/plain')
+        return self._send_json(None)
+
+    def do_PATCH(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self._fail():
+            return self._send(503, b'Service unavailable', 'text/plain')
+        version, path, _ = self._route()
+        with self.server.lock:
+            try:
+                entry = self._launchpad.entries[path]
+            except KeyError:
+                return self._send(404, b'Not found', 'text/plain')
+            entry.update(json.loads(body.decode('utf-8')))
+            return self._send_json(
+                self._represent(self._base(version), path), status=209)
+
+
+class FakeLaunchpadServer(ThreadingHTTPServer):
+    '''An HTTP server for a FakeLaunchpad, on a free port of localhost.
+
+    Every response is delayed by %latency seconds, and a %failure_rate
+    share of requests fail with a 503 error.
+    '''
+
+    daemon_threads = True
+
+    def __init__(self, launchpad, latency=0, failure_rate=0, seed=0):
+        ThreadingHTTPServer.__init__(self, ('127.0.0.1', 0), _Handler)
+        self.launchpad = launchpad
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.request_count = 0
+        with open(WADL_PATH, 'rb') as wadl:
+            self.wadl = wadl.read()
+        self._thread = None
+
+    @property
+    def service_root(self):
+        return 'http://%s:%d/' % self.server_address[:2]
+
+    def start(self):
+        '''Serve requests in a background thread.'''
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self._thread.join()
+        self.server_close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
@@ -22,8 +22,10 @@ from breezy.workingtree import PointlessMerge
 from unittest.mock import patch
 from tarmac import branch
 from tarmac.exceptions import (
+    BranchHasConflicts,
     InvalidWorkingTree,
     TarmacMergeError,
+    TarmacMergeSkipError,
 )
 from tarmac.tests import (
     BranchTestCase,
@@ -125,6 +127,125 @@ class TestBranch(BranchTestCase):
         self.assertTrue(self.branch1.tree.changes_from(
                 self.branch1.tree.basis_tree()).has_changed())
 
+    def test_merge_from_mirror(self):
+        '''Sources with a target are read from their mirror in CACHE_HOME.'''
+        self.branch2.lp_branch.unique_name = '~owner/project/branch2'
+        source = branch.Branch.create(
+            self.branch2.lp_branch, self.config, target=self.branch1)
+        mirror = os.path.join(
+            self.config.CACHE_HOME, 'mirrors', 'project', '~owner',
+            'branch2')
+        self.assertEqual(
+            'file://%s/' % mirror, source.bzr_branch.user_url)
+        self.assertEqual(
+            self.branch2.bzr_branch.last_revision(),
+            source.bzr_branch.last_revision())
+        self.branch1.merge(source)
+        self.assertTrue(self.branch1.tree.changes_from(
+                self.branch1.tree.basis_tree()).has_changed())
+
+    def test_merge_mirror_disabled(self):
+        '''No mirror is kept when the source_mirrors setting is off.'''
+        self.config.set('Tarmac', 'source_mirrors', 'false')
+        self.branch2.lp_branch.unique_name = '~owner/project/branch2'
+        source = branch.Branch.create(
+            self.branch2.lp_branch, self.config, target=self.branch1)
+        self.assertEqual(
+            self.branch2.bzr_branch.user_url, source.bzr_branch.user_url)
+
+    def test_create_tree_bound(self):
+        '''With bound_tree, the tree is of a local branch bound to this one.'''
+        tree_dir = os.path.join(self.TEST_ROOT, 'bound')
+        self.config.set(self.branch1.lp_branch.bzr_identity, 'tree_dir',
+                        tree_dir)
+        self.config.set(self.branch1.lp_branch.bzr_identity, 'bound_tree',
+                        'true')
+        self.branch1.lp_branch.unique_name = '~owner/project/branch1'
+        target = branch.Branch.create(
+            self.branch1.lp_branch, self.config, create_tree=True)
+        self.assertEqual(
+            self.branch1.bzr_branch.base,
+            target.bzr_branch.get_bound_location())
+        target.merge(self.branch2)
+        target.commit('Landed')
+        self.assertEqual(
+            target.bzr_branch.last_revision(),
+            self.branch1.bzr_branch.last_revision())
+
+        # Commits fail when the branch moved on since the tree was updated.
+        target.cleanup()
+        self.branch1.tree.update()
+        self.branch1.commit('Elsewhere')
+        self.assertRaises(
+            TarmacMergeSkipError, target.commit, 'Late', authors=['Tarmac'])
+
+    def test_cleanup_bound_offline(self):
+        '''Cleanups of bound trees don't open the master branch.'''
+        tree_dir = os.path.join(self.TEST_ROOT, 'offline')
+        self.addCleanup(shutil.rmtree, tree_dir)
+        identity = self.branch1.lp_branch.bzr_identity
+        self.config.set(identity, 'tree_dir', tree_dir)
+        self.config.set(identity, 'bound_tree', 'true')
+        self.branch1.lp_branch.unique_name = '~owner/project/branch1'
+        target = branch.Branch.create(
+            self.branch1.lp_branch, self.config, create_tree=True)
+        target.merge(self.branch2)
+        with patch.object(target.tree.branch, 'get_master_branch') as master:
+            target.cleanup()
+            self.assertFalse(master.called)
+
+        # The revisions committed elsewhere are fetched by refresh().
+        self.branch1.tree.update()
+        self.branch1.commit('Elsewhere')
+        target.refresh()
+        self.assertEqual(
+            self.branch1.bzr_branch.last_revision(),
+            target.tree.last_revision())
+
+    def test_create_tree_bound_failure(self):
+        '''The tree is a lightweight checkout if binding fails.'''
+        tree_dir = os.path.join(self.TEST_ROOT, 'unbound')
+        self.addCleanup(shutil.rmtree, tree_dir)
+        identity = self.branch1.lp_branch.bzr_identity
+        self.config.set(identity, 'tree_dir', tree_dir)
+        self.config.set(identity, 'bound_tree', 'true')
+        self.branch1.lp_branch.unique_name = '~owner/project/branch1'
+        with patch('tarmac.branch.MirrorStore.bound_branch',
+                   side_effect=OSError(28, 'No space left on device')):
+            target = branch.Branch.create(
+                self.branch1.lp_branch, self.config, create_tree=True)
+        self.assertEqual(
+            self.branch1.bzr_branch.user_url, target.bzr_branch.user_url)
+        self.assertEqual(
+            self.branch1.bzr_branch.user_url, target.tree.branch.user_url)
+
+    def test_create_tree_bound_existing(self):
+        '''Existing trees are switched when bound_tree is changed.'''
+        tree_dir = os.path.join(self.TEST_ROOT, 'switched')
+        self.addCleanup(shutil.rmtree, tree_dir)
+        identity = self.branch1.lp_branch.bzr_identity
+        self.config.set(identity, 'tree_dir', tree_dir)
+        self.branch1.lp_branch.unique_name = '~owner/project/branch1'
+        target = branch.Branch.create(
+            self.branch1.lp_branch, self.config, create_tree=True)
+        self.assertEqual(
+            self.branch1.bzr_branch.user_url, target.tree.branch.user_url)
+
+        self.config.set(identity, 'bound_tree', 'true')
+        target = branch.Branch.create(
+            self.branch1.lp_branch, self.config, create_tree=True)
+        self.assertEqual(
+            target.bzr_branch.user_url, target.tree.branch.user_url)
+        self.assertEqual(
+            self.branch1.bzr_branch.base,
+            target.tree.branch.get_bound_location())
+
+        self.config.set(identity, 'bound_tree', 'false')
+        target = branch.Branch.create(
+            self.branch1.lp_branch, self.config, create_tree=True)
+        self.assertEqual(
+            self.branch1.bzr_branch.user_url, target.tree.branch.user_url)
+
     def test_merge_tags(self):
         """Test that merging tags works as expected."""
         tag_name = 'tag1'
@@ -214,6 +335,80 @@ class TestBranch(BranchTestCase):
         self.assertFalse(self.branch1.tree.changes_from(
                 self.branch1.tree.basis_tree()).has_changed())
 
+    def test_cleanup_changed_paths(self):
+        '''Only the paths a merge changed are reverted by cleanup.'''
+        self.branch1.merge(self.branch2)
+        self.assertEqual({'README'}, self.branch1._changed)
+        tree_dir = self.branch1.config.get('tree_dir')
+        os.makedirs(os.path.join(tree_dir, 'build'))
+        with open(os.path.join(tree_dir, 'build', 'output'), 'w') as f:
+            f.close()
+        with patch.object(self.branch1.tree, 'revert',
+                          wraps=self.branch1.tree.revert) as revert:
+            self.branch1.cleanup()
+            # The merge added README, so it is removed without reverting.
+            self.assertFalse(revert.called)
+        self.assertFalse(self.branch1.tree.changes_from(
+                self.branch1.tree.basis_tree()).has_changed())
+        self.assertEqual([], self.branch1.tree.get_parent_ids()[1:])
+        self.assertEqual([], self.branch1.unmanaged_files)
+
+    def test_cleanup_unchanged(self):
+        '''Nothing is done when nothing changed since the last cleanup.'''
+        self.branch1.cleanup()
+        with patch.object(self.branch1.tree, 'extras') as extras:
+            self.branch1.cleanup()
+            self.assertFalse(extras.called)
+
+    def test_cleanup_after_commit(self):
+        '''Files left before a commit are removed by the next cleanup.'''
+        self.branch1.merge(self.branch2)
+        with open(os.path.join(self.branch1.config.get('tree_dir'),
+                               'output'), 'w') as f:
+            f.close()
+        self.branch1.commit('Merged')
+        self.branch1.cleanup()
+        self.assertEqual([], self.branch1.unmanaged_files)
+
+    def test_cleanup_added_directory(self):
+        '''Directories added by a merge are removed by cleanup.'''
+        tree = self.branch2.tree
+        os.makedirs(tree.abspath('docs/guide'))
+        with open(tree.abspath('docs/guide/index.txt'), 'w') as f:
+            f.write('Guide')
+        tree.add(['docs', 'docs/guide', 'docs/guide/index.txt'])
+        self.branch2.commit('Added a guide')
+        self.branch1.merge(self.branch2)
+        self.branch1.cleanup()
+        self.assertFalse(self.branch1.tree.changes_from(
+                self.branch1.tree.basis_tree()).has_changed())
+        self.assertEqual([], self.branch1.unmanaged_files)
+
+    def test_cleanup_conflicts(self):
+        '''The files left by conflicts are removed by cleanup.'''
+        self.branch1.lp_branch.display_name = 'lp:branch1'
+        self.branch1.tree.put_file_bytes_non_atomic('README', b'Other')
+        self.branch1.tree.add(['README'])
+        self.branch1.commit('Conflicting README')
+        self.assertRaises(
+            BranchHasConflicts, self.branch1.merge, self.branch2)
+        self.branch1.cleanup()
+        self.assertEqual([], self.branch1.tree.conflicts())
+        self.assertEqual([], self.branch1.unmanaged_files)
+        self.assertEqual(
+            b'Other', self.branch1.tree.get_file_text('README'))
+
+    def test_cleanup_up_to_date(self):
+        '''The tree isn't updated when it is at the tip of the branch.'''
+        with patch.object(self.branch1.tree, 'update') as update:
+            self.branch1.cleanup()
+            self.assertFalse(update.called)
+            self.branch1.bzr_branch.create_checkout(
+                os.path.join(self.TEST_ROOT, 'elsewhere'),
+                lightweight=True).commit('Elsewhere')
+            self.branch1.cleanup()
+            self.assertTrue(update.called)
+
     def test_unmanaged_files(self):
         """Test that the unmanaged_files property returns correct lists."""
         self.branch1.merge(self.branch2)
@@ -14,18 +14,31 @@
 # You should have received a copy of the GNU General Public License
 # along with Tarmac.  If not, see <http://www.gnu.org/licenses/>.
 '''Tests for tarmac.bin.commands.py.'''
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from io import StringIO
+import json
+import multiprocessing
 import os
 import shutil
 import sys
 
-from unittest.mock import patch, MagicMock
+from breezy.errors import LockContention
+import httplib2
+from lazr.restfulclient.errors import NotFound
+from unittest.mock import ANY, patch, MagicMock
 from tarmac.bin import commands
 from tarmac.bin.registry import CommandRegistry
 from tarmac.branch import Branch
 from tarmac.config import TarmacConfig
+from tarmac.lp import ProposalSnapshot
+from tarmac.plugins.commitmessage import CommitMessageTemplate
+from tarmac.transport import TarmacHttp
 from tarmac.exceptions import (
+    BranchHasConflicts,
     InvalidWorkingTree,
+    LaunchpadUnavailable,
+    TarmacCommandError,
+    TarmacMergeError,
     UnapprovedChanges,
 )
 from tarmac.tests import (
@@ -36,6 +49,11 @@ from tarmac.tests import (
 )
 
 
+def raise_not_found():
+    """Fail like a request for a missing Launchpad entry."""
+    raise NotFound(httplib2.Response({'status': '404'}), b'Not found')
+
+
 class FakeCommand(commands.TarmacCommand):
     '''Fake command for testing.'''
 
@@ -268,6 +286,326 @@ class TestMergeCommand(BranchTestCase):
         self.assertEqual(self.error.comment,
                          'No approved revision specified.')
 
+    def test_daemon_reuses_target(self):
+        """Test that the daemon only creates each target tree once."""
+        registry = CommandRegistry(config=self.config)
+        registry.register_command('daemon', commands.cmd_daemon)
+        command = registry._get_command(commands.cmd_daemon, 'daemon')
+        with patch.object(commands.Branch, 'create',
+                          wraps=Branch.create) as create, \
+                patch('tarmac.bin.commands.time.sleep',
+                      side_effect=[None, KeyboardInterrupt]) as sleep:
+            command.run(launchpad=self.launchpad, interval=5)
+        targets = [call for call in create.call_args_list
+                   if call[1].get('create_tree')]
+        self.assertEqual(1, len(targets))
+        self.assertEqual(2, sleep.call_count)
+        sleep.assert_called_with(5)
+        self.assertEqual({}, command._targets)
+
+    def test_plan(self):
+        """Test that the plan lists the proposals without opening branches."""
+        self.addProposal('no_revision')
+        self.proposals[1].reviewed_revid = \
+            self.branch2.bzr_branch.last_revision().decode('utf-8')
+        registry = CommandRegistry(config=self.config)
+        registry.register_command('plan', commands.cmd_plan)
+        command = registry._get_command(commands.cmd_plan, 'plan')
+        with patch.object(commands.Branch, 'create') as create, \
+                patch('sys.stdout', new_callable=StringIO) as stdout:
+            command.run(branch_urls=[self.branches[1].bzr_identity],
+                        launchpad=self.launchpad)
+        self.assertEqual(0, create.call_count)
+        plan = json.loads(stdout.getvalue())
+        self.assertEqual(
+            [{'branch': self.branches[1].bzr_identity,
+              'landing': [self.proposals[1].web_link],
+              'skipped': [
+                  {'proposal': self.proposals[0].web_link,
+                   'reason': 'not-approved'},
+                  {'proposal': self.proposals[2].web_link,
+                   'reason': 'merge-error',
+                   'message': 'No approved revision specified.'}]}],
+            plan['targets'])
+        self.assertIs(None, plan['api_calls'])
+        self.assertEqual(['candidates', 'checks', 'setup', 'targets'],
+                         sorted(plan['timings']))
+
+    def test_plan_pre_merge_check(self):
+        """Test that the plan runs the checks of the proposals' votes."""
+        self.proposals[1].reviewed_revid = \
+            self.branch2.bzr_branch.last_revision().decode('utf-8')
+        self.config.set('Tarmac', 'voting_criteria', 'Approve >= 2')
+        self.branches[1].isPersonTrustedReviewer = lambda reviewer: True
+        self.proposals[1].votes = [Thing(
+            is_pending=False, comment=Thing(vote='Approve'),
+            reviewer=Thing(display_name='Reviewer'))]
+        registry = CommandRegistry(config=self.config)
+        registry.register_command('plan', commands.cmd_plan)
+        command = registry._get_command(commands.cmd_plan, 'plan')
+        with patch('sys.stdout', new_callable=StringIO) as stdout:
+            command.run(branch_urls=[self.branches[1].bzr_identity],
+                        launchpad=self.launchpad)
+        [target] = json.loads(stdout.getvalue())['targets']
+        self.assertEqual([], target['landing'])
+        self.assertEqual(
+            {'proposal': self.proposals[1].web_link,
+             'reason': 'merge-error',
+             'message': 'Voting criteria not met.'},
+            target['skipped'][-1])
+
+    def test_daemon_survives_errors(self):
+        """Test that an error in one poll doesn't stop the daemon."""
+        registry = CommandRegistry(config=self.config)
+        registry.register_command('daemon', commands.cmd_daemon)
+        command = registry._get_command(commands.cmd_daemon, 'daemon')
+        command._do_merges = MagicMock(side_effect=[Exception('boom'), None])
+        with patch('tarmac.bin.commands.time.sleep',
+                   side_effect=[None, KeyboardInterrupt]):
+            command.run(branch_urls=[self.branches[1].bzr_identity],
+                        launchpad=self.launchpad)
+        self.assertEqual(2, command._do_merges.call_count)
+
+    def test_run_skips_unavailable_target(self):
+        """Test that a target is skipped when Launchpad is unavailable."""
+        self.command._do_merges = MagicMock(side_effect=[
+            LaunchpadUnavailable('Down'), None])
+        self.command.run(launchpad=self.launchpad)
+        self.assertEqual(2, self.command._do_merges.call_count)
+
+    def run_in_parallel(self, worker, **kwargs):
+        """Run the merge command with --jobs, using threads for workers."""
+        def executor(max_workers, mp_context):
+            return ThreadPoolExecutor(max_workers=max_workers)
+
+        with patch('tarmac.bin.commands.ProcessPoolExecutor', executor), \
+                patch('tarmac.bin.commands._merge_in_subprocess',
+                      side_effect=worker) as merge:
+            self.command.run(launchpad=self.launchpad, jobs=2, **kwargs)
+        return merge
+
+    def test_run_jobs(self):
+        """Test that --jobs merges every target in a worker."""
+        merge = self.run_in_parallel(
+            lambda url, settings, dry_run: (None, []), debug=False)
+        self.assertEqual(
+            sorted(self.config.branches),
+            sorted(call[0][0] for call in merge.call_args_list))
+        for call in merge.call_args_list:
+            self.assertEqual(({'debug': False}, False), call[0][1:])
+
+    def test_run_jobs_raises_first_error(self):
+        """Test that --jobs finishes all targets before raising an error."""
+        merged = []
+
+        def worker(branch_url, settings, dry_run):
+            if branch_url == self.config.branches[0]:
+                raise LockContention(branch_url)
+            if branch_url == self.config.branches[1]:
+                raise TarmacCommandError('Broken')
+            merged.append(branch_url)
+            return None, []
+
+        self.config.add_section('lp:branch3')
+        self.addCleanup(self.config.remove_section, 'lp:branch3')
+        self.assertRaises(TarmacCommandError, self.run_in_parallel, worker)
+        self.assertEqual(['lp:branch3'], merged)
+
+    def test_run_jobs_one(self):
+        """Test that --one merges the targets one after another."""
+        self.command._do_merges = MagicMock(return_value=True)
+        merge = self.run_in_parallel(
+            lambda url, settings, dry_run: (True, []), one=True)
+        self.assertFalse(merge.called)
+        self.assertEqual(1, self.command._do_merges.call_count)
+
+    def test_in_worker_errors_reach_parent(self):
+        """Test that errors from worker processes don't break the pool."""
+        with ProcessPoolExecutor(
+                max_workers=1,
+                mp_context=multiprocessing.get_context('spawn')) as executor:
+            failed = executor.submit(commands._in_worker, raise_not_found)
+            merged = executor.submit(commands._in_worker, sorted, [2, 1])
+            error = failed.exception()
+            self.assertEqual([1, 2], merged.result())
+        self.assertIsInstance(error, TarmacCommandError)
+        self.assertTrue(str(error).startswith('NotFound: HTTP Error 404'))
+
+    def set_up_landing(self, option):
+        """Set up two approved proposals, landed two at a time."""
+        self.addProposal('train')
+        self.proposals[1].reviewed_revid = \
+            self.branch2.bzr_branch.last_revision().decode('utf-8')
+        self.proposals[2].reviewed_revid = \
+            self.branches[2]._internal_bzr_branch.last_revision().decode(
+                'utf-8')
+        self.config.set(self.branches[1].bzr_identity, option, '2')
+
+    def test_run_train(self):
+        """Test that a merge train lands the proposals in order."""
+        self.set_up_landing('train_size')
+        self.command.run(launchpad=self.launchpad)
+        self.assertEqual(None, self.error)
+        history = list(self.branch1.bzr_branch.repository.iter_revisions(
+            [self.branch1.bzr_branch.last_revision()]))
+        revision = history[0][1]
+        self.assertEqual(self.proposals[2].web_link,
+                         revision.properties['merge_url'])
+        self.assertEqual(3, self.branch1.bzr_branch.revno())
+
+    def test_run_train_reverifies_after_failure(self):
+        """Test that proposals behind a failed one are verified again."""
+        self.set_up_landing('train_size')
+        verified = []
+        fire = commands.tarmac_hooks.fire
+
+        def fail_first(hook_name, *args, **kwargs):
+            if hook_name == 'tarmac_pre_commit':
+                target, source, proposal = args[1:]
+                verified.append(
+                    (proposal.web_link, len(target.tree.get_parent_ids())))
+                if proposal.proposal is self.proposals[1]:
+                    raise TarmacMergeError('Failed.')
+            return fire(hook_name, *args, **kwargs)
+
+        with patch('tarmac.bin.commands.tarmac_hooks.fire', fail_first):
+            self.command.run(launchpad=self.launchpad)
+        self.assertEqual('Failed.', self.error.comment)
+        self.assertEqual(
+            [(self.proposals[1].web_link, 2),
+             (self.proposals[2].web_link, 3),
+             (self.proposals[2].web_link, 2)],
+            sorted(verified[:2]) + verified[2:])
+        self.assertEqual(2, self.branch1.bzr_branch.revno())
+
+    def test_run_train_reverified_commit_message(self):
+        """Test that templates aren't applied twice to re-verified cars."""
+        self.set_up_landing('train_size')
+        self.config.set(self.branches[1].bzr_identity,
+                        'commit_message_template', '[r=x] <commit_message>')
+        cars = []
+
+        def fail_first(hook_name, *args, **kwargs):
+            if hook_name == 'tarmac_pre_commit':
+                command, target, source, proposal = args
+                cars.append((target, source))
+                CommitMessageTemplate().run(command, target, source, proposal)
+                if proposal.proposal is self.proposals[1]:
+                    raise TarmacMergeError('Failed.')
+
+        with patch('tarmac.bin.commands.tarmac_hooks.fire', fail_first):
+            self.command.run(launchpad=self.launchpad)
+        self.assertEqual('[r=x] Commitable.', self.landed_messages()[0])
+        self.assertEqual(2, self.branch1.bzr_branch.revno())
+        # Every car is verified with branch objects of its own.
+        self.assertEqual(3, len(cars))
+        for target, source in cars:
+            self.assertIs(target, source.target)
+        self.assertEqual(
+            3, len({id(target.bzr_branch) for target, _ in cars}))
+
+    def test_run_batch(self):
+        """Test that a batch is verified together and landed in order."""
+        self.set_up_landing('batch_size')
+        verified = []
+        fire = commands.tarmac_hooks.fire
+
+        def record(hook_name, *args, **kwargs):
+            if hook_name == 'tarmac_pre_commit':
+                target, source, proposal = args[1:]
+                verified.append(len(target.tree.get_parent_ids()))
+            return fire(hook_name, *args, **kwargs)
+
+        with patch('tarmac.bin.commands.tarmac_hooks.fire', record):
+            self.command.run(launchpad=self.launchpad)
+        self.assertEqual(None, self.error)
+        self.assertEqual([3, 3], verified)
+        history = list(self.branch1.bzr_branch.repository.iter_revisions(
+            [self.branch1.bzr_branch.last_revision()]))
+        revision = history[0][1]
+        self.assertEqual(self.proposals[2].web_link,
+                         revision.properties['merge_url'])
+        self.assertEqual(3, self.branch1.bzr_branch.revno())
+
+    def test_run_batch_bisects_failure(self):
+        """Test that only the failing proposal of a batch is reported."""
+        self.set_up_landing('batch_size')
+        verified = []
+        fire = commands.tarmac_hooks.fire
+
+        def fail_first(hook_name, *args, **kwargs):
+            if hook_name == 'tarmac_pre_commit':
+                target, source, proposal = args[1:]
+                verified.append(
+                    (proposal.web_link, len(target.tree.get_parent_ids())))
+                if proposal.proposal is self.proposals[1]:
+                    raise TarmacMergeError('Failed.')
+            return fire(hook_name, *args, **kwargs)
+
+        with patch('tarmac.bin.commands.tarmac_hooks.fire', fail_first):
+            self.command.run(launchpad=self.launchpad)
+        self.assertEqual('Failed.', self.error.comment)
+        self.assertEqual(
+            [(self.proposals[1].web_link, 3),
+             (self.proposals[1].web_link, 2),
+             (self.proposals[2].web_link, 2)],
+            verified)
+        self.assertEqual(2, self.branch1.bzr_branch.revno())
+
+    def test_run_records_failure_outcome(self):
+        """Test that the kind of failure and the target tip are recorded."""
+        self.set_up_landing('batch_size')
+        fire = commands.tarmac_hooks.fire
+
+        def conflict_first(hook_name, *args, **kwargs):
+            if hook_name == 'tarmac_pre_commit':
+                if args[-1].proposal is self.proposals[1]:
+                    raise BranchHasConflicts('Conflicts.')
+            return fire(hook_name, *args, **kwargs)
+
+        with patch('tarmac.bin.commands.tarmac_hooks.fire', conflict_first):
+            self.command.run(launchpad=self.launchpad)
+        entry = self.command.state.get(self.proposals[1])
+        self.assertEqual('conflicts', entry['outcome'])
+        entry = self.command.state.get(self.proposals[2])
+        self.assertEqual('landed', entry['outcome'])
+        self.assertEqual(
+            self.branch1.bzr_branch.last_revision().decode(),
+            entry['target_revid'])
+        stats = list(self.command.state.owner_stats().values())
+        self.assertEqual(2, sum(entry.attempts for entry in stats))
+        self.assertEqual(1, sum(entry.landed for entry in stats))
+
+    def fail_combined_with_template(self, hook_name, *args, **kwargs):
+        """Render the commit message template, and fail combined trees."""
+        if hook_name == 'tarmac_pre_commit':
+            command, target, source, proposal = args
+            CommitMessageTemplate().run(command, target, source, proposal)
+            if len(target.tree.get_parent_ids()) > 2:
+                raise TarmacMergeError('Failed together.')
+
+    def landed_messages(self):
+        """Return the messages of the revisions on trunk, newest first."""
+        branch = self.branch1.bzr_branch
+        with branch.lock_read():
+            graph = branch.repository.get_graph()
+            return [
+                branch.repository.get_revision(revid).message
+                for revid in graph.iter_lefthand_ancestry(
+                    branch.last_revision(), [b'null:'])]
+
+    def test_run_batch_reverified_commit_message(self):
+        """Test that templates aren't applied twice after bisecting."""
+        self.set_up_landing('batch_size')
+        self.config.set(self.branches[1].bzr_identity,
+                        'commit_message_template', '[r=x] <commit_message>')
+        with patch('tarmac.bin.commands.tarmac_hooks.fire',
+                   self.fail_combined_with_template):
+            self.command.run(launchpad=self.launchpad)
+        self.assertEqual(
+            ['[r=x] Commitable.', '[r=x] Commit this.'],
+            self.landed_messages()[:2])
+
     def test_get_reviews(self):
         """Test that the _get_reviews method gives the right lists."""
         self.assertEqual(self.command._get_reviews(self.proposals[0]),
@@ -461,6 +799,64 @@ class TestMergeCommand(BranchTestCase):
             [p.self_link
              for p in commands.sort_landing_candidates(self.proposals)])
 
+    def test_sort_proposals_order(self):
+        """The order only applies to proposals without prerequisites."""
+        self.addProposal("compare_proposals", self.branches[0])
+        ranks = {self.proposals[0].self_link: 1,
+                 self.proposals[1].self_link: 0,
+                 self.proposals[2].self_link: -1}
+        self.assertEqual(
+            [self.proposals[1].self_link, self.proposals[0].self_link,
+             self.proposals[2].self_link],
+            [p.self_link for p in commands.sort_landing_candidates(
+                self.proposals, lambda p: ranks[p.self_link])])
+
+    def test_run_replay_is_dry_run(self):
+        """Test that nothing is committed when replaying a recording."""
+        self.proposals[1].reviewed_revid = \
+            self.branch2.bzr_branch.last_revision().decode('utf-8')
+        revno = self.branch1.bzr_branch.revno()
+        with patch.object(Branch, 'commit') as commit:
+            self.command.run(launchpad=self.launchpad, replay='recording')
+        commit.assert_called_once_with(
+            'Commit this.', revprops=ANY, authors=ANY, dry_run=True,
+            reviews=ANY)
+        self.assertEqual(revno, self.branch1.bzr_branch.revno())
+
+    def test_run_pre_merge_check_failure(self):
+        """Proposals rejected by the checks aren't fetched or merged."""
+        self.proposals[1].reviewed_revid = \
+            self.branch2.bzr_branch.last_revision().decode('utf-8')
+        fire = commands.tarmac_hooks.fire
+
+        def reject(hook_name, *args, **kwargs):
+            if hook_name == 'tarmac_pre_merge_check':
+                raise TarmacMergeError('Rejected.')
+            return fire(hook_name, *args, **kwargs)
+
+        with patch('tarmac.bin.commands.tarmac_hooks.fire', reject), \
+                patch('tarmac.bin.commands.Branch.create',
+                      wraps=Branch.create) as create:
+            self.command.run(launchpad=self.launchpad)
+        self.assertEqual('Rejected.', self.error.comment)
+        self.assertEqual(
+            [self.branches[1]], [call.args[0] for call in create.mock_calls])
+
+    def test_run_prerequisite_cycle(self):
+        """Proposals whose prerequisites form a cycle fail to land."""
+        self.addProposal("cycle_a")
+        self.addProposal("cycle_b", self.branches[-1])
+        self.proposals[2].prerequisite_branch = self.branches[-1]
+        self.command.run(launchpad=self.launchpad)
+        self.assertIn('can not be landed', self.error.comment)
+
+    def test__get_landing_order_unknown(self):
+        """An unknown landing_order is an error."""
+        self.config.set(
+            self.branches[1].bzr_identity, 'landing_order', 'random')
+        self.assertRaises(TarmacCommandError,
+                          self.command._get_landing_order, self.branches[1])
+
     def test__get_mergable_proposals_for_branch_are_sorted(self):
         """
         Mergable proposals should be in sorted order (prereqs should come
@@ -487,6 +883,143 @@ class TestMergeCommand(BranchTestCase):
         self.assertEqual(len(proposals), 1)
         self.assertEqual(proposals[0].source_branch.name, "unmerged")
 
+    def test__get_mergable_proposals_for_branch_skips_unchanged(self):
+        """Proposals that weren't landable are skipped until they change."""
+        self.command._set_up(launchpad=self.launchpad)
+        self.proposals[0].date_last_modified = '2026-01-01 00:00:00'
+        self.command._get_mergable_proposals_for_branch(self.branches[1])
+        self.assertEqual(
+            'not-approved',
+            self.command.state.get(self.proposals[0])['outcome'])
+
+        with patch.object(self.command, '_get_prerequisite_proposals',
+                          wraps=self.command._get_prerequisite_proposals) \
+                as get_prerequisites:
+            proposals = self.command._get_mergable_proposals_for_branch(
+                self.branches[1])
+            self.assertEqual(
+                [self.proposals[1]], [p.proposal for p in proposals])
+            self.assertTrue(get_prerequisites.called)
+            for call_args in get_prerequisites.call_args_list:
+                self.assertIs(self.proposals[1], call_args[0][0].proposal)
+
+        self.proposals[0].date_last_modified = '2026-01-02 00:00:00'
+        self.proposals[0].queue_status = 'Approved'
+        proposals = self.command._get_mergable_proposals_for_branch(
+            self.branches[1])
+        self.assertEqual(2, len(proposals))
+
+    def test__get_mergable_proposals_for_branch_skips_failed(self):
+        """Failed proposals are skipped until they or the target change."""
+        self.command._set_up(launchpad=self.launchpad)
+        self.proposals[1].date_last_modified = '2026-01-01 00:00:00'
+        self.proposals[1].reviewed_revid = 'reviewed-1'
+        self.command.state.record(
+            self.proposals[1], 'conflicts', target_revid='tip-1')
+        self.command._target_revid = 'tip-1'
+        self.assertEqual(
+            [], self.command._get_mergable_proposals_for_branch(
+                self.branches[1]))
+
+        self.command._target_revid = 'tip-2'
+        self.assertEqual(
+            [self.proposals[1]],
+            [p.proposal for p in
+             self.command._get_mergable_proposals_for_branch(
+                 self.branches[1])])
+
+        self.command.state.record(
+            self.proposals[1], 'verify-failed', target_revid='tip-2')
+        self.proposals[1].reviewed_revid = 'reviewed-2'
+        self.assertEqual(
+            1, len(self.command._get_mergable_proposals_for_branch(
+                self.branches[1])))
+
+    def test_run_prerequisite_landed_in_same_run(self):
+        """Test that a proposal waiting for a prerequisite landed in the
+        same run is tried on the next run, before the target moves on."""
+        self.branches[0].landing_targets = [self.proposals[1]]
+        self.proposals[1].reviewed_revid = \
+            self.branch2.bzr_branch.last_revision().decode()
+        self.addProposal('dependent', self.branches[0])
+        dependent = self.proposals[2]
+        dependent.date_last_modified = '2026-01-01 00:00:00'
+        dependent.reviewed_revid = \
+            self.branches[2]._internal_bzr_branch.last_revision().decode()
+        self.command.run(launchpad=self.launchpad)
+        self.assertEqual(
+            'waiting-prerequisite',
+            self.command.state.get(dependent)['outcome'])
+        self.assertEqual(2, self.branch1.bzr_branch.revno())
+
+        # Launchpad has seen the prerequisite land by the next run.
+        self.proposals[1].queue_status = 'Merged'
+        self.branches[1].last_scanned_id = \
+            self.branch1.bzr_branch.last_revision().decode()
+        self.command.run(launchpad=self.launchpad)
+        self.assertEqual(
+            'landed', self.command.state.get(dependent)['outcome'])
+        self.assertEqual(3, self.branch1.bzr_branch.revno())
+
+    def test__get_mergable_proposals_for_branch_snapshots(self):
+        """Snapshots of the proposals are taken by a pool of threads."""
+        self.addProposal("prefetched", self.branches[0])
+        with patch.object(self.command, '_take_snapshot',
+                          wraps=self.command._take_snapshot) as take:
+            proposals = self.command._get_mergable_proposals_for_branch(
+                self.branches[1])
+            self.assertCountEqual(
+                self.proposals, [c[0][0] for c in take.call_args_list])
+        for proposal in proposals:
+            self.assertIsInstance(proposal, ProposalSnapshot)
+
+    def test__iter_mergable_proposals_lazy(self):
+        """Proposals are checked as they are asked for."""
+        self.config.set('Tarmac', 'prefetch_threads', '1')
+        self.addProposal("lazy", self.branches[0])
+        self.proposals[0].queue_status = 'Approved'
+        with patch.object(self.command, '_get_prerequisite_proposals',
+                          return_value=[]) as get_prerequisites:
+            proposals = self.command._iter_mergable_proposals(
+                self.branches[1])
+            first = next(proposals)
+            self.assertEqual(1, get_prerequisites.call_count)
+            self.assertIs(first, get_prerequisites.call_args[0][0])
+            self.assertEqual(2, len(list(proposals)))
+            self.assertEqual(3, get_prerequisites.call_count)
+
+    def test__prefetch_checks_failure(self):
+        """Failures to prefetch are left for the checks to report."""
+        snapshot = ProposalSnapshot(self.proposals[1])
+        with patch.object(self.command, '_get_prerequisite_proposals',
+                          side_effect=Exception('Launchpad is down')):
+            self.command._prefetch_checks(snapshot)
+
+    def test__take_snapshots_serial(self):
+        """No threads are used with prefetch_threads set to 1."""
+        self.config.set('Tarmac', 'prefetch_threads', '1')
+        with patch.object(self.command, '_take_snapshot') as take:
+            snapshots = self.command._take_snapshots(self.proposals)
+            self.assertFalse(take.called)
+        self.assertEqual(
+            self.proposals, [snapshot.proposal for snapshot in snapshots])
+
+    def test__report_api_stats(self):
+        """The API requests made are written to the cache directory."""
+        http = TarmacHttp(None, None, None, None, None, None)
+        self.command.launchpad = Thing(_browser=Thing(_connection=http))
+        with self.command._api_phase('discovery'):
+            http.stats.record(http.phase, 'branch', 100, 0.2)
+        self.assertEqual('setup', http.phase)
+        self.command._report_api_stats()
+        with open(os.path.join(
+                self.config.CACHE_HOME, commands.API_STATS_FILENAME)) as f:
+            [entry] = json.load(f)['requests']
+        self.assertEqual(('discovery', 'branch', 1),
+                         (entry['phase'], entry['resource'],
+                          entry['requests']))
+        self.assertEqual([], http.stats.summary())
+
     def test__get_prerequisite_proposals_no_prerequisites(self):
         """proposals[0] does not have a prerequisite branch listed"""
         proposals = self.command._get_prerequisite_proposals(self.proposals[0])
@@ -498,7 +1031,16 @@ class TestMergeCommand(BranchTestCase):
         proposals = self.command._get_prerequisite_proposals(self.proposals[2])
         self.assertEqual(len(proposals), 2)
 
-    @patch('tarmac.bin.commands.Launchpad.load')
+    def test__get_prerequisite_proposals_cached(self):
+        """The landing targets of a prerequisite are only fetched once."""
+        self.addProposal("one_prerequisite", self.branches[0])
+        self.command._get_prerequisite_proposals(self.proposals[2])
+        self.branches[0].landing_targets = []
+        proposals = self.command._get_prerequisite_proposals(self.proposals[2])
+        self.assertEqual(len(proposals), 2)
+        self.assertEqual(3, self.command._round_trips_saved)
+
+    @patch('tarmac.bin.commands.TarmacLaunchpad.load')
     def test__get_proposal_from_mp_url(self, mocked):
         """Test that the URL is substituted correctly."""
         self.command.launchpad = MagicMock()
@@ -508,7 +1050,7 @@ class TestMergeCommand(BranchTestCase):
         mocked.assert_called_once_with(
             'https://api.launchpad.net/1.0/~foo/bar/baz/+merge/10')
 
-    @patch('tarmac.bin.commands.Launchpad.load')
+    @patch('tarmac.bin.commands.TarmacLaunchpad.load')
     def test__get_proposal_from_mp_url_with_api_url(self, mocked):
         """Test that the URL is ignored correctly."""
         self.command.launchpad = MagicMock()
@@ -529,7 +1071,10 @@ class TestMergeCommand(BranchTestCase):
         self.command.run(launchpad=self.launchpad)
         self.launchpad.load.assert_called_once_with(
             self.proposals[1].self_link)
-        self.command._get_reviews.assert_called_once_with(self.proposals[1])
+        self.assertEqual(1, self.command._get_reviews.call_count)
+        self.assertIs(
+            self.proposals[1],
+            self.command._get_reviews.call_args[0][0].proposal)
 
     def test_run_merge_with_specific_proposal_with_branch_url(self):
         """Test that a specific proposal is merged, with the others ignored."""
@@ -543,4 +1088,7 @@ class TestMergeCommand(BranchTestCase):
                          branch_url=self.branches[1].bzr_identity)
         self.launchpad.load.assert_called_once_with(
             self.proposals[1].self_link)
-        self.command._get_reviews.assert_called_once_with(self.proposals[1])
+        self.assertEqual(1, self.command._get_reviews.call_count)
+        self.assertIs(
+            self.proposals[1],
+            self.command._get_reviews.call_args[0][0].proposal)
@@ -0,0 +1,121 @@
+'''Tests for tarmac.tests.fakelaunchpad'''
+from io import StringIO
+import json
+import os
+from unittest.mock import patch
+
+from lazr.restfulclient.errors import ServerError
+
+from tarmac.bin import commands
+from tarmac.bin.registry import CommandRegistry
+from tarmac.tests import TarmacTestCase
+from tarmac.tests.fakelaunchpad import (
+    FakeLaunchpad,
+    FakeLaunchpadServer,
+    WEB_ROOT,
+    write_credentials,
+)
+
+
+class TestFakeLaunchpadServer(TarmacTestCase):
+    '''Tests for running Tarmac against a FakeLaunchpadServer.'''
+
+    def setUp(self):
+        super(TestFakeLaunchpadServer, self).setUp()
+        self.launchpad = FakeLaunchpad()
+        self.launchpad.add_person('reviewer')
+        self.trunk = self.launchpad.add_branch('~owner/project/trunk')
+        self.approved = self.launchpad.add_proposal(
+            self.launchpad.add_branch('~owner/project/approved'), self.trunk,
+            reviewed_revid='revision-1', votes=[('reviewer', 'Approve')])
+        self.pending = self.launchpad.add_proposal(
+            self.launchpad.add_branch('~owner/project/pending'), self.trunk,
+            queue_status='Needs review')
+        self.server = FakeLaunchpadServer(self.launchpad)
+        self.server.start()
+        self.addCleanup(self.server.stop)
+
+        os.remove(self.config.CREDENTIALS)
+        write_credentials(self.config.CREDENTIALS)
+        os.environ['TARMAC_SERVICE_ROOT'] = self.server.service_root
+        self.addCleanup(os.environ.pop, 'TARMAC_SERVICE_ROOT')
+        self.config.add_section('lp:~owner/project/trunk')
+
+    def get_command(self, name, command_class):
+        registry = CommandRegistry(config=self.config)
+        registry.register_command(name, command_class)
+        return registry._get_command(command_class, name)
+
+    def test_get_launchpad_object(self):
+        command = self.get_command('merge', commands.cmd_merge)
+        launchpad = command.get_launchpad_object()
+        self.assertEqual('tarmac', launchpad.me.name)
+        branch = launchpad.branches.getByUrl(url='lp:~owner/project/trunk')
+        [proposal] = [
+            proposal for proposal in branch.landing_candidates
+            if proposal.queue_status == 'Approved']
+        self.assertEqual(
+            '~owner/project/approved', proposal.source_branch.unique_name)
+        self.assertEqual(['Reviewer;Approve'], command._get_reviews(proposal))
+        proposal.setStatus(status='Needs review')
+        self.assertEqual(
+            'Needs review', self.launchpad.entries[self.approved][
+                'queue_status'])
+
+    def test_wadl_cached(self):
+        command = self.get_command('merge', commands.cmd_merge)
+        command.get_launchpad_object()
+        requests = self.server.request_count
+        launchpad = command.get_launchpad_object()
+        # Only the root is fetched again.
+        self.assertEqual(requests * 2 - 1, self.server.request_count)
+        self.assertEqual('tarmac', launchpad.me.name)
+
+    def test_get_busy_targets(self):
+        self.launchpad.add_branch('~owner/project/idle')
+        self.launchpad.add_branch('~owner/other/idle')
+        command = self.get_command('merge', commands.cmd_merge)
+        command._set_up()
+        requests = self.server.request_count
+        self.assertEqual(
+            ['lp:~owner/project/trunk', 'lp:project'],
+            command._get_busy_targets([
+                'lp:~owner/project/trunk', 'lp:~owner/project/idle',
+                'lp:~owner/other/idle', 'lp:project']))
+        # A lookup and a search for each project.
+        self.assertEqual(4, self.server.request_count - requests)
+
+    def test_plan(self):
+        with patch('sys.stdout', new_callable=StringIO) as stdout:
+            self.get_command('plan', commands.cmd_plan).run()
+        plan = json.loads(stdout.getvalue())
+        [target] = plan['targets']
+        self.assertEqual([WEB_ROOT + self.approved], target['landing'])
+        self.assertEqual(
+            [{'proposal': WEB_ROOT + self.pending,
+              'reason': 'not-approved'}],
+            target['skipped'])
+        self.assertEqual(self.server.request_count, plan['api_calls'])
+
+    def test_replay(self):
+        record = os.path.join(self.tempdir, 'recording')
+        with patch('sys.stdout', new_callable=StringIO) as stdout:
+            self.get_command('plan', commands.cmd_plan).run(record=record)
+        recorded = json.loads(stdout.getvalue())
+
+        # Nothing is asked of Launchpad when replaying.
+        self.server.failure_rate = 1
+        self.launchpad.entries[self.approved]['queue_status'] = 'Merged'
+        with patch('sys.stdout', new_callable=StringIO) as stdout:
+            self.get_command('plan', commands.cmd_plan).run(replay=record)
+        replayed = json.loads(stdout.getvalue())
+        self.assertEqual(recorded['targets'], replayed['targets'])
+        self.assertEqual(0, replayed['api_calls'])
+
+    def test_failures(self):
+        self.server.failure_rate = 1
+        command = self.get_command('merge', commands.cmd_merge)
+        with patch('tarmac.transport.time.sleep') as sleep:
+            self.assertRaises(ServerError, command.get_launchpad_object)
+        self.assertEqual(4, sleep.call_count)
+        self.assertEqual(5, self.server.request_count)
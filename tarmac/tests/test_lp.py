@@ -0,0 +1,251 @@
+'''Tests for tarmac.lp'''
+import os
+import socket
+import threading
+import time
+
+import httplib2
+from lazr.restfulclient.errors import ServerError
+from unittest.mock import MagicMock
+from tarmac.exceptions import LaunchpadUnavailable
+from tarmac.lp import (
+    CachedLaunchpad,
+    Identity,
+    ProposalSnapshot,
+    TTLStore,
+    WriteQueue,
+    branch_unique_name,
+    cached,
+)
+from tarmac.tests import TarmacTestCase, Thing
+
+
+class TestBranchUniqueName(TarmacTestCase):
+    '''Tests for tarmac.lp.branch_unique_name.'''
+
+    def test_branch_unique_name(self):
+        for url, expected in [
+                ('lp:~owner/project/trunk', '~owner/project/trunk'),
+                ('https://api.launchpad.net/devel/~owner/project/trunk',
+                 '~owner/project/trunk'),
+                ('lp:project', None),
+                ('lp:project/series', None),
+                ('https://api.launchpad.net/devel/~owner', None),
+                ]:
+            self.assertEqual(expected, branch_unique_name(url))
+
+
+class TestTTLStore(TarmacTestCase):
+    '''Tests for tarmac.lp.TTLStore.'''
+
+    def setUp(self):
+        super(TestTTLStore, self).setUp()
+        self.path = os.path.join(self.config.CACHE_HOME, 'store.json')
+        self.store = TTLStore(self.path)
+
+    def test_set(self):
+        self.assertIs(None, self.store.get('key'))
+        self.store.set('key', ['value'], 60)
+        self.assertEqual(['value'], self.store.get('key'))
+        self.assertEqual(['value'], TTLStore(self.path).get('key'))
+
+    def test_expired(self):
+        self.store.set('key', 'value', -1)
+        self.assertIs(None, self.store.get('key'))
+        self.store.set('other', 'value', 60)
+        self.assertEqual(['other'], list(TTLStore(self.path)._load()))
+
+
+class TestCachedLaunchpad(TarmacTestCase):
+    '''Tests for tarmac.lp.CachedLaunchpad.'''
+
+    def setUp(self):
+        super(TestCachedLaunchpad, self).setUp()
+        self.person = Thing(self_link='https://api/~person', name='person')
+        self.people = MagicMock()
+        self.people.__getitem__.return_value = self.person
+        self.people.getByEmail.return_value = self.person
+        self.root = Thing(
+            people=self.people,
+            me=Thing(name='tarmac', display_name='Tarmac'),
+            load=MagicMock(return_value=self.person),
+            version='devel')
+        self.store = TTLStore(
+            os.path.join(self.config.CACHE_HOME, 'launchpad.json'))
+        self.launchpad = CachedLaunchpad(self.root, store=self.store)
+
+    def test_passes_through(self):
+        self.assertEqual('devel', self.launchpad.version)
+
+    def test_collection_lookups(self):
+        self.assertIs(self.person, self.launchpad.people['person'])
+        self.assertIs(self.person, self.launchpad.people['person'])
+        self.assertEqual(1, self.people.__getitem__.call_count)
+        for _ in range(2):
+            self.assertIs(
+                self.person,
+                self.launchpad.people.getByEmail(email='person@example.com'))
+        self.people.getByEmail.assert_called_once_with(
+            email='person@example.com')
+
+    def test_load(self):
+        self.launchpad.people['person']
+        self.assertIs(self.person, self.launchpad.load('https://api/~person'))
+        self.assertEqual(0, self.root.load.call_count)
+        self.launchpad.load('https://api/devel/~person')
+        self.launchpad.load('https://api/devel/~person')
+        self.assertEqual(1, self.root.load.call_count)
+
+    def test_reset(self):
+        self.launchpad.people['person']
+        self.launchpad.reset()
+        self.launchpad.people['person']
+        self.assertEqual(2, self.people.__getitem__.call_count)
+
+    def test_members(self):
+        team = Thing(self_link='https://api/~team', members=[self.person])
+        self.assertEqual([self.person], self.launchpad.members(team))
+        team.members = []
+        self.assertEqual([self.person], self.launchpad.members(team))
+
+    def test_me(self):
+        self.assertEqual(Identity('tarmac', 'Tarmac'), self.launchpad.me)
+        self.root.me = None
+        launchpad = CachedLaunchpad(self.root, store=self.store)
+        self.assertEqual(Identity('tarmac', 'Tarmac'), launchpad.me)
+
+    def test_me_expired(self):
+        key = self.launchpad._identity_key()
+        self.store.set(key, ['old', 'Old'], -1)
+        self.assertEqual('tarmac', self.launchpad.me.name)
+        self.assertLess(time.time(), self.store._load()[key][0])
+
+    def test_me_per_login(self):
+        '''The identity is kept for each service root and token.'''
+        self.root._root_uri = 'https://api.launchpad.net/devel/'
+        self.root.credentials = Thing(access_token=Thing(key='token'))
+        self.assertEqual('tarmac', self.launchpad.me.name)
+        self.root.me = Thing(name='other', display_name='Other')
+        self.root.credentials.access_token.key = 'other-token'
+        launchpad = CachedLaunchpad(self.root, store=self.store)
+        self.assertEqual('other', launchpad.me.name)
+        self.root._root_uri = 'https://api.staging.launchpad.net/devel/'
+        self.root.me = Thing(name='staging', display_name='Staging')
+        launchpad = CachedLaunchpad(self.root, store=self.store)
+        self.assertEqual('staging', launchpad.me.name)
+        self.root.credentials.access_token.key = 'token'
+        self.root._root_uri = 'https://api.launchpad.net/devel/'
+        launchpad = CachedLaunchpad(self.root, store=self.store)
+        self.assertEqual('tarmac', launchpad.me.name)
+
+    def test_cached(self):
+        self.assertIs(self.launchpad, cached(self.launchpad))
+        self.assertIsInstance(cached(self.root), CachedLaunchpad)
+
+
+class TestProposalSnapshot(TarmacTestCase):
+    '''Tests for tarmac.lp.ProposalSnapshot.'''
+
+    def setUp(self):
+        super(TestProposalSnapshot, self).setUp()
+        self.source = Thing(
+            unique_name='~person/project/source', web_link='https://source',
+            display_name='lp:~person/project/source',
+            owner=Thing(name='person'))
+        self.proposal = Thing(
+            self_link='https://api/proposal', web_link='https://proposal',
+            queue_status='Approved', commit_message='Message.',
+            source_branch=self.source, setStatus=MagicMock())
+        self.snapshot = ProposalSnapshot(self.proposal)
+
+    def test_attributes(self):
+        self.assertEqual('https://proposal', self.snapshot.web_link)
+        self.assertEqual('Approved', self.snapshot.queue_status)
+        self.assertIs(None, self.snapshot.prerequisite_branch)
+        self.assertEqual(
+            '~person/project/source', self.snapshot.source_branch.unique_name)
+        self.source.unique_name = '~person/project/renamed'
+        self.assertEqual(
+            '~person/project/source', self.snapshot.source_branch.unique_name)
+
+    def test_passes_through(self):
+        self.assertEqual('person', self.snapshot.source_branch.owner.name)
+        self.snapshot.setStatus(status='Needs review')
+        self.proposal.setStatus.assert_called_once_with(status='Needs review')
+        self.assertRaises(AttributeError, getattr, self.snapshot, 'votes')
+
+    def test_writes(self):
+        self.snapshot.commit_message = 'Rendered.'
+        self.assertEqual('Rendered.', self.proposal.commit_message)
+        self.assertEqual('Rendered.', self.snapshot.commit_message)
+        self.assertRaises(
+            AttributeError, setattr, self.snapshot, 'queue_status', 'Merged')
+
+    def test_from_proposal(self):
+        self.assertIs(
+            self.snapshot, ProposalSnapshot.from_proposal(self.snapshot))
+        snapshot = ProposalSnapshot.from_proposal(self.proposal)
+        self.assertIs(self.proposal, snapshot.proposal)
+
+
+class TestWriteQueue(TarmacTestCase):
+    '''Tests for tarmac.lp.WriteQueue.'''
+
+    def setUp(self):
+        super(TestWriteQueue, self).setUp()
+        self.queue = WriteQueue(threads=4, delay=0)
+        self.written = []
+
+    def write(self, name, started=None):
+        if started is not None:
+            started.wait(5)
+        self.written.append(name)
+
+    def test_in_order_for_key(self):
+        started = threading.Event()
+        self.queue.put('a', 'first', self.write, 'a1', started)
+        self.queue.put('a', 'second', self.write, 'a2')
+        self.queue.put('b', 'other', self.write, 'b1')
+        # The change for b doesn't wait for the ones for a.
+        while not self.written:
+            time.sleep(0.01)
+        self.assertEqual(['b1'], self.written)
+        started.set()
+        self.assertEqual([], self.queue.flush())
+        self.assertEqual(['b1', 'a1', 'a2'], self.written)
+
+    def test_retried(self):
+        write = MagicMock(side_effect=[LaunchpadUnavailable('Down'), None])
+        self.queue.put('a', 'write', write, status='Merged')
+        self.assertEqual([], self.queue.flush())
+        self.assertEqual(2, write.call_count)
+        write.assert_called_with(status='Merged')
+
+    def test_not_retried_once_sent(self):
+        for error in [
+                ServerError(httplib2.Response({'status': '503'}), b''),
+                socket.timeout(), ConnectionResetError()]:
+            write = MagicMock(side_effect=[error, None])
+            self.queue.put('a', 'post a comment', write)
+            self.assertEqual([('post a comment', error)], self.queue.flush())
+            self.assertEqual(1, write.call_count)
+
+    def test_retried_refused(self):
+        write = MagicMock(side_effect=[ConnectionRefusedError(), None])
+        self.queue.put('a', 'write', write)
+        self.assertEqual([], self.queue.flush())
+        self.assertEqual(2, write.call_count)
+
+    def test_failures(self):
+        error = ValueError('Bad status')
+        write = MagicMock(side_effect=error)
+        self.queue.put('a', 'set the status', write)
+        self.queue.put('a', 'write', self.write, 'a2')
+        self.assertEqual([('set the status', error)], self.queue.flush())
+        self.assertEqual(1, write.call_count)
+        self.assertEqual(['a2'], self.written)
+
+    def test_no_threads(self):
+        queue = WriteQueue(threads=0)
+        queue.put('a', 'write', self.write, 'a1')
+        self.assertEqual(['a1'], self.written)
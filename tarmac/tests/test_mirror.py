@@ -0,0 +1,71 @@
+'''Tests for tarmac.mirror'''
+import os
+
+from breezy.controldir import ControlDir
+
+from tarmac.mirror import MirrorStore
+from tarmac.tests import TarmacTestCase
+
+
+class TestMirrorStore(TarmacTestCase):
+    '''Tests for keeping mirrors of branches in shared repositories.'''
+
+    def setUp(self):
+        super(TestMirrorStore, self).setUp()
+        self.store = MirrorStore(os.path.join(self.tempdir, 'mirrors'))
+        self.tree = ControlDir.create_standalone_workingtree(
+            os.path.join(self.tempdir, 'remote'))
+        self.tree.commit('First')
+
+    def test_mirror(self):
+        mirror = self.store.mirror(self.tree.branch, '~owner/project/name')
+        self.assertEqual(
+            os.path.join(self.store.directory, 'project', '~owner', 'name'),
+            mirror.controldir.root_transport.local_abspath('.').rstrip('/'))
+        self.assertEqual(
+            self.tree.branch.last_revision(), mirror.last_revision())
+        self.assertTrue(mirror.repository.is_shared())
+        self.assertFalse(mirror.controldir.has_workingtree())
+
+    def test_mirror_shares_repository(self):
+        mirror = self.store.mirror(self.tree.branch, '~owner/project/name')
+        other = self.store.mirror(self.tree.branch, '~other/project/name')
+        self.assertEqual(
+            mirror.repository.user_url, other.repository.user_url)
+        elsewhere = self.store.mirror(self.tree.branch, '~owner/other/name')
+        self.assertNotEqual(
+            mirror.repository.user_url, elsewhere.repository.user_url)
+
+    def test_mirror_pulls(self):
+        self.store.mirror(self.tree.branch, '~owner/project/name')
+        revid = self.tree.commit('Second')
+        mirror = self.store.mirror(self.tree.branch, '~owner/project/name')
+        self.assertEqual(revid, mirror.last_revision())
+
+    def test_mirror_overwritten(self):
+        self.store.mirror(self.tree.branch, '~owner/project/name')
+        self.tree.commit('Second')
+        other = ControlDir.create_standalone_workingtree(
+            os.path.join(self.tempdir, 'other'))
+        revid = other.commit('Unrelated')
+        mirror = self.store.mirror(other.branch, '~owner/project/name')
+        self.assertEqual(revid, mirror.last_revision())
+
+    def test_bound_branch(self):
+        mirror = self.store.mirror(self.tree.branch, '~owner/project/name')
+        bound = self.store.bound_branch(
+            self.tree.branch, '~owner/project/name')
+        self.assertEqual(self.tree.branch.base, bound.get_bound_location())
+        self.assertEqual(
+            mirror.repository.user_url, bound.repository.user_url)
+        checkout = bound.create_checkout(
+            os.path.join(self.tempdir, 'checkout'), lightweight=True)
+        revid = checkout.commit('Landed')
+        self.assertEqual(revid, self.tree.branch.last_revision())
+
+    def test_bound_branch_updated(self):
+        self.store.bound_branch(self.tree.branch, '~owner/project/name')
+        revid = self.tree.commit('Second')
+        bound = self.store.bound_branch(
+            self.tree.branch, '~owner/project/name')
+        self.assertEqual(revid, bound.last_revision())
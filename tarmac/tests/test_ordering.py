@@ -0,0 +1,102 @@
+'''Tests for tarmac.ordering'''
+from tarmac.ordering import LandingGraph, landing_orders, proposal_owner
+from tarmac.state import OwnerStats
+from tarmac.tests import TarmacTestCase, Thing
+
+
+def make_proposal(owner):
+    return Thing(source_branch=Thing(unique_name='~%s/project/branch' % owner))
+
+
+class TestLandingOrders(TarmacTestCase):
+    '''Tests for the landing order policies.'''
+
+    stats = {
+        'slow': OwnerStats(attempts=4, landed=4, mean_duration=600.0),
+        'quick': OwnerStats(attempts=4, landed=1, mean_duration=60.0),
+        }
+
+    def sort(self, name, owners):
+        key = landing_orders.get(name)(self.stats)
+        return [proposal_owner(proposal) for proposal in sorted(
+            [make_proposal(owner) for owner in owners], key=key)]
+
+    def test_proposal_owner(self):
+        self.assertEqual('user', proposal_owner(make_proposal('user')))
+
+    def test_fifo(self):
+        self.assertEqual(['slow', 'new', 'quick'],
+                         self.sort('fifo', ['slow', 'new', 'quick']))
+
+    def test_shortest_first(self):
+        self.assertEqual(['quick', 'new', 'slow'],
+                         self.sort('shortest-first', ['slow', 'new', 'quick']))
+
+    def test_likely_first(self):
+        self.assertEqual(['slow', 'new', 'quick'],
+                         self.sort('likely-first', ['quick', 'new', 'slow']))
+
+
+def make_chain_proposal(name, prerequisite=None):
+    return Thing(
+        source_branch=Thing(unique_name=name),
+        prerequisite_branch=(
+            Thing(unique_name=prerequisite) if prerequisite else None))
+
+
+class TestLandingGraph(TarmacTestCase):
+    '''Tests for tarmac.ordering.LandingGraph.'''
+
+    def names(self, proposals):
+        return [proposal.source_branch.unique_name for proposal in proposals]
+
+    def test_sorted(self):
+        graph = LandingGraph([
+            make_chain_proposal('c', 'b'),
+            make_chain_proposal('x', 'elsewhere'),
+            make_chain_proposal('b', 'a'),
+            make_chain_proposal('a')])
+        self.assertEqual(['x', 'a', 'b', 'c'], self.names(graph.sorted()))
+        self.assertEqual(2, graph.depth(graph.proposals[0]))
+
+    def test_sorted_long_chain(self):
+        proposals = [make_chain_proposal('0')] + [
+            make_chain_proposal(str(i), str(i - 1)) for i in range(1, 5000)]
+        graph = LandingGraph(reversed(proposals))
+        self.assertEqual(self.names(proposals), self.names(graph.sorted()))
+
+    def test_sorted_order(self):
+        graph = LandingGraph([
+            make_chain_proposal('z'),
+            make_chain_proposal('b', 'a'),
+            make_chain_proposal('a'),
+            make_chain_proposal('y', 'z'),
+            make_chain_proposal('c')])
+        self.assertEqual(['z', 'a', 'c', 'b', 'y'],
+                         self.names(graph.sorted()))
+        self.assertEqual(
+            ['a', 'c', 'z', 'b', 'y'],
+            self.names(graph.sorted(
+                lambda proposal: proposal.source_branch.unique_name)))
+
+    def test_chains(self):
+        graph = LandingGraph([
+            make_chain_proposal('b', 'a'),
+            make_chain_proposal('y', 'x'),
+            make_chain_proposal('a'),
+            make_chain_proposal('x')])
+        self.assertEqual([['a', 'b'], ['x', 'y']],
+                         sorted(self.names(chain) for chain in graph.chains()))
+
+    def test_cycle(self):
+        graph = LandingGraph([
+            make_chain_proposal('behind', 'b'),
+            make_chain_proposal('b', 'a'),
+            make_chain_proposal('a', 'b'),
+            make_chain_proposal('free')])
+        self.assertEqual([False, False, False, True],
+                         [not graph.in_cycle(p) for p in graph.proposals])
+        self.assertIs(None, graph.depth(graph.proposals[0]))
+        self.assertEqual('free', self.names(graph.sorted())[0])
+        self.assertEqual([['free']],
+                         [self.names(chain) for chain in graph.chains()])
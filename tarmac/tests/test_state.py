@@ -0,0 +1,128 @@
+'''Tests for tarmac.state'''
+import os
+
+from tarmac.state import LandingState, OwnerStats
+from tarmac.tests import TarmacTestCase, Thing
+
+
+class TestLandingState(TarmacTestCase):
+    '''Tests for tarmac.state.LandingState.'''
+
+    def setUp(self):
+        super(TestLandingState, self).setUp()
+        self.state = LandingState.from_config(self.config)
+        self.addCleanup(self.state.close)
+        self.proposal = Thing(
+            self_link='https://api.launchpad.net/1.0/proposal',
+            date_last_modified='2026-01-01 00:00:00',
+            queue_status='Needs review',
+            reviewed_revid=None)
+
+    def test_from_config(self):
+        '''The state is kept in the cache dir.'''
+        self.assertEqual(
+            os.path.join(self.config.CACHE_HOME, 'landing-state.sqlite'),
+            self.state.path)
+
+    def test_record(self):
+        '''The last recorded outcome is kept.'''
+        self.assertIs(None, self.state.get(self.proposal))
+        self.state.record(self.proposal, 'failed', target_revid='rev-1')
+        self.state.record(self.proposal, 'landed', duration=2.5)
+        entry = self.state.get(self.proposal)
+        self.assertEqual('landed', entry['outcome'])
+        self.assertEqual(2.5, entry['duration'])
+        self.assertIs(None, entry['target_revid'])
+
+    def test_record_persists(self):
+        '''Outcomes are kept between runs.'''
+        self.state.record(self.proposal, 'not-approved')
+        state = LandingState.from_config(self.config)
+        self.addCleanup(state.close)
+        self.assertEqual('not-approved', state.get(self.proposal)['outcome'])
+
+    def test_unchanged_outcome(self):
+        '''Stable outcomes are returned until the proposal changes.'''
+        self.state.record(self.proposal, 'not-approved')
+        self.assertEqual('not-approved',
+                         self.state.unchanged_outcome(self.proposal))
+        self.proposal.date_last_modified = '2026-01-02 00:00:00'
+        self.assertIs(None, self.state.unchanged_outcome(self.proposal))
+
+    def test_unchanged_outcome_unstable(self):
+        '''Outcomes that depend on more than the proposal are not returned.'''
+        self.state.record(self.proposal, 'failed', target_revid='rev-1')
+        self.assertIs(None, self.state.unchanged_outcome(
+            self.proposal, target_revid='rev-1'))
+
+    def test_unchanged_outcome_target(self):
+        '''Conflicts are returned until the proposal or target change.'''
+        self.proposal.queue_status = 'Approved'
+        self.proposal.reviewed_revid = 'reviewed-1'
+        self.state.record(self.proposal, 'conflicts', target_revid='rev-1')
+        self.assertEqual('conflicts', self.state.unchanged_outcome(
+            self.proposal, target_revid='rev-1'))
+        self.assertIs(None, self.state.unchanged_outcome(
+            self.proposal, target_revid='rev-2'))
+        self.assertIs(None, self.state.unchanged_outcome(self.proposal))
+        self.proposal.reviewed_revid = 'reviewed-2'
+        self.assertIs(None, self.state.unchanged_outcome(
+            self.proposal, target_revid='rev-1'))
+
+    def test_unchanged_outcome_reapproved(self):
+        '''Failures are tried again once the proposal is approved again.'''
+        self.proposal.queue_status = 'Approved'
+        self.proposal.reviewed_revid = 'reviewed-1'
+        self.state.record(
+            self.proposal, 'verify-failed', target_revid='rev-1')
+        self.proposal.queue_status = 'Needs review'
+        self.proposal.date_last_modified = '2026-01-02 00:00:00'
+        self.assertIs(None, self.state.unchanged_outcome(
+            self.proposal, target_revid='rev-1'))
+        self.proposal.queue_status = 'Approved'
+        self.proposal.date_last_modified = '2026-01-03 00:00:00'
+        self.assertIs(None, self.state.unchanged_outcome(
+            self.proposal, target_revid='rev-1'))
+
+    def test_unchanged_outcome_target_unreviewed(self):
+        '''Proposals without a reviewed revision are never skipped.'''
+        self.state.record(self.proposal, 'conflicts', target_revid='rev-1')
+        self.assertIs(None, self.state.unchanged_outcome(
+            self.proposal, target_revid='rev-1'))
+
+    def test_unchanged_outcome_waiting(self):
+        '''Proposals waiting for a prerequisite are always checked again.'''
+        self.proposal.reviewed_revid = 'reviewed-1'
+        self.state.record(
+            self.proposal, 'waiting-prerequisite', target_revid='rev-1')
+        self.assertIs(None, self.state.unchanged_outcome(
+            self.proposal, target_revid='rev-1'))
+
+    def test_batch(self):
+        '''Records made in a batch are written together at its end.'''
+        state = LandingState.from_config(self.config)
+        self.addCleanup(state.close)
+        with self.state.batch():
+            self.state.record(self.proposal, 'failed')
+            self.state.record_attempt('user', 'failed')
+            with self.state.batch():
+                self.state.record(self.proposal, 'landed')
+            self.assertIs(None, state.get(self.proposal))
+        self.assertEqual('landed', state.get(self.proposal)['outcome'])
+        self.assertEqual(1, state.owner_stats()['user'].attempts)
+
+    def test_unchanged_outcome_without_date(self):
+        '''Proposals without a modification date are never skipped.'''
+        self.proposal.date_last_modified = None
+        self.state.record(self.proposal, 'not-approved')
+        self.assertIs(None, self.state.unchanged_outcome(self.proposal))
+
+    def test_owner_stats(self):
+        '''Landing attempts are summarised per owner.'''
+        self.state.record_attempt('user', 'landed', duration=10.0)
+        self.state.record_attempt('user', 'failed', duration=30.0)
+        self.state.record_attempt('other', 'failed')
+        self.assertEqual(
+            {'user': OwnerStats(attempts=2, landed=1, mean_duration=20.0),
+             'other': OwnerStats(attempts=1, landed=0, mean_duration=None)},
+            self.state.owner_stats())
@@ -0,0 +1,55 @@
+'''Tests for tarmac.traffic'''
+import os
+
+import httplib2
+
+from tarmac.exceptions import ReplayError
+from tarmac.tests import TarmacTestCase
+from tarmac.traffic import TrafficRecorder, TrafficReplayer
+
+
+class TestTraffic(TarmacTestCase):
+    '''Tests for recording and replaying Launchpad API traffic.'''
+
+    def setUp(self):
+        super(TestTraffic, self).setUp()
+        self.directory = os.path.join(self.tempdir, 'recording')
+
+    def record(self, *contents):
+        recorder = TrafficRecorder(
+            self.directory, service_root='https://api.launchpad.net/')
+        for content in contents:
+            recorder.record(
+                'GET', 'https://api/~person', None, 'application/json',
+                httplib2.Response({'status': '200'}), content)
+        recorder.record(
+            'POST', 'https://api/~person', b'ws.op=join', 'application/json',
+            httplib2.Response({'status': '400'}), b'Bad request')
+        recorder.close()
+
+    def test_replay(self):
+        self.record(b'{"name": "old"}', b'{"name": "new"}')
+        replayer = TrafficReplayer(self.directory)
+        self.assertEqual('https://api.launchpad.net/', replayer.service_root)
+        for expected in [b'{"name": "old"}', b'{"name": "new"}',
+                         b'{"name": "new"}']:
+            response, content = replayer.replay(
+                'GET', 'https://api/~person', None, 'application/json')
+            self.assertEqual(200, response.status)
+            self.assertEqual(expected, content)
+        response, content = replayer.replay(
+            'POST', 'https://api/~person', 'ws.op=join', 'application/json')
+        self.assertEqual((400, b'Bad request'), (response.status, content))
+
+    def test_replay_not_recorded(self):
+        self.record(b'{}')
+        replayer = TrafficReplayer(self.directory)
+        self.assertRaises(
+            ReplayError, replayer.replay,
+            'GET', 'https://api/~other', None, 'application/json')
+        self.assertRaises(
+            ReplayError, replayer.replay,
+            'GET', 'https://api/~person', None, 'application/xhtml+xml')
+
+    def test_not_a_recording(self):
+        self.assertRaises(ReplayError, TrafficReplayer, self.tempdir)
@@ -0,0 +1,244 @@
+'''Tests for tarmac.transport'''
+import errno
+import os
+import socket
+from time import time
+from unittest.mock import patch
+
+import httplib2
+from lazr.restfulclient.errors import ClientError, ServerError
+
+from tarmac.exceptions import LaunchpadUnavailable
+from tarmac.tests import TarmacTestCase, Thing
+from tarmac.transport import (
+    ApiStats,
+    CircuitBreaker,
+    TarmacHttp,
+    WadlCache,
+    is_unavailable,
+    resource_type,
+    retry_delay,
+)
+
+
+class TestResourceType(TarmacTestCase):
+    '''Tests for tarmac.transport.resource_type.'''
+
+    def test_resource_type(self):
+        root = 'https://api.launchpad.net/devel/'
+        for uri, expected in [
+                ('', 'root'),
+                ('~person', 'person'),
+                ('~person/project/branch', 'branch'),
+                ('~person/project/branch/landing_candidates',
+                 'landing_candidates'),
+                ('~person/project/branch/+merge/1', 'merge_proposal'),
+                ('~person/project/branch/+merge/1/votes', 'votes'),
+                ('~person/project/branch/+merge/1?ws.op=setStatus',
+                 'merge_proposal.setStatus'),
+                ('branches?ws.op=getByUrl&url=lp%3Abranch',
+                 'branches.getByUrl'),
+                ('bugs/1', 'bug'),
+                ('project', 'project'),
+                ]:
+            self.assertEqual(expected, resource_type(root + uri))
+
+    def test_resource_type_wadl(self):
+        self.assertEqual('wadl', resource_type(
+            'https://api.launchpad.net/devel/',
+            'application/vnd.sun.wadl+xml'))
+
+
+class TestRetries(TarmacTestCase):
+    '''Tests for the retry policy of tarmac.transport.'''
+
+    def test_retry_delay(self):
+        for attempt in range(10):
+            self.assertTrue(0 <= retry_delay(attempt) <= min(30, 2 ** attempt))
+        self.assertEqual(7, retry_delay(
+            0, httplib2.Response({'retry-after': '7'}), delay=0))
+        self.assertEqual(30, retry_delay(
+            0, httplib2.Response({'retry-after': '3600'}), delay=0))
+
+    def test_is_unavailable(self):
+        self.assertTrue(is_unavailable(LaunchpadUnavailable('Down')))
+        self.assertTrue(is_unavailable(ConnectionResetError()))
+        self.assertTrue(is_unavailable(
+            ServerError(httplib2.Response({'status': '503'}), b'')))
+        self.assertFalse(is_unavailable(
+            ClientError(httplib2.Response({'status': '404'}), b'')))
+        self.assertFalse(is_unavailable(ValueError()))
+        self.assertTrue(is_unavailable(socket.timeout()))
+        self.assertTrue(is_unavailable(httplib2.ServerNotFoundError()))
+        self.assertFalse(is_unavailable(OSError(errno.ENOSPC, 'Disk full')))
+        self.assertFalse(is_unavailable(PermissionError()))
+        self.assertFalse(is_unavailable(FileNotFoundError()))
+
+    def test_circuit_breaker(self):
+        breaker = CircuitBreaker(threshold=2, cooldown=60)
+        breaker.failure()
+        breaker.check()
+        breaker.failure()
+        self.assertRaises(LaunchpadUnavailable, breaker.check)
+        with patch('tarmac.transport.time.time', return_value=time() + 61):
+            # One request is let through after the cooldown.
+            breaker.check()
+            self.assertRaises(LaunchpadUnavailable, breaker.check)
+        breaker.success()
+        breaker.check()
+
+
+class TestWadlCache(TarmacTestCase):
+    '''Tests for tarmac.transport.WadlCache.'''
+
+    def test_get(self):
+        cache = WadlCache(os.path.join(self.tempdir, 'wadl'), ttl=60)
+        self.assertIs(None, cache.get('https://api/devel/'))
+        cache.set('https://api/devel/', b'<application/>')
+        self.assertEqual(b'<application/>', cache.get('https://api/devel/'))
+        self.assertIs(None, cache.get('https://api/1.0/'))
+        with patch('tarmac.transport.time.time', return_value=time() + 61):
+            self.assertIs(None, cache.get('https://api/devel/'))
+
+
+class TestApiStats(TarmacTestCase):
+    '''Tests for tarmac.transport.ApiStats.'''
+
+    def test_record(self):
+        stats = ApiStats()
+        stats.record('discovery', 'branch', 100, 0.2)
+        stats.record('discovery', 'branch', 100, 20)
+        stats.record('discovery', 'branch', 100)
+        stats.record('plugins', 'person', 10, 0.01)
+        summary = stats.summary()
+        self.assertEqual(
+            ['discovery', 'plugins'], [entry['phase'] for entry in summary])
+        self.assertEqual(3, summary[0]['requests'])
+        self.assertEqual(1, summary[0]['cache_hits'])
+        self.assertEqual(300, summary[0]['bytes'])
+        self.assertEqual([0, 1, 0, 0, 0, 0, 0, 1], summary[0]['latency'])
+
+    def test_add(self):
+        stats = ApiStats()
+        stats.record('discovery', 'branch', 100, 0.2)
+        other = ApiStats()
+        other.add(stats.summary())
+        other.add(stats.summary())
+        self.assertEqual(2, other.summary()[0]['requests'])
+        self.assertEqual(
+            [0, 2, 0, 0, 0, 0, 0, 0], other.summary()[0]['latency'])
+        other.reset()
+        self.assertEqual([], other.summary())
+
+
+class TestTarmacHttp(TarmacTestCase):
+    '''Tests for tarmac.transport.TarmacHttp.'''
+
+    def setUp(self):
+        super(TestTarmacHttp, self).setUp()
+        self.http = TarmacHttp(None, None, None, None, None, None)
+        self.http.retry_delay = 0
+        patcher = patch.object(
+            httplib2.Http, 'request',
+            return_value=(Thing(status=200), b'{}'))
+        self.request = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_request_not_remembered(self):
+        self.http.request('https://api/~person')
+        self.http.request('https://api/~person')
+        self.assertEqual(2, self.request.call_count)
+
+    def test_request_remembered(self):
+        self.http.remember_responses()
+        for _ in range(2):
+            self.assertEqual(
+                b'{}', self.http.request('https://api/~person')[1])
+        self.assertEqual(1, self.request.call_count)
+        self.http.request(
+            'https://api/~person', headers={'Accept': 'application/xhtml'})
+        self.assertEqual(2, self.request.call_count)
+
+    def test_request_forgotten_on_change(self):
+        self.http.remember_responses()
+        self.http.request('https://api/~person')
+        self.http.request('https://api/~person', method='PATCH', body='{}')
+        self.http.request('https://api/~person')
+        self.assertEqual(3, self.request.call_count)
+
+    def test_request_stats(self):
+        self.http.remember_responses()
+        self.http.phase = 'discovery'
+        self.http.request('https://api/devel/~person')
+        self.http.request('https://api/devel/~person')
+        [entry] = self.http.stats.summary()
+        self.assertEqual(
+            ('discovery', 'person', 2, 1),
+            (entry['phase'], entry['resource'], entry['requests'],
+             entry['cache_hits']))
+
+    def test_request_failure_not_remembered(self):
+        self.request.return_value = (Thing(status=404), b'')
+        self.http.remember_responses()
+        self.http.request('https://api/~person')
+        self.http.request('https://api/~person')
+        self.assertEqual(2, self.request.call_count)
+
+    def test_request_retried(self):
+        self.request.side_effect = [
+            (Thing(status=503), b''), ConnectionResetError(),
+            (Thing(status=200), b'{}')]
+        response, content = self.http.request('https://api/devel/~person')
+        self.assertEqual((200, b'{}'), (response.status, content))
+        self.assertEqual(3, self.request.call_count)
+        [entry] = self.http.stats.summary()
+        self.assertEqual((1, 2), (entry['requests'], entry['retries']))
+
+    def test_request_retries_exhausted(self):
+        self.request.return_value = (Thing(status=502), b'')
+        self.assertEqual(
+            502, self.http.request('https://api/~person')[0].status)
+        self.assertEqual(5, self.request.call_count)
+        self.request.side_effect = ConnectionResetError()
+        self.assertRaises(
+            ConnectionResetError, self.http.request, 'https://api/~person')
+
+    def test_request_change_not_retried(self):
+        self.request.return_value = (Thing(status=503), b'')
+        self.http.request('https://api/~person', method='POST', body='')
+        self.assertEqual(1, self.request.call_count)
+
+    def test_request_breaker(self):
+        self.http.retries = 0
+        self.request.return_value = (Thing(status=503), b'')
+        for _ in range(5):
+            self.http.request('https://api/~person')
+        self.assertRaises(
+            LaunchpadUnavailable, self.http.request, 'https://api/~person')
+        self.assertEqual(5, self.request.call_count)
+
+    def test_request_wadl_cache(self):
+        self.http.wadl_cache = WadlCache(self.tempdir)
+        self.request.return_value = (Thing(status=200), b'<application/>')
+        for _ in range(2):
+            response, content = self.http.request(
+                'https://api/devel/',
+                headers={'Accept': 'application/vnd.sun.wadl+xml'})
+            self.assertEqual((200, b'<application/>'),
+                             (response.status, content))
+        self.assertEqual(1, self.request.call_count)
+        [entry] = self.http.stats.summary()
+        self.assertEqual(('wadl', 1), (entry['resource'], entry['cache_hits']))
+
+    def test_pooled_connections(self):
+        def request(http, *args, **kwargs):
+            connections.append(http.connections)
+            http.connections['https:api'] = object()
+            return Thing(status=200), b'{}'
+
+        connections = []
+        with patch.object(httplib2.Http, 'request', request):
+            self.http.request('https://api/~person')
+            self.http.request('https://api/~team')
+        self.assertIs(connections[0], connections[1])
+        self.assertEqual({}, self.http.connections)
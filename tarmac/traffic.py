@@ -0,0 +1,115 @@
+# Copyright 2026 Tarmac Developers
+#
+# This file is part of Tarmac.
+#
+# Tarmac is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by
+# the Free Software Foundation.
+#
+# Tarmac is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Tarmac.  If not, see <http://www.gnu.org/licenses/>.
+
+'''Recording of Launchpad API traffic, and replaying it without a network.
+
+A recording is a directory holding the service root that was used, and the
+requests and responses of every process of the run, one JSON document per
+line.  Requests are matched by method, URI, media type and body, so the
+OAuth signatures, which change every time, don't matter.
+'''
+import base64
+import glob
+import json
+import os
+import threading
+from collections import deque
+
+import httplib2
+
+from tarmac.exceptions import ReplayError
+
+# The files in a recording.
+SERVICE_ROOT_FILENAME = 'service-root.json'
+TRAFFIC_PATTERN = 'traffic-*.jsonl'
+
+
+def _key(method, uri, body, accept):
+    if isinstance(body, bytes):
+        body = body.decode('utf-8', 'replace')
+    return (method, str(uri), accept or '', body or '')
+
+
+class TrafficRecorder:
+    '''Writes the Launchpad API traffic of this process to a recording.'''
+
+    def __init__(self, directory, service_root=None):
+        self.directory = directory
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        if service_root is not None:
+            with open(os.path.join(
+                    directory, SERVICE_ROOT_FILENAME), 'w') as f:
+                json.dump({'service_root': service_root}, f)
+        self._lock = threading.Lock()
+        self._file = open(os.path.join(
+            directory, TRAFFIC_PATTERN.replace('*', str(os.getpid()))), 'a')
+
+    def record(self, method, uri, body, accept, response, content):
+        '''Record the %response to a request.'''
+        line = json.dumps({
+            'request': _key(method, uri, body, accept),
+            'headers': dict(response),
+            'content': base64.b64encode(content or b'').decode('ascii'),
+            })
+        with self._lock:
+            self._file.write(line + '\n')
+            self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class TrafficReplayer:
+    '''Answers Launchpad API requests from a recording.
+
+    Responses to the same request are given in the order they were recorded
+    in, and the last one is given again once they run out, so that a run
+    that makes more requests than the one recorded still works.
+    '''
+
+    def __init__(self, directory):
+        self.directory = directory
+        try:
+            with open(os.path.join(directory, SERVICE_ROOT_FILENAME)) as f:
+                self.service_root = json.load(f)['service_root']
+        except (OSError, ValueError, KeyError):
+            raise ReplayError(
+                '%s is not a recording of Launchpad traffic.' % directory)
+        self._lock = threading.Lock()
+        self._responses = {}
+        for path in sorted(glob.glob(os.path.join(
+                directory, TRAFFIC_PATTERN))):
+            with open(path) as f:
+                for line in f:
+                    entry = json.loads(line)
+                    self._responses.setdefault(
+                        tuple(entry['request']), deque()).append(
+                            (entry['headers'], entry['content']))
+
+    def replay(self, method, uri, body, accept):
+        '''Return the recorded response and content for a request.'''
+        with self._lock:
+            responses = self._responses.get(_key(method, uri, body, accept))
+            if not responses:
+                raise ReplayError(
+                    'No response to %s %s was recorded.' % (method, uri))
+            if len(responses) > 1:
+                headers, content = responses.popleft()
+            else:
+                headers, content = responses[0]
+        return httplib2.Response(headers), base64.b64decode(content)
@@ -0,0 +1,537 @@
+# Copyright 2026 Tarmac Developers
+#
+# This file is part of Tarmac.
+#
+# Tarmac is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License version 3 as
+# published by
+# the Free Software Foundation.
+#
+# Tarmac is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Tarmac.  If not, see <http://www.gnu.org/licenses/>.
+
+'''HTTP transport for the Launchpad API.'''
+import bisect
+import hashlib
+import logging
+import os
+import random
+import socket
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import parse_qs, urlsplit
+
+import httplib2
+from launchpadlib.launchpad import Launchpad, LaunchpadOAuthAwareHttp
+from lazr.restfulclient.errors import HTTPError
+from lazr.restfulclient.resource import ServiceRoot
+
+from tarmac.exceptions import LaunchpadUnavailable
+from tarmac.traffic import TrafficRecorder, TrafficReplayer
+
+# Upper bounds, in seconds, of the buckets of the latency histograms.  The
+# last bucket holds anything slower.
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Versions of the web service, which are left out of the resource types.
+API_VERSIONS = frozenset(['1.0', 'beta', 'devel'])
+
+# Top-level collections, as they appear in the path of a URI.
+COLLECTIONS = frozenset(['branches', 'bugs', 'people', 'projects'])
+
+# Requests that can be sent again without changing anything on Launchpad.
+IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD'])
+
+# Statuses of responses from a Launchpad that is overloaded or throttling,
+# after which a request is worth trying again.
+RETRY_STATUSES = frozenset([429, 500, 502, 503, 504])
+
+# How many times a failed read is tried again, and the longest time, in
+# seconds, waited before the first and the last of those tries.
+RETRIES = 4
+RETRY_DELAY = 1
+MAX_RETRY_DELAY = 30
+
+# How many requests in a row have to fail before no more are sent, and for
+# how many seconds.
+BREAKER_THRESHOLD = 5
+BREAKER_COOLDOWN = 300
+
+# How many sets of idle connections are kept open for the next requests.
+POOL_SIZE = 8
+
+# The media type of the service description, and the number of seconds a
+# copy kept on disk is used for before it is fetched again.
+WADL_TYPE = 'application/vnd.sun.wadl+xml'
+WADL_TTL = 60 * 60 * 24
+
+
+def resource_type(uri, accept=None):
+    """Return a short name for the type of Launchpad resource at %uri.
+
+    Named operations are named after the resource they are called on, for
+    instance ``branches.getByUrl``.
+    """
+    if accept is not None and 'wadl' in accept:
+        return 'wadl'
+    parts = urlsplit(uri)
+    segments = [segment for segment in parts.path.split('/') if segment]
+    if segments and segments[0] in API_VERSIONS:
+        segments = segments[1:]
+
+    if not segments:
+        name = 'root'
+    elif '+merge' in segments:
+        index = segments.index('+merge')
+        if len(segments) > index + 2:
+            name = segments[-1]
+        else:
+            name = 'merge_proposal'
+    elif segments[0].startswith('~'):
+        if len(segments) == 1:
+            name = 'person'
+        elif len(segments) == 3:
+            name = 'branch'
+        else:
+            name = segments[-1]
+    elif segments[0] in COLLECTIONS:
+        if len(segments) == 1:
+            name = segments[0]
+        elif len(segments) == 2:
+            name = segments[0].rstrip('s')
+        else:
+            name = segments[-1]
+    elif len(segments) == 1:
+        name = 'project'
+    else:
+        name = segments[-1]
+
+    operation = parse_qs(parts.query).get('ws.op')
+    if operation:
+        name = '%s.%s' % (name, operation[0])
+    return name
+
+
+# The errors of failing to connect to Launchpad, or to get an answer.
+CONNECTION_ERRORS = (
+    ConnectionError, socket.timeout, httplib2.ServerNotFoundError)
+
+
+def is_unavailable(error):
+    """Return whether %error means Launchpad was down or overloaded.
+
+    Of the OSErrors, only failures to connect or to get an answer count,
+    so that errors such as a full disk aren't mistaken for an outage.
+    """
+    if isinstance(error, (LaunchpadUnavailable,) + CONNECTION_ERRORS):
+        return True
+    response = getattr(error, 'response', None)
+    return (isinstance(error, HTTPError) and
+            getattr(response, 'status', None) in RETRY_STATUSES)
+
+
+def was_not_sent(error):
+    """Return whether %error means the request never reached Launchpad.
+
+    Only such requests can safely be sent again when they change something:
+    the circuit breaker was open, or no connection could be made.
+    """
+    return isinstance(error, (
+        LaunchpadUnavailable, ConnectionRefusedError,
+        httplib2.ServerNotFoundError))
+
+
+def retry_delay(attempt, response=None, delay=RETRY_DELAY):
+    """Return how long to wait before trying a request again.
+
+    The delay is picked at random up to a limit that doubles with every
+    %attempt, so that threads and processes retrying at the same time spread
+    out, but it is never shorter than the Retry-After header of %response.
+    """
+    delay = random.uniform(0, min(MAX_RETRY_DELAY, delay * 2 ** attempt))
+    try:
+        retry_after = float(response['retry-after'])
+    except (KeyError, TypeError, ValueError):
+        return delay
+    return max(delay, min(MAX_RETRY_DELAY, retry_after))
+
+
+class CircuitBreaker:
+    """Stops requests to Launchpad for a while once it seems to be down.
+
+    Once %threshold requests in a row have failed, even after being tried
+    again, requests fail with LaunchpadUnavailable without being sent for
+    %cooldown seconds.  Then a single request is let through, to see whether
+    Launchpad is back.
+    """
+
+    def __init__(self, threshold=BREAKER_THRESHOLD,
+                 cooldown=BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened = None
+
+    def check(self):
+        """Raise LaunchpadUnavailable if no request should be sent."""
+        with self._lock:
+            if self._opened is None:
+                return
+            remaining = self._opened + self.cooldown - time.time()
+            if remaining > 0:
+                raise LaunchpadUnavailable(
+                    'Launchpad API requests keep failing, not trying again '
+                    'for %d seconds.' % remaining)
+            # Let this request through, but no others until it succeeds.
+            self._opened = time.time()
+
+    def success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened = None
+
+    def failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._failures >= self.threshold:
+                self._opened = time.time()
+
+
+class WadlCache:
+    """Copies of the service descriptions of the Launchpad API, on disk.
+
+    A copy is used for %ttl seconds after it was last fetched.  Checking it
+    only takes a stat() of the file.
+    """
+
+    def __init__(self, directory, ttl=WADL_TTL):
+        self.directory = directory
+        self.ttl = ttl
+
+    def _path(self, uri):
+        digest = hashlib.sha1(str(uri).encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, 'wadl-%s.xml' % digest[:16])
+
+    def get(self, uri):
+        """Return the description at %uri, or None if it is stale."""
+        path = self._path(uri)
+        try:
+            if os.stat(path).st_mtime + self.ttl < time.time():
+                return None
+            with open(path, 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def set(self, uri, content):
+        """Keep %content as the description at %uri."""
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            fd, temp_path = tempfile.mkstemp(dir=self.directory)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(content)
+            os.replace(temp_path, self._path(uri))
+        except OSError:
+            # Fetching the description again next time does no harm.
+            pass
+
+
+class ApiStats:
+    """Counts of the Launchpad API requests made, by phase and resource.
+
+    Requests answered without going to Launchpad are counted as cache hits,
+    and left out of the latency histograms.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Forget the requests counted so far."""
+        with self._lock:
+            self._entries = {}
+
+    def _entry(self, phase, resource):
+        try:
+            return self._entries[(phase, resource)]
+        except KeyError:
+            entry = {
+                'phase': phase,
+                'resource': resource,
+                'requests': 0,
+                'cache_hits': 0,
+                'bytes': 0,
+                'seconds': 0.0,
+                'retries': 0,
+                'latency': [0] * (len(LATENCY_BUCKETS) + 1),
+                }
+            self._entries[(phase, resource)] = entry
+            return entry
+
+    def record(self, phase, resource, size, seconds=None, retries=0):
+        """Count a request for a %resource in %phase.
+
+        %seconds is how long Launchpad took to answer, including any
+        %retries, or None if the response came from a cache.
+        """
+        with self._lock:
+            entry = self._entry(phase, resource)
+            entry['requests'] += 1
+            entry['bytes'] += size
+            entry['retries'] += retries
+            if seconds is None:
+                entry['cache_hits'] += 1
+            else:
+                entry['seconds'] += seconds
+                entry['latency'][
+                    bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+
+    def add(self, summary):
+        """Add the counts in %summary, as returned by summary()."""
+        with self._lock:
+            for other in summary:
+                entry = self._entry(other['phase'], other['resource'])
+                for name in ('requests', 'cache_hits', 'bytes', 'seconds'):
+                    entry[name] += other[name]
+                entry['retries'] += other.get('retries', 0)
+                entry['latency'] = [
+                    count + other_count for count, other_count in zip(
+                        entry['latency'], other['latency'])]
+
+    def summary(self):
+        """Return the counts, as a list of dicts sorted by phase."""
+        with self._lock:
+            return [
+                dict(entry, latency=list(entry['latency']))
+                for _, entry in sorted(self._entries.items())]
+
+
+class TarmacHttp(LaunchpadOAuthAwareHttp):
+    """An HTTP client for the Launchpad API that threads can share.
+
+    httplib2 keeps a single connection per host, which can't be used by two
+    threads at once, so every request is sent over a set of connections
+    taken from a pool, and put back afterwards to be kept alive for the next
+    request of any thread.  The number of requests sent is kept in
+    request_count.
+
+    Reads that fail because Launchpad is down, overloaded or throttling are
+    tried again up to %retries times, after a random delay that grows with
+    every try.  Requests that change something are sent once.  Once
+    requests keep failing, the breaker stops them from being sent at all for
+    a while.
+
+    Once remember_responses is called, successful GET responses are kept
+    until the next request that isn't a GET, so that resources fetched ahead
+    by other threads aren't fetched again.
+
+    Every request is counted in stats, under the phase of the run that the
+    thread making it is in.  With a TrafficRecorder as %traffic, requests
+    and responses are also recorded; with a TrafficReplayer, responses come
+    from the recording instead of Launchpad.  With a WadlCache as
+    %wadl_cache, the service description is read from there while it's
+    fresh.
+    """
+
+    def __init__(self, *args, traffic=None, wadl_cache=None):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._idle = []
+        self._responses = None
+        self.request_count = 0
+        self.retries = RETRIES
+        self.retry_delay = RETRY_DELAY
+        self.breaker = CircuitBreaker()
+        self.stats = ApiStats()
+        self.traffic = traffic
+        self.wadl_cache = wadl_cache
+        self.logger = logging.getLogger('tarmac')
+        super(TarmacHttp, self).__init__(*args)
+
+    def remember_responses(self):
+        """Start keeping GET responses, forgetting the ones kept so far."""
+        with self._lock:
+            self._responses = {}
+
+    def request(self, uri, method='GET', body=None, headers=None,
+                *args, **kwargs):
+        accept = (headers or {}).get('Accept')
+        resource = resource_type(uri, accept)
+        wadl = (self.wadl_cache is not None and resource == 'wadl' and
+                method == 'GET')
+        if wadl:
+            content = self.wadl_cache.get(uri)
+            if content is not None:
+                self.stats.record(self.phase, resource, len(content))
+                return httplib2.Response(
+                    {'status': '200', 'content-type': WADL_TYPE}), content
+        remember = self._responses is not None and method == 'GET'
+        if self._responses is not None and not remember:
+            with self._lock:
+                self._responses.clear()
+        if remember:
+            try:
+                response, content = self._responses[(uri, accept)]
+            except KeyError:
+                pass
+            else:
+                self.stats.record(self.phase, resource, len(content or b''))
+                return response, content
+
+        started = time.time()
+        retries = self.retries if method in IDEMPOTENT_METHODS else 0
+        self.breaker.check()
+        for attempt in range(retries + 1):
+            try:
+                response, content = self._send(
+                    uri, method, body, headers, accept, *args, **kwargs)
+            except CONNECTION_ERRORS as error:
+                if attempt == retries:
+                    self.breaker.failure()
+                    raise
+                self.logger.debug(
+                    'Retrying %s %s after error: %s', method, uri, error)
+                response = None
+            else:
+                if (response.status not in RETRY_STATUSES or
+                        attempt == retries):
+                    break
+                self.logger.debug(
+                    'Retrying %s %s after status %d', method, uri,
+                    response.status)
+            time.sleep(retry_delay(attempt, response, self.retry_delay))
+        if response.status in RETRY_STATUSES:
+            self.breaker.failure()
+        else:
+            self.breaker.success()
+
+        seconds = time.time() - started
+        if getattr(response, 'fromcache', False):
+            seconds = None
+        self.stats.record(
+            self.phase, resource, len(content or b''), seconds, attempt)
+        if remember and response.status == 200:
+            with self._lock:
+                self._responses[(uri, accept)] = (response, content)
+        if wadl and response.status == 200:
+            self.wadl_cache.set(uri, content)
+        return response, content
+
+    def _send(self, uri, method, body, headers, accept, *args, **kwargs):
+        """Send a request once, or answer it from the replayed traffic."""
+        if isinstance(self.traffic, TrafficReplayer):
+            return self.traffic.replay(method, uri, body, accept)
+        with self._pooled_connections():
+            response, content = super(TarmacHttp, self).request(
+                uri, method, body, headers, *args, **kwargs)
+        if isinstance(self.traffic, TrafficRecorder):
+            self.traffic.record(method, uri, body, accept, response, content)
+        return response, content
+
+    def _request(self, *args):
+        with self._lock:
+            self.request_count += 1
+        return super(TarmacHttp, self)._request(*args)
+
+    @contextmanager
+    def _pooled_connections(self):
+        """Use a set of connections from the pool in this thread."""
+        if getattr(self._local, 'pooled', False):
+            # A redirect being followed, over the same connections.
+            yield
+            return
+        with self._lock:
+            self._local.connections = self._idle.pop() if self._idle else {}
+        self._local.pooled = True
+        try:
+            yield
+        finally:
+            self._local.pooled = False
+            connections, self._local.connections = self._local.connections, {}
+            with self._lock:
+                if len(self._idle) < POOL_SIZE:
+                    self._idle.append(connections)
+                    connections = {}
+            for connection in connections.values():
+                connection.close()
+
+    def close(self):
+        """Close the pooled connections, as well as this thread's."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for connections in idle:
+            for connection in connections.values():
+                connection.close()
+        return super(TarmacHttp, self).close()
+
+    @property
+    def phase(self):
+        return getattr(self._local, 'phase', 'setup')
+
+    @phase.setter
+    def phase(self, value):
+        self._local.phase = value
+
+    @property
+    def connections(self):
+        try:
+            return self._local.connections
+        except AttributeError:
+            self._local.connections = {}
+            return self._local.connections
+
+    @connections.setter
+    def connections(self, value):
+        self._local.connections = value
+
+
+class _ServiceRoot(ServiceRoot):
+    """A ServiceRoot that leaves trying requests again to TarmacHttp."""
+
+    def __init__(self, *args, **kwargs):
+        kwargs['max_retries'] = 0
+        super(_ServiceRoot, self).__init__(*args, **kwargs)
+
+
+class TarmacLaunchpad(Launchpad, _ServiceRoot):
+    """The Launchpad API root, using Tarmac's HTTP transport."""
+
+    # The TrafficRecorder or TrafficReplayer of the transport, if any.
+    traffic = None
+    # The WadlCache the service description is kept in, if any.
+    wadl_cache = None
+
+    @classmethod
+    def using(cls, traffic=None, wadl_cache=None):
+        """Return a TarmacLaunchpad class whose transport uses %traffic and
+        %wadl_cache.
+
+        The transport is made while the root is being set up, so these can't
+        be passed to login_with.
+        """
+        return type(cls.__name__, (cls,), {
+            'traffic': traffic, 'wadl_cache': wadl_cache})
+
+    def httpFactory(self, credentials, cache, timeout, proxy_info):
+        return TarmacHttp(
+            self, self.authorization_engine, credentials, cache, timeout,
+            proxy_info, traffic=self.traffic, wadl_cache=self.wadl_cache)
+
+
+def get_http(launchpad):
+    """Return the TarmacHttp used by %launchpad, or None if it has none."""
+    browser = getattr(launchpad, '_browser', None)
+    http = getattr(browser, '_connection', None)
+    if not isinstance(http, TarmacHttp):
+        return None
+    return http